@@ -0,0 +1,86 @@
+"""
+ANN Benchmark
+Recall and latency of the approximate similar-player index against the exact ranking
+
+Usage:
+> python ann_benchmark.py [../data/cleaned_data.csv] [--queries 200] [--n 4] [--list-size 256] [--n-probe 1 2 4 8 16] [--min-size 0]
+The exact ranking is the one of SimilarityEngine, identical to scoring every
+candidate name once with sim_pearson(). For each knob setting the script prints the index
+build time, the mean recall@n over random query players, and the mean query
+latency of both engines.
+"""
+
+import os
+import sys
+import time
+import argparse
+import collections
+import numpy  as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from similarity import SimilarityEngine, cols_GK, cols_nGK
+from player_store import PlayerStore
+from ann_index import ApproximateSimilarityEngine
+from data_loader import load_cleaned_data
+
+#############################################################
+def timed_queries(engine, queries, n):
+    """
+    Run most_similar() for every query, return the results and the mean latency in ms
+    """
+    start   = time.perf_counter()
+    results = [engine.most_similar(name, n) for name in queries]
+    return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+def recall(exact, approximate):
+    """
+    Fraction of the exact (score, name) results found by the approximate search
+    """
+    found = sum(sum((collections.Counter(e) & collections.Counter(a)).values()) for e, a in zip(exact, approximate))
+    total = sum(len(e) for e in exact)
+    return float(found) / total if total else 1.0
+
+#############################################################
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the benchmark
+    """
+    parser = argparse.ArgumentParser(
+        description='Recall and latency of the approximate similar-player index',
+        epilog='Example: python ann_benchmark.py ../data/cleaned_data.csv --n-probe 2 8')
+    parser.add_argument('data_filepath', nargs='?', default='../data/cleaned_data.csv',
+                        help='cleaned csv file written by process_data.py')
+    parser.add_argument('--queries',   type=int, default=200, help='number of random query players')
+    parser.add_argument('--n',         type=int, default=4,   help='number of similar players per query')
+    parser.add_argument('--list-size', type=int, nargs='+', default=[256], help='average candidates per list')
+    parser.add_argument('--n-probe',   type=int, nargs='+', default=[1, 2, 4, 8, 16], help='lists scored per query')
+    parser.add_argument('--min-size',  type=int, default=0,   help='smallest position indexed, see FIFA19_ANN_MIN_SIZE')
+    parser.add_argument('--seed',      type=int, default=0,   help='seed of the query sampling and of the index')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+
+    data  = load_cleaned_data(args.data_filepath, ['ID', 'Name', 'Position', 'Overall'] + cols_nGK + cols_GK)
+    store = PlayerStore.from_frame(data)
+    rng   = np.random.RandomState(args.seed)
+    queries = store.names[rng.choice(len(store), min(args.queries, len(store)), replace=False)].tolist()
+    print('{} players, {} queries, n={}'.format(len(store), len(queries), args.n))
+
+    exact, exact_ms = timed_queries(SimilarityEngine(store), queries, args.n)
+    print('exact: {:.3f} ms/query'.format(exact_ms))
+
+    print('{:>9} {:>7} {:>9} {:>8} {:>9} {:>8}'.format('list_size', 'n_probe', 'build_s', 'recall', 'ms/query', 'speedup'))
+    for list_size in args.list_size:
+        start  = time.perf_counter()
+        engine = ApproximateSimilarityEngine(store, list_size=list_size, min_size=args.min_size, seed=args.seed)
+        build  = time.perf_counter() - start
+        for n_probe in args.n_probe:
+            engine.n_probe = n_probe
+            approximate, ms = timed_queries(engine, queries, args.n)
+            print('{:>9} {:>7} {:>9.2f} {:>8.3f} {:>9.3f} {:>7.1f}x'.format(
+                list_size, n_probe, build, recall(exact, approximate), ms, exact_ms / ms))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+Approximate Nearest-Neighbour Index
+Sub-linear similar-player search for datasets too large for the exhaustive scan
+
+The Pearson correlation of two ability vectors is the cosine of the two vectors
+once each is centred on its own mean. The index clusters the centred, unit
+length vectors of every position bucket with a spherical k-means (an inverted
+file index): a query only scores the candidates of the n_probe lists whose
+centroids are the closest to it, instead of the whole bucket.
+
+Within a list the candidates are sorted by Overall, so the 80% Overall rule of
+most_similar() is a prefix of each probed list. Probed candidates are scored
+with SimilarityEngine.pearson_scores(), so the scores returned are exactly the
+sim_pearson() scores; only candidates living in lists that were not probed can
+be missed.
+
+Knobs:
+    list_size - average number of candidates per list, the cost of probing one list
+    n_probe   - number of lists scored per query, trades latency for recall
+    min_size  - buckets smaller than this are searched exhaustively, like the buckets
+                whose ability vectors are all constant
+
+A bucket of B candidates has about B / list_size lists, and the index only
+scores fewer candidates than the exhaustive scan when n_probe is below that
+number: with the defaults (list_size 256, min_size 1024), the buckets of 1024
+candidates or more are indexed, and a query with n_probe 2 scores about half
+of a 1024 candidates bucket.
+"""
+
+import numpy  as np
+
+from similarity import SimilarityEngine
+
+#############################################################
+def unit_centred(features):
+    """
+    Centre each ability vector on its own mean and scale it to unit length.
+    Constant vectors, whose Pearson score is always 0, are returned as zeros.
+    """
+    centred = features - features.mean(axis=1, keepdims=True)
+    norm    = np.sqrt((centred * centred).sum(axis=1, keepdims=True))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        unit = centred / norm
+    unit[~np.isfinite(unit).all(axis=1)] = 0
+    return unit
+
+def spherical_kmeans(vectors, n_lists, iterations=10, seed=0, block=65536):
+    """
+    Cluster unit vectors by cosine similarity
+
+    Arguments:
+        vectors    - unit vectors, one per row
+        n_lists    - number of clusters
+        iterations - number of assignment/update rounds
+        seed       - seed of the initial centroids sampling
+        block      - rows assigned at a time, bounds the memory of the assignment
+    Outputs:
+        centroids  - unit centroid of each cluster
+        labels     - cluster of each vector
+    """
+    rng       = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)]
+    labels    = np.zeros(len(vectors), dtype=np.int64)
+
+    for _ in range(iterations):
+        for start in range(0, len(vectors), block):
+            labels[start:start+block] = np.argmax(vectors[start:start+block] @ centroids.T, axis=1)
+
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors)
+        norm  = np.sqrt((sums * sums).sum(axis=1, keepdims=True))
+        empty = norm[:, 0] == 0
+        centroids[~empty] = sums[~empty] / norm[~empty]
+
+    return centroids, labels
+
+#############################################################
+class InvertedFileBucket(object):
+    """
+    Inverted file index of the candidates of one position bucket
+
+    Parameter:
+    bucket:    PositionBucket of the player matrix
+    list_size: average number of candidates per list
+    seed:      seed of the k-means initialization
+    """
+    def __init__(self, bucket, list_size, seed=0):
+        unit  = unit_centred(np.asarray(bucket.features))
+        valid = np.flatnonzero(unit.any(axis=1))
+
+        n_lists = max(1, min(len(valid), int(np.ceil(len(valid) / float(list_size)))))
+        self.centroids, labels = spherical_kmeans(unit[valid], n_lists, seed=seed)
+
+        # Candidates ordered by list, then by Overall descending within a list
+        order   = np.lexsort((-bucket.overall[valid], labels))
+        self.bucket  = bucket.take(valid[order])
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n_lists))])
+
+        # Sorted integer search key (list, Overall level descending): the candidates of
+        # list i with an Overall above the r lowest levels end at searchsorted(key, (i+1)*K - r)
+        self.levels = np.unique(self.bucket.overall)
+        level       = np.searchsorted(self.levels, self.bucket.overall)
+        self.key    = labels[order] * len(self.levels) + (len(self.levels) - 1 - level)
+
+    def candidates(self, player_vector, min_overall, n_probe):
+        """
+        Return the positions, in self.bucket, of the candidates above min_overall
+        in the n_probe lists closest to the query
+        """
+        unit = unit_centred(np.asarray(player_vector, dtype=np.float64)[None, :])[0]
+        if n_probe < len(self.centroids):
+            probe = np.argpartition(-(self.centroids @ unit), n_probe)[:n_probe]
+        else:
+            probe = np.arange(len(self.centroids))
+
+        # Overall is sorted descending in a list: keep the prefix of each probed list above min_overall
+        K     = len(self.levels)
+        r     = np.searchsorted(self.levels, min_overall, side='right')
+        start = self.offsets[probe]
+        stop  = np.searchsorted(self.key, (probe + 1) * K - r, side='left')
+        count = np.maximum(stop - start, 0)
+        return np.repeat(start - np.cumsum(count) + count, count) + np.arange(count.sum())
+
+#############################################################
+class ApproximateSimilarityEngine(SimilarityEngine):
+    """
+    SimilarityEngine answering most_similar() from an inverted file index per
+    position bucket. The results keep the (score, name) format and ordering of
+    the exact engine.
+
+    A query whose ability vector is constant, or that cannot find n candidates
+    in its probed lists, falls back to the exhaustive scan. Candidates with a
+    constant ability vector score 0 and are never returned by the index.
+
+    Parameter:
+    store:     PlayerStore of the cleaned dataset
+    list_size: average number of candidates per list
+    n_probe:   number of lists scored per query
+    min_size:  buckets smaller than this are searched exhaustively
+    seed:      seed of the k-means initialization
+    """
+    def __init__(self, store, list_size=256, n_probe=8, min_size=1024, seed=0):
+        SimilarityEngine.__init__(self, store)
+        self.n_probe = n_probe
+        self.indexes = {}
+        for pos, bucket in self.buckets.items():
+            # a bucket without a single non-constant ability vector has nothing to cluster
+            if len(bucket.rows) >= min_size and (np.ptp(bucket.features, axis=1) > 0).any():
+                self.indexes[pos] = InvertedFileBucket(bucket, list_size, seed=seed)
+
+    def approximate_rows(self, row, n):
+        """
+        Return the n best (score, name, row) tuples of the candidates probed for the
+        template player at the given row, None when the exhaustive scan must answer
+        """
+        player_position = str(self.store.position[row])
+        player_vector   = self.store.ability_matrix(player_position)[row]
+
+        index = self.indexes.get(player_position)
+        if index is None or n <= 0 or np.ptp(player_vector) == 0:
+            return None
+
+        candidates = index.candidates(player_vector, self.store.overall[row]*0.8, self.n_probe)
+        candidates = candidates[index.bucket.rows[candidates] != row]
+        if len(candidates) < n:
+            return None
+
+        bucket = index.bucket.take(candidates)
+        scores = self.pearson_scores(player_vector, bucket)
+        return self.top_n_rows(scores, bucket.rows, n)
+
+    def most_similar(self, player, n=4):
+        """
+        This function find the most similar players to the provided player
+
+        Parameter:
+        player: a player name as the Recommendation template
+        n:      number of similar players to return
+
+        return:
+        list of (score, name) tuples, highest score first
+        """
+        similar = self.approximate_rows(self.store.rows_for_name(player)[0], n)
+        if similar is None:
+            return SimilarityEngine.most_similar(self, player, n)
+        return [(score, name) for score, name, _ in similar]
+
+    def most_similar_rows(self, rows, n=4):
+        """
+        Batched most_similar(): every template is answered from the index, those the
+        index cannot answer by one batched exhaustive scan
+
+        Parameter:
+        rows: rows of the template players in the store, searched with their own position,
+              Overall and abilities
+        n:    number of similar players to return per template
+
+        return:
+        list, per template row, of (score, name, row) tuples, highest score first
+        """
+        results  = [self.approximate_rows(row, n) for row in np.asarray(rows, dtype=np.int64)]
+        fallback = [i for i, similar in enumerate(results) if similar is None]
+        for i, similar in zip(fallback, SimilarityEngine.most_similar_rows(self, [rows[i] for i in fallback], n)):
+            results[i] = similar
+        return results
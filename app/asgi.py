@@ -0,0 +1,33 @@
+"""
+ASGI entry point of the web app
+
+> uvicorn asgi:application --host 0.0.0.0 --port 3001
+or FIFA19_SERVER=asgi python run.py
+
+The Flask views run in the threads of the ASGI server (asgiref's WsgiToAsgi),
+the event loop only handles the connections, and the similarity searches run
+in the bounded compute pool of run.py. Requires asgiref and uvicorn.
+"""
+
+import os
+
+try:
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    raise ImportError('the ASGI mode requires asgiref and uvicorn: pip install asgiref uvicorn')
+
+#############################################################
+def __getattr__(name):
+    # asgi:application imports run.py only when the ASGI server asks for it
+    if name == 'application':
+        from run import app
+        return WsgiToAsgi(app)
+    raise AttributeError(name)
+
+def serve(app):
+    """
+    Serve a Flask app with uvicorn, FIFA19_HOST/FIFA19_PORT default to 127.0.0.1:5000 like app.run()
+    """
+    import uvicorn
+    uvicorn.run(WsgiToAsgi(app), host=os.environ.get('FIFA19_HOST', '127.0.0.1'),
+                port=int(os.environ.get('FIFA19_PORT', 5000)))
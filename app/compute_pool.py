@@ -0,0 +1,90 @@
+"""
+Compute Pool
+Bounded worker pool running the CPU-heavy similarity searches off the request threads
+
+At most `workers` searches run at once and at most `max_queue` more wait for a
+worker. A request arriving when the pool is full is refused at once with
+PoolSaturated instead of queueing behind the others, and a request whose search
+does not finish within `timeout` seconds gets ComputeTimeout. The web app
+answers both with HTTP 503, so cheap pages like the index keep their latency
+while expensive searches run.
+
+NumPy releases the GIL in its array loops, so the searches of several threads
+overlap.
+"""
+
+import threading
+import concurrent.futures
+
+#############################################################
+class PoolSaturated(RuntimeError):
+    """Raised when every worker is busy and the waiting queue is full"""
+    pass
+
+class ComputeTimeout(RuntimeError):
+    """Raised when a computation does not finish within the pool timeout"""
+    pass
+
+#############################################################
+class ComputePool(object):
+    """
+    Thread pool with a bounded queue depth and a per-call timeout
+
+    Parameter:
+    workers:   number of computations running at once
+    max_queue: number of computations allowed to wait for a worker
+    timeout:   seconds a caller waits for its result, None to wait forever
+    """
+    def __init__(self, workers=4, max_queue=16, timeout=10.0):
+        self.workers   = workers
+        self.max_queue = max_queue
+        self.timeout   = timeout
+        self.executor  = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                               thread_name_prefix='compute')
+        self.slots     = threading.BoundedSemaphore(workers + max_queue)
+        self.lock      = threading.Lock()
+        self.pending   = 0
+        self.rejected  = 0
+        self.timeouts  = 0
+
+    def run(self, function, *args, **kwargs):
+        """
+        Run function(*args, **kwargs) in the pool and return its result
+
+        Raises PoolSaturated when the pool is full, ComputeTimeout when the
+        result is not ready in time, or the exception raised by the function.
+        A computation that timed out keeps its slot until it really ends.
+        """
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise PoolSaturated('{} computations running or queued'.format(self.workers + self.max_queue))
+
+        with self.lock:
+            self.pending += 1
+        try:
+            future = self.executor.submit(function, *args, **kwargs)
+        except Exception:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+
+        try:
+            return future.result(timeout=self.timeout)
+        except concurrent.futures.TimeoutError:
+            with self.lock:
+                self.timeouts += 1
+            raise ComputeTimeout('no result after {} seconds'.format(self.timeout))
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+        self.slots.release()
+
+    def stats(self):
+        """
+        Return the number of computations in the pool and the rejection/timeout counters
+        """
+        with self.lock:
+            return {'workers': self.workers, 'max_queue': self.max_queue, 'pending': self.pending,
+                    'rejected': self.rejected, 'timeouts': self.timeouts}
@@ -0,0 +1,233 @@
+"""
+Dashboard
+Build the Plotly figures of the index page, and cache their serialized payload
+
+The figures only depend on cleaned_data.csv, so DashboardCache serializes them
+once and rebuilds them only when the file changes (by modification time and
+size). Each payload carries an ETag (hash of the JSON) and a Last-Modified
+date so that browsers and proxies can revalidate instead of downloading the
+page again.
+"""
+
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime, timezone
+
+import plotly
+import numpy  as np
+from plotly.graph_objs import Bar
+from plotly.graph_objs import Pie
+from plotly.graph_objs import Heatmap
+from data_loader import load_cleaned_data
+from metrics     import phase
+
+#feature list for graph five: FIFA 19 dataset important feature correlation heatmap display
+feature_list = ['Age','Overall','Potential','International Reputation','PAC','SHO','PAS','DRI','DEF','PHY',
+                'DIV','HAN','KIC','REF','SPD','POS','Value_Number_K','Wage_Number_K','ReleaseClause_Number_K']
+
+#columns of cleaned_data.csv read by the dashboard
+dashboard_columns = ['Club', 'Position'] + feature_list
+
+#############################################################
+def bar_graph(series, title, yaxis_title, xaxis_title):
+    """
+    Bar chart of an already aggregated and sorted series
+    """
+    return {
+        'data': [
+            Bar(
+                x=series.index,
+                y=series.values
+            )
+        ],
+
+        'layout': {
+            'title': title,
+            'yaxis': { 'title': yaxis_title },
+            'xaxis': { 'title': xaxis_title }
+        }
+    }
+
+#############################################################
+def dashboard_aggregates(data):
+    """
+    Compute the aggregates the visuals of the index page are drawn from, every one once
+
+    Parameter:
+    data: cleaned dataset, with the dashboard_columns
+
+    Returns:
+    dict of aggregates, see build_graphs()
+    """
+    # float64 sums and means of the money, stored as float32 in a compact dataset (see schema.py)
+    money           = data[["Value_Number_K", "Wage_Number_K"]].astype(np.float64)
+    club_groups     = money.groupby(data["Club"], observed=True)
+    position_groups = money.groupby(data["Position"], observed=True)
+    age_groups      = money.groupby(data["Age"])
+
+    return {
+        'age_counts':          data['Age'].value_counts(),
+        'position_counts':     data['Position'].value_counts(),
+        'club_value_sum':      club_groups["Value_Number_K"].sum().sort_values(ascending=False).head(20),
+        'club_wage_mean':      club_groups["Wage_Number_K"].mean().sort_values(ascending=False).head(20),
+        'position_value_mean': position_groups["Value_Number_K"].mean().sort_values(ascending=False),
+        'position_wage_mean':  position_groups["Wage_Number_K"].mean().sort_values(ascending=False),
+        'age_value_mean':      age_groups["Value_Number_K"].mean().sort_values(ascending=False),
+        'age_wage_mean':       age_groups["Wage_Number_K"].mean().sort_values(ascending=False),
+        'correlation':         np.array(data[feature_list].corr()),
+    }
+
+def build_graphs(data=None, aggregates=None):
+    """
+    Create the nine visuals of the index page
+
+    Parameter:
+    data:       cleaned dataset
+    aggregates: its dashboard_aggregates(), computed from data when not given, e.g. by a SQL query
+
+    Returns:
+    list of Plotly graph dicts
+    """
+    if aggregates is None:
+        aggregates = dashboard_aggregates(data)
+    age_counts      = aggregates['age_counts']
+    position_counts = aggregates['position_counts']
+
+    graphs = [
+        # Graph 1: FIFA19 Players' Age Distribution
+        {
+            'data': [
+                Pie(
+                    labels = age_counts.index,
+                    values = age_counts.values
+                )
+            ],
+            'layout': { 'title': 'FIFA 19 Players Age Distribution' }
+        },
+
+        # Graph 2: FIFA19 Players' Position Distribution
+        {
+            'data': [
+                Pie(
+                    labels = position_counts.index,
+                    values = position_counts.values
+                )
+            ],
+            'layout': { 'title': 'FIFA 19 Players Position Distribution' }
+        },
+
+        # Graph 3: FIFA 19 Top 20 clubs with highest total player market value
+        bar_graph(aggregates['club_value_sum'],
+                  'FIFA 19 Top 20 clubs with highest total player market value',
+                  "Total Market Value of the Players (in thousands)", "Club"),
+
+        # Graph 4: FIFA 19 Top 20 clubs with highest average wage
+        bar_graph(aggregates['club_wage_mean'],
+                  'FIFA 19 Top 20 clubs with highest average wage',
+                  "Average wage of the Players (in thousands)", "Club"),
+
+        # Graph 5: Average value for each position
+        bar_graph(aggregates['position_value_mean'],
+                  'Average value for each position',
+                  "Average value for each position (in thousands)", "Position"),
+
+        # Graph 6: Average wage for each position
+        bar_graph(aggregates['position_wage_mean'],
+                  'Average wage for each position',
+                  "Average wage for each position (in thousands)", "Position"),
+
+        # Graph 7: Average value for each age
+        bar_graph(aggregates['age_value_mean'],
+                  'Average value for each age',
+                  "Average value for each age (in thousands)", "Age"),
+
+        # Graph 8: Average wage for each age
+        bar_graph(aggregates['age_wage_mean'],
+                  'Average wage for each age',
+                  "Average wage for each Age (in thousands)", "Age"),
+
+        # Graph 9: FIFA 19 dataset important feature correlation heatmap display
+        {
+            'data': [
+                Heatmap(
+                    z=aggregates['correlation'],
+                    x=feature_list,
+                    y=feature_list,
+                    colorscale='Jet'
+                )
+            ],
+
+            'layout': { 'title': 'FIFA19 dataset important feature correlation heatmap display' }
+        },
+    ]
+
+    return graphs
+
+#############################################################
+class DashboardPayload(object):
+    """
+    Serialized index page visuals of one version of the dataset
+
+    html is left empty here, run.py fills it the first time the page is rendered
+    """
+    def __init__(self, graphs, last_modified):
+        # encode plotly graphs in JSON
+        self.ids           = ["graph-{}".format(i) for i, _ in enumerate(graphs)]
+        with phase('dashboard_json'):
+            self.graphJSON = json.dumps(graphs, cls=plotly.utils.PlotlyJSONEncoder)
+        self.etag          = hashlib.sha1(self.graphJSON.encode('utf-8')).hexdigest()
+        self.last_modified = last_modified
+        self.html          = None
+
+#############################################################
+class DashboardCache(object):
+    """
+    Serialized dashboard payload, rebuilt only when the data file changes
+
+    Parameter:
+    data_filepath: path of cleaned_data.csv
+    data:          optional DataFrame already loaded from data_filepath
+    watch:         rebuild the payload when the data file changes, turned off when
+                   a new DashboardCache comes with each reloaded dataset
+    """
+    def __init__(self, data_filepath, data=None, watch=True):
+        self.data_filepath = data_filepath
+        self.watch         = watch
+        self.lock          = threading.Lock()
+        self.signature     = None
+        self.payload       = None
+        if data is not None:
+            self.signature = self.file_signature()
+            self.payload   = self.build(data, self.signature)
+
+    def file_signature(self):
+        # the columnar copy, when used, is always written right after the csv file
+        stat = os.stat(self.data_filepath)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def build(self, data, signature):
+        last_modified = datetime.fromtimestamp(signature[0] / 1e9, tz=timezone.utc)
+        with phase('dashboard_figures'):
+            graphs = build_graphs(data)
+        return DashboardPayload(graphs, last_modified)
+
+    def get(self):
+        """
+        Return the current payload, rebuilding it if the data file changed
+        """
+        if not self.watch and self.payload is not None:
+            return self.payload
+
+        signature = self.file_signature()
+        if signature == self.signature:
+            return self.payload
+
+        with self.lock:
+            if signature != self.signature:
+                with phase('dashboard_load'):
+                    data = load_cleaned_data(self.data_filepath, columns=dashboard_columns)
+                self.payload   = self.build(data, signature)
+                self.signature = signature
+        return self.payload
@@ -0,0 +1,58 @@
+"""
+Data Loader
+Load the columns of the cleaned FIFA19 dataset that the web app uses
+
+process_data.py --columnar writes a typed Parquet copy next to cleaned_data.csv.
+When that copy exists and is not older than the csv file, only the requested
+columns are read from it. Otherwise the csv file is parsed, still restricted
+to the requested columns. Either way the columns get the compact types of
+clean_data(), see schema.py: the categorical columns are parsed straight into
+categoricals, the ratings are int8 and the money float32 when it holds the values.
+"""
+
+import os
+
+import pandas as pd
+
+from schema import compact_frame, categorical_dtypes
+
+#############################################################
+def columnar_filepath(data_filepath):
+    """
+    Return the path of the Parquet copy of a cleaned csv file: cleaned_data.csv -> cleaned_data.parquet
+    """
+    return os.path.splitext(data_filepath)[0] + '.parquet'
+
+#############################################################
+def is_current(derived_path, data_filepath):
+    """
+    True if the file/directory derived from the cleaned csv file exists and is not older than it
+    """
+    if not os.path.exists(derived_path):
+        return False
+    if not os.path.exists(data_filepath):
+        return True
+    return os.path.getmtime(derived_path) >= os.path.getmtime(data_filepath)
+
+#############################################################
+def load_cleaned_data(data_filepath, columns):
+    """
+    Load the cleaned dataset, preferring its up-to-date columnar copy
+
+    Parameter:
+    data_filepath: path of cleaned_data.csv
+    columns:       columns to load
+
+    Returns:
+    DataFrame with the requested columns, in their compact types
+    """
+    columnar = columnar_filepath(data_filepath)
+    if is_current(columnar, data_filepath):
+        try:
+            return compact_frame(pd.read_parquet(columnar, columns=columns))
+        except ImportError:
+            pass
+
+    # round_trip reads back the exact values process_data.py wrote, like its player matrix and neighbour table
+    return compact_frame(pd.read_csv(data_filepath, usecols=columns, float_precision='round_trip',
+                                     dtype=categorical_dtypes(columns))[columns])
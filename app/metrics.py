@@ -0,0 +1,322 @@
+"""
+Request Metrics
+Latency histograms, request counters and in-flight gauges of the web app, with a
+slow-request log and an opt-in sampling profiler
+
+RequestMetrics hooks into the Flask request cycle and keeps, per route:
+    fifa19_requests_total{route, method, status}    - requests answered
+    fifa19_requests_in_flight{route}                - requests being answered
+    fifa19_request_seconds{route}                   - latency histogram
+    fifa19_request_phase_seconds{route, phase}      - latency histogram of each phase of the requests
+render() writes them in the Prometheus text format, served on /metrics. The
+values are kept per process: every worker process of a server exposes its own.
+
+A phase is a block of a view timed with `with metrics.phase('most_similar'):`,
+e.g. the dashboard figures, the similarity search, the template rendering or
+the JSON encoding, so the latency of a route can be split into its steps.
+metrics.note() attaches details to the current request (the query player, the
+number of candidates scored); they are only written, in the slow-request log,
+for requests slower than slow_threshold, and may be functions only called then.
+
+With profile_dirpath set, a sampling thread records the stack of every request
+thread (and of the compute pool threads working for it, see traced()) every
+sample_interval seconds. The stacks of a request slower than slow_threshold are
+written to profile_dirpath as a .folded file, one "frame;frame;frame count" line
+per distinct stack, the input of flamegraph.pl, speedscope or inferno.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+import collections
+import contextlib
+
+from flask import g, request, has_request_context
+
+Default_Buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+slow_log = logging.getLogger('fifa19.slow')
+
+#############################################################
+class Histogram(object):
+    """
+    Cumulative bucket counts, sum and count of observed values, like a Prometheus histogram
+    """
+    def __init__(self, buckets=Default_Buckets):
+        self.buckets = buckets
+        self.counts  = [0] * len(buckets)
+        self.count   = 0
+        self.sum     = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum   += value
+
+    def lines(self, name, labels):
+        for bound, count in zip(self.buckets, self.counts):
+            yield '{}_bucket{} {}'.format(name, format_labels(labels + [('le', repr(bound))]), count)
+        yield '{}_bucket{} {}'.format(name, format_labels(labels + [('le', '+Inf')]), self.count)
+        yield '{}_sum{} {!r}'.format(name, format_labels(labels), self.sum)
+        yield '{}_count{} {}'.format(name, format_labels(labels), self.count)
+
+def format_labels(labels):
+    """
+    Return the {name="value",...} part of a sample, values escaped as the text format requires
+    """
+    if not labels:
+        return ''
+    escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join('{}="{}"'.format(name, escape(value)) for name, value in labels) + '}'
+
+#############################################################
+def current_state():
+    return g.get('request_metrics') if has_request_context() else None
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Time a block as one phase of the current request, outside of a request it is not timed.
+    Phases may be nested, e.g. the figures and the JSON encoding of the dashboard phase.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        state = current_state()
+        if state is not None:
+            state.phases[name] = state.phases.get(name, 0.0) + time.perf_counter() - start
+
+def note(**notes):
+    """
+    Attach details to the current request for the slow-request log, values or functions computing them
+    """
+    state = current_state()
+    if state is not None:
+        state.notes.update(notes)
+
+#############################################################
+class RequestState(object):
+    """
+    Timing of the request being answered, kept on flask.g
+    """
+    def __init__(self, route):
+        self.route   = route
+        self.start   = time.perf_counter()
+        self.phases  = collections.OrderedDict()
+        self.notes   = collections.OrderedDict()
+        self.status  = None
+        self.samples = None
+
+#############################################################
+class RequestMetrics(object):
+    """
+    Metrics of the requests of a Flask app, see the module documentation
+
+    Parameter:
+    slow_threshold:  seconds above which a request is slow: logged, and profiled with profile_dirpath
+    profile_dirpath: directory of the .folded profiles of the slow requests, None to disable sampling
+    sample_interval: seconds between two stack samples of the profiler
+    buckets:         upper bounds of the latency histogram buckets, in seconds
+    """
+    def __init__(self, slow_threshold=None, profile_dirpath=None, sample_interval=0.005, buckets=Default_Buckets):
+        self.slow_threshold  = slow_threshold
+        self.profile_dirpath = profile_dirpath
+        self.sample_interval = sample_interval
+        self.buckets         = buckets
+        self.lock            = threading.Lock()
+        self.requests        = collections.Counter()
+        self.in_flight       = collections.Counter()
+        self.latency         = {}
+        self.phase_latency   = {}
+        self.gauges          = []
+        self.slow_requests   = 0
+        self.profiles        = 0
+
+        # thread ident -> stack counter of the request it works for, read by the sampling thread
+        self.sampled = {}
+        self.active  = threading.Event()
+        self.sampler = None
+        if profile_dirpath is not None and slow_threshold is not None:
+            os.makedirs(profile_dirpath, exist_ok=True)
+            self.sampler = threading.Thread(target=self.sample, name='request-profiler')
+            self.sampler.daemon = True
+            self.sampler.start()
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def register(self, name, kind, help, function):
+        """
+        Expose the value returned by function() as a gauge or counter of /metrics, e.g. the compute pool queue
+        """
+        self.gauges.append((name, kind, help, function))
+
+    #############################################################
+    def before_request(self):
+        state = g.request_metrics = RequestState(request.url_rule.rule if request.url_rule else 'unmatched')
+        with self.lock:
+            self.in_flight[state.route] += 1
+        if self.sampler is not None:
+            state.samples = collections.Counter()
+            self.sampled[threading.get_ident()] = state.samples
+            self.active.set()
+
+    def after_request(self, response):
+        state = g.get('request_metrics')
+        if state is not None:
+            state.status = response.status_code
+        return response
+
+    def teardown_request(self, error=None):
+        state = g.pop('request_metrics', None)
+        if state is None:
+            return
+        seconds = time.perf_counter() - state.start
+        self.sampled.pop(threading.get_ident(), None)
+        status = state.status if state.status is not None else 500
+
+        with self.lock:
+            self.in_flight[state.route] -= 1
+            self.requests[(state.route, request.method, status)] += 1
+            self.latency.setdefault(state.route, Histogram(self.buckets)).observe(seconds)
+            for phase, phase_seconds in state.phases.items():
+                self.phase_latency.setdefault((state.route, phase), Histogram(self.buckets)).observe(phase_seconds)
+
+        if self.slow_threshold is not None and seconds >= self.slow_threshold:
+            self.log_slow_request(state, status, seconds)
+
+    #############################################################
+    def phase(self, name):
+        return phase(name)
+
+    def note(self, **notes):
+        note(**notes)
+
+    def traced(self, function):
+        """
+        Wrap a function run by another thread for the current request (e.g. in the compute
+        pool), so that the profiler samples that thread as part of the request
+        """
+        state = current_state()
+        if state is None or state.samples is None:
+            return function
+        samples = state.samples
+        def run(*args, **kwargs):
+            ident = threading.get_ident()
+            self.sampled[ident] = samples
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.sampled.pop(ident, None)
+        return run
+
+    #############################################################
+    def log_slow_request(self, state, status, seconds):
+        notes = collections.OrderedDict()
+        for name, value in state.notes.items():
+            try:
+                notes[name] = value() if callable(value) else value
+            except Exception as error:
+                notes[name] = repr(error)
+
+        profile = None
+        if state.samples:
+            profile = self.save_profile(state, seconds)
+        with self.lock:
+            self.slow_requests += 1
+
+        slow_log.warning(json.dumps(collections.OrderedDict([
+            ('route',   state.route),
+            ('path',    request.full_path.rstrip('?')),
+            ('method',  request.method),
+            ('status',  status),
+            ('ms',      round(seconds * 1000, 3)),
+            ('phases',  dict((phase, round(phase_seconds * 1000, 3)) for phase, phase_seconds in state.phases.items())),
+            ('notes',   notes),
+            ('profile', profile),
+        ]), default=str))
+
+    def save_profile(self, state, seconds):
+        """
+        Write the sampled stacks of a request as a .folded file, return its path
+        """
+        route    = re.sub('[^A-Za-z0-9]+', '_', state.route).strip('_') or 'index'
+        filepath = os.path.join(self.profile_dirpath, '{}-{}-{:.0f}ms.folded'.format(
+            time.strftime('%Y%m%d-%H%M%S'), route, seconds * 1000))
+        with open(filepath, 'w') as f:
+            for stack, count in sorted(state.samples.items()):
+                f.write('{} {}\n'.format(stack, count))
+        with self.lock:
+            self.profiles += 1
+        return filepath
+
+    def sample(self):
+        """
+        Sampling thread: add the current stack of every sampled thread to the counter of its request
+        """
+        # idle until a request starts, the event is set again by every request
+        while True:
+            self.active.wait()
+            self.active.clear()
+            while self.sampled:
+                time.sleep(self.sample_interval)
+                frames = sys._current_frames()
+                for ident, samples in list(self.sampled.items()):
+                    frame = frames.get(ident)
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append('{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename),
+                                                         code.co_firstlineno))
+                        frame = frame.f_back
+                    if stack:
+                        samples[';'.join(reversed(stack))] += 1
+                del frames
+
+    #############################################################
+    def render(self):
+        """
+        Return every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            requests      = sorted(self.requests.items())
+            in_flight     = sorted(self.in_flight.items())
+            latency       = sorted(self.latency.items())
+            phase_latency = sorted(self.phase_latency.items())
+            lines = ['# HELP fifa19_requests_total Requests answered, by route, method and status',
+                     '# TYPE fifa19_requests_total counter']
+            lines += ['fifa19_requests_total{} {}'.format(
+                          format_labels([('route', route), ('method', method), ('status', status)]), count)
+                      for (route, method, status), count in requests]
+            lines += ['# HELP fifa19_requests_in_flight Requests being answered, by route',
+                      '# TYPE fifa19_requests_in_flight gauge']
+            lines += ['fifa19_requests_in_flight{} {}'.format(format_labels([('route', route)]), count)
+                      for route, count in in_flight]
+            lines += ['# HELP fifa19_request_seconds Request latency, by route',
+                      '# TYPE fifa19_request_seconds histogram']
+            for route, histogram in latency:
+                lines += histogram.lines('fifa19_request_seconds', [('route', route)])
+            lines += ['# HELP fifa19_request_phase_seconds Latency of the phases of the requests, by route and phase',
+                      '# TYPE fifa19_request_phase_seconds histogram']
+            for (route, phase), histogram in phase_latency:
+                lines += histogram.lines('fifa19_request_phase_seconds', [('route', route), ('phase', phase)])
+            lines += ['# HELP fifa19_slow_requests_total Requests slower than the slow-request threshold',
+                      '# TYPE fifa19_slow_requests_total counter',
+                      'fifa19_slow_requests_total {}'.format(self.slow_requests),
+                      '# HELP fifa19_request_profiles_total Profiles of slow requests written',
+                      '# TYPE fifa19_request_profiles_total counter',
+                      'fifa19_request_profiles_total {}'.format(self.profiles)]
+
+        for name, kind, help, function in self.gauges:
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} {}'.format(name, kind),
+                      '{} {!r}'.format(name, float(function()))]
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,220 @@
+"""
+Name Index
+Accent-insensitive exact, prefix and fuzzy search of the player names, built at load time
+
+Names are folded before indexing and searching: accents removed, lower case,
+punctuation as spaces, so "l messi", "L. MESSI" and "L. Messí" find "L. Messi".
+
+    exact  - folded name -> names
+    prefix - sorted array of the folded names and of their suffixes starting at
+             each word, a binary search gives the range of the keys starting with
+             the query, like the subtree of a prefix trie ("mes" finds "L. Messi")
+    fuzzy  - trigram inverted index: the names sharing the most trigrams with the
+             query, scored by Jaccard similarity, catch typos ("L. Mesi")
+
+The trigram postings are built with NumPy array operations, so the index of a
+few hundred thousand names is rebuilt in well under a second on each reload.
+Matches of the same kind are ranked by Overall, the best players first.
+"""
+
+import re
+import bisect
+import unicodedata
+
+import numpy  as np
+
+# combining diacritical marks left by the NFKD decomposition, and what separates words
+Combining_Marks = re.compile('[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]')
+Separators      = re.compile('[^\\w\\n]+|_+')
+
+#############################################################
+def fold_all(names):
+    """
+    Return the searchable form of every name: no accents, lower case, words separated
+    by single spaces. The names are folded as one text, newline separated.
+    """
+    text = unicodedata.normalize('NFKD', '\n'.join(names))
+    text = Separators.sub(' ', Combining_Marks.sub('', text).lower())
+    return [' '.join(name.split()) for name in text.split('\n')]
+
+def fold(name):
+    return fold_all([name])[0]
+
+def trigram_codes(text):
+    """
+    Return the trigrams of a string as integers, three 21-bit code points each
+    """
+    codes = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    return (codes[:-2] << 42) | (codes[1:-1] << 21) | codes[2:]
+
+#############################################################
+class NameIndex(object):
+    """
+    Search index of the distinct names of a PlayerStore, a name standing for its first row
+
+    Parameter:
+    store:        PlayerStore of the dataset
+    max_postings: trigrams found in more names than this are only used to score the
+                  candidates found by rarer trigrams, not to find candidates
+    """
+    def __init__(self, store, max_postings=2000):
+        self.store        = store
+        self.max_postings = max_postings
+        self.names        = list(store.rows_by_name)
+        self.rows         = np.array([rows[0] for rows in store.rows_by_name.values()], dtype=np.int64)
+        self.overall      = np.asarray(store.overall)[self.rows]
+        folded            = fold_all(self.names)
+
+        self.exact = {}
+        for i, key in enumerate(folded):
+            self.exact.setdefault(key, []).append(i)
+
+        # prefix keys: every folded name, and its suffixes starting at each word
+        keys, owners = [], []
+        for i, key in enumerate(folded):
+            keys.append(key)
+            owners.append(i)
+            start = key.find(' ')
+            while start >= 0:
+                keys.append(key[start+1:])
+                owners.append(i)
+                start = key.find(' ', start+1)
+        order = np.argsort(np.array(keys, dtype=str), kind='stable')
+        self.prefix_keys    = [keys[i] for i in order]
+        self.prefix_owners  = np.array(owners, dtype=np.int64)[order]
+        self.prefix_overall = self.overall[self.prefix_owners]
+
+        self.build_trigrams(folded)
+
+    def build_trigrams(self, folded):
+        """
+        Build the trigram postings (trigram -> names) and the trigrams of each name,
+        the names being padded with a space on both sides
+        """
+        padded  = [' ' + key + ' ' for key in folded]
+        lengths = np.array([len(text) for text in padded], dtype=np.int64)
+        codes   = np.frombuffer(''.join(padded).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        owner   = np.repeat(np.arange(len(padded)), lengths)
+        offset  = np.arange(len(codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        starts  = np.flatnonzero(offset <= np.repeat(lengths, lengths) - 3)
+
+        trigrams = (codes[starts] << 42) | (codes[starts+1] << 21) | codes[starts+2]
+        owner    = owner[starts]
+
+        # distinct trigrams of each name, grouped by name
+        order    = np.lexsort((trigrams, owner))
+        trigrams, owner = trigrams[order], owner[order]
+        distinct = np.ones(len(trigrams), dtype=bool)
+        distinct[1:] = (trigrams[1:] != trigrams[:-1]) | (owner[1:] != owner[:-1])
+        trigrams, owner = trigrams[distinct], owner[distinct]
+        self.name_trigrams = trigrams
+        self.name_offsets  = np.concatenate([[0], np.cumsum(np.bincount(owner, minlength=len(padded)))])
+
+        # postings, grouped by trigram
+        order = np.argsort(trigrams, kind='stable')
+        self.posting_names = owner[order]
+        self.trigrams, self.posting_offsets = np.unique(trigrams[order], return_index=True)
+        self.posting_offsets = np.append(self.posting_offsets, len(order))
+
+    def __len__(self):
+        return len(self.names)
+
+    #############################################################
+    def prefix_matches(self, key, limit):
+        """
+        Return the limit names with the highest Overall among those with a key starting with key, ties by name
+        """
+        lo = bisect.bisect_left(self.prefix_keys, key)
+        hi = bisect.bisect_left(self.prefix_keys, key + '\U0010ffff', lo)
+
+        # a name has one key per word, keep enough keys to find limit distinct names
+        owners = self.prefix_owners[lo:hi]
+        if len(owners) > limit * 4:
+            overall   = self.prefix_overall[lo:hi]
+            threshold = np.partition(overall, len(owners) - limit * 4)[len(owners) - limit * 4]
+            owners    = owners[overall >= threshold]
+        return sorted(set(owners.tolist()), key=lambda i: (-self.overall[i], self.names[i]))[0:limit]
+
+    def fuzzy_matches(self, key, limit, min_score):
+        """
+        Return (name, score) pairs of the names whose trigrams are the most similar to the key's
+        """
+        query = np.unique(trigram_codes(' ' + key + ' '))
+        found = np.searchsorted(self.trigrams, query)
+        found = found[found < len(self.trigrams)]
+        found = found[np.isin(self.trigrams[found], query)]
+        if len(found) == 0:
+            return []
+
+        # candidates: the names holding the rarer trigrams of the query
+        sizes = self.posting_offsets[found+1] - self.posting_offsets[found]
+        rare  = found[sizes <= self.max_postings]
+        if len(rare) == 0:
+            rare = found[[np.argmin(sizes)]]
+        starts     = self.posting_offsets[rare]
+        sizes      = self.posting_offsets[rare+1] - starts
+        candidates = np.unique(self.posting_names[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) +
+                                                  np.arange(sizes.sum())])
+
+        # Jaccard similarity of the trigram sets of the query and of each candidate
+        starts = self.name_offsets[candidates]
+        sizes  = self.name_offsets[candidates+1] - starts
+        shared = np.isin(self.name_trigrams[np.repeat(starts - np.cumsum(sizes) + sizes, sizes) +
+                                            np.arange(sizes.sum())], query)
+        shared = np.bincount(np.repeat(np.arange(len(candidates)), sizes), weights=shared,
+                             minlength=len(candidates))
+        scores = shared / (len(query) + sizes - shared)
+
+        keep = np.flatnonzero(scores >= min_score)
+        keep = keep[np.argsort(-scores[keep], kind='stable')][0:limit * 4]
+        best = sorted(keep.tolist(), key=lambda i: (-scores[i], -self.overall[candidates[i]],
+                                                    self.names[candidates[i]]))[0:limit]
+        return [(int(candidates[i]), float(scores[i])) for i in best]
+
+    #############################################################
+    def search(self, query, limit=10, min_score=0.2):
+        """
+        Find the names matching a query: exact matches first, then names starting with
+        the query (or with a word starting with it), then similar names
+
+        Parameter:
+        query:     text typed by the user
+        limit:     number of names returned at most
+        min_score: lowest trigram similarity of a fuzzy match, between 0 and 1
+
+        Returns:
+        list of dicts {"id", "name", "position", "overall", "match", "score"}, the
+        player of each name being its first row like in most_similar()
+        """
+        key = fold(query)
+        if not key or limit <= 0:
+            return []
+
+        matches = [(i, 'exact', 1.0) for i in self.exact.get(key, [])]
+        if len(matches) < limit:
+            matches += [(i, 'prefix', 1.0) for i in self.prefix_matches(key, limit)]
+        if len(matches) < limit:
+            matches += [(i, 'fuzzy', score) for i, score in self.fuzzy_matches(key, limit, min_score)]
+
+        results, seen = [], set()
+        for i, match, score in matches:
+            if i in seen:
+                continue
+            seen.add(i)
+            row = self.rows[i]
+            results.append({'id': self.store.ids[row].item(), 'name': self.names[i],
+                            'position': str(self.store.position[row]), 'overall': self.overall[i].item(),
+                            'match': match, 'score': score})
+        return results[0:limit]
+
+    def resolve(self, query):
+        """
+        Return the row of the player a query designates: the exact name, else the
+        best match of search(), None when nothing matches
+        """
+        if query in self.store:
+            return self.store.rows_for_name(query)[0]
+        results = self.search(query, limit=1)
+        if not results:
+            return None
+        return self.store.row_by_id[results[0]['id']]
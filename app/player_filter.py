@@ -0,0 +1,208 @@
+"""
+Player Filter
+Indexed multi-attribute search over the cleaned columns, behind the /search endpoint
+
+A query is a set of conditions, e.g. the CBs aged 23 or less with a Potential
+of 80 or more, worth at most 5000K, with at most 12 months of contract left:
+
+    {"Position": ["CB"], "Age": {"max": 23}, "Potential": {"min": 80},
+     "Value_Number_K": {"max": 5000}, "Contract_Remaining_Month_Number": {"max": 12}}
+
+Indexes, built once per dataset with array operations:
+    categorical columns - one posting list of rows per value (rows grouped by value)
+    numeric columns     - the rows sorted by value, a range is a binary search away
+
+The number of rows matching each condition is known from its index before any
+row is read, so a query starts from the most selective condition and checks the
+others on its rows only, in selectivity order: the cost follows the size of the
+smallest candidate set, not the size of the dataset. The top-N rows by a
+numeric column are picked with a partial sort.
+"""
+
+import numpy  as np
+import pandas as pd
+
+# columns searched by value and by range
+Categorical_Columns = ['Position', 'Club', 'Nationality', 'Preferred Foot']
+Numeric_Columns     = ['Age', 'Overall', 'Potential', 'Special', 'International Reputation', 'Weak Foot',
+                       'Skill Moves', 'Value_Number_K', 'Wage_Number_K', 'ReleaseClause_Number_K',
+                       'Contract_Remaining_Month_Number', 'Height_float', 'Weight_float',
+                       'PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']
+
+# columns of every result, followed by the searched and ordering columns
+Result_Columns      = ['ID', 'Name', 'Position', 'Club', 'Nationality', 'Age', 'Overall', 'Potential', 'Value_Number_K']
+
+filter_columns      = list(dict.fromkeys(['ID', 'Name'] + Categorical_Columns + Numeric_Columns))
+
+#############################################################
+class InvalidQuery(ValueError):
+    """Raised for a condition on an unknown column or with a malformed value"""
+    pass
+
+#############################################################
+class CategoricalIndex(object):
+    """
+    Rows grouped by value: the rows of values[i] are rows[offsets[i]:offsets[i+1]], in dataset order
+    """
+    def __init__(self, column):
+        codes, uniques = pd.factorize(column)
+        self.codes   = codes
+        self.lookup  = dict(zip(uniques.tolist(), range(len(uniques))))
+        self.rows    = np.argsort(codes, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(codes[codes >= 0], minlength=len(uniques)))])
+        self.rows    = self.rows[len(codes) - self.offsets[-1]:]
+
+    def condition(self, values):
+        """
+        Return the number of rows holding one of the values, and the rows and row test of that condition
+        """
+        codes = [self.lookup[value] for value in values if value in self.lookup]
+        count = sum(int(self.offsets[code+1] - self.offsets[code]) for code in codes)
+        rows  = lambda: np.sort(np.concatenate([self.rows[self.offsets[code]:self.offsets[code+1]]
+                                                for code in codes] or [np.zeros(0, dtype=np.int64)]))
+        test  = lambda candidates: np.isin(self.codes[candidates], codes)
+        return count, rows, test
+
+class NumericIndex(object):
+    """
+    Rows sorted by value, missing values last
+    """
+    def __init__(self, column):
+        self.values = column.to_numpy(dtype=np.float64)
+        self.rows   = np.argsort(self.values, kind='stable')
+        self.sorted = self.values[self.rows]
+
+    def condition(self, low, high):
+        """
+        Return the number of rows with low <= value <= high, and the rows and row test of that condition
+        """
+        start = np.searchsorted(self.sorted, low, side='left')
+        stop  = np.searchsorted(self.sorted, high, side='right')
+        count = max(0, int(stop - start))
+        rows  = lambda: np.sort(self.rows[start:stop])
+        test  = lambda candidates: (self.values[candidates] >= low) & (self.values[candidates] <= high)
+        return count, rows, test
+
+#############################################################
+class PlayerFilter(object):
+    """
+    Search the players of a cleaned dataset by conditions on several columns
+
+    Parameter:
+    data: cleaned data DataFrame, with the filter_columns found in it
+    """
+    def __init__(self, data):
+        self.data    = data
+        self.columns = dict((column, data[column].to_numpy()) for column in data.columns)
+        self.indexes = {}
+        for column in Categorical_Columns:
+            if column in data:
+                self.indexes[column] = CategoricalIndex(data[column])
+        for column in Numeric_Columns:
+            if column in data:
+                self.indexes[column] = NumericIndex(data[column])
+
+    def __len__(self):
+        return len(self.data)
+
+    def condition(self, column, value):
+        """
+        Turn one condition of a query into (count, rows, test), see the index classes.
+        A categorical condition is a value or a list of values, a numeric one is a
+        value, a [low, high] list or a {"min", "max"} object.
+        """
+        if column not in self.indexes:
+            raise InvalidQuery('cannot search by {!r}, the columns are: {}'.format(column, ', '.join(self.indexes)))
+        index = self.indexes[column]
+
+        if isinstance(index, CategoricalIndex):
+            values = value if isinstance(value, list) else [value]
+            if not all(isinstance(value, (str, int, float)) for value in values):
+                raise InvalidQuery('expected a value or a list of values for {!r}'.format(column))
+            return index.condition(values)
+
+        if isinstance(value, dict):
+            low, high = value.get('min'), value.get('max')
+        elif isinstance(value, list) and len(value) == 2:
+            low, high = value
+        else:
+            low, high = value, value
+        try:
+            low  = -np.inf if low is None else float(low)
+            high = np.inf if high is None else float(high)
+        except (TypeError, ValueError):
+            raise InvalidQuery('expected a number, a [min, max] list or a {{"min", "max"}} object for {!r}'.format(column))
+        return index.condition(low, high)
+
+    def search(self, conditions, order_by=None, descending=True, limit=20, offset=0):
+        """
+        Find the players meeting every condition
+
+        Parameter:
+        conditions: dict column -> condition, see condition()
+        order_by:   numeric column ordering the results, dataset order by default
+        descending: highest values first
+        limit:      number of players returned
+        offset:     number of players skipped, to page through the results
+
+        Returns:
+        number of players found, and the rows of the returned players in order
+        """
+        if order_by is not None and not (isinstance(order_by, str) and
+                                         isinstance(self.indexes.get(order_by), NumericIndex)):
+            raise InvalidQuery('cannot order by {!r}'.format(order_by))
+
+        # most selective condition first: its rows are the candidates the others are checked on
+        conditions = sorted((self.condition(column, value) for column, value in conditions.items()),
+                            key=lambda condition: condition[0])
+        if conditions:
+            count, rows, _ = conditions[0]
+            candidates     = rows() if count else np.zeros(0, dtype=np.int64)
+            for _, _, test in conditions[1:]:
+                if len(candidates) == 0:
+                    break
+                candidates = candidates[test(candidates)]
+        else:
+            candidates = np.arange(len(self.data))
+
+        found = len(candidates)
+        stop  = min(found, offset + limit)
+        if order_by is None or stop <= offset:
+            return found, candidates[offset:stop]
+
+        # partial sort: the stop best candidates, missing values last, ties in dataset order
+        values = self.indexes[order_by].values[candidates]
+        keys   = np.where(np.isnan(values), np.inf, -values if descending else values)
+        if stop < found:
+            top        = np.argpartition(keys, stop - 1)[:stop]
+            threshold  = keys[top].max()
+            top        = np.flatnonzero(keys <= threshold)
+        else:
+            top        = np.arange(found)
+        top = top[np.lexsort((top, keys[top]))]
+        return found, candidates[top[offset:stop]]
+
+    def parse_arguments(self, arguments):
+        """
+        Turn query string arguments into conditions: Position=CB,LCB for values,
+        Age=..23, Potential=80.. or Overall=75..85 for ranges, Age=21 for a value
+        """
+        conditions = {}
+        for column, text in arguments.items():
+            if isinstance(self.indexes.get(column), CategoricalIndex):
+                conditions[column] = text.split(',')
+            elif '..' in text:
+                low, high = text.split('..', 1)
+                conditions[column] = {'min': low or None, 'max': high or None}
+            else:
+                conditions[column] = text
+        return conditions
+
+    def records(self, rows, columns):
+        """
+        Return the given columns of the rows as JSON-ready dicts, missing values as None
+        """
+        columns = [column for column in columns if column in self.columns]
+        values  = [[None if pd.isnull(value) else value for value in self.columns[column][rows].tolist()]
+                   for column in columns]
+        return [dict(zip(columns, record)) for record in zip(*values)]
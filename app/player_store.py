@@ -0,0 +1,154 @@
+"""
+Player Store
+Indexed, read-only view of the cleaned FIFA19 players built once at load time
+
+The store keeps the handful of columns needed on the request path as NumPy
+arrays, together with a Name -> rows and an ID -> row index, so looking a
+player up never scans the DataFrame.
+
+Player names are not unique in the dataset. rows_for_name() returns every row
+carrying a name, lookup() keeps the historical behaviour of the app and
+resolves a name to its first row, and lookup_unique() refuses ambiguous names.
+"""
+
+from collections import namedtuple
+
+import numpy  as np
+import pandas as pd
+
+from similarity    import feature_columns
+from player_matrix import build_player_matrix, open_player_matrix
+
+PlayerRecord = namedtuple('PlayerRecord', ['row', 'id', 'name', 'position', 'overall',
+                                           'ability_columns', 'abilities'])
+
+#############################################################
+class PlayerNotFound(KeyError):
+    """Raised when no player matches the requested name or ID"""
+    pass
+
+class AmbiguousPlayerName(KeyError):
+    """Raised by lookup_unique() when several players share the requested name"""
+    pass
+
+#############################################################
+class PlayerStore(object):
+    """
+    Name/ID indexed player records of a cleaned FIFA19 dataset
+
+    Parameter:
+    matrix: player matrix arrays, see player_matrix.py. Use from_frame() or
+            from_matrix_dir() to build the store from a DataFrame or from the
+            memory-mapped matrix written by process_data.py
+    """
+    def __init__(self, matrix):
+        self.matrix   = matrix
+        self.ids      = matrix['ids']
+        self.names    = matrix['names']
+        self.position = matrix['position']
+        self.overall  = matrix['overall']
+        self.abilities = {
+            "GK":  matrix['abilities_GK'],
+            "nGK": matrix['abilities_nGK'],
+        }
+        self.first_row = matrix['first_row']
+
+        # Name -> all of its rows, in dataset order
+        codes, uniques = pd.factorize(self.names)
+        order          = np.argsort(codes, kind='stable')
+        bounds         = np.flatnonzero(np.diff(codes[order])) + 1
+        self.rows_by_name = dict(zip(uniques.tolist(), np.split(order, bounds)))
+
+        self.row_by_id = dict(zip(self.ids.tolist(), range(len(self.ids))))
+        if len(self.row_by_id) != len(self.ids):
+            raise ValueError("Player IDs are not unique")
+
+    @classmethod
+    def from_frame(cls, data):
+        """
+        Build the store of a cleaned dataset loaded in a DataFrame
+        """
+        return cls(build_player_matrix(data))
+
+    @classmethod
+    def from_matrix_dir(cls, dirpath):
+        """
+        Build the store on the read-only memory-mapped player matrix written by
+        process_data.py --player-matrix, shared by every process mapping it
+        """
+        return cls(open_player_matrix(dirpath))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, name):
+        return name in self.rows_by_name
+
+    def ability_matrix(self, position):
+        """
+        Return the ability matrix (one row per player) compared for the given position
+        """
+        if position == "GK":
+            return self.abilities["GK"]
+        else:
+            return self.abilities["nGK"]
+
+    def rows_for_name(self, name):
+        """
+        Return the rows of every player with the given name
+        """
+        if name not in self.rows_by_name:
+            raise PlayerNotFound(name)
+        return self.rows_by_name[name]
+
+    def is_ambiguous(self, name):
+        return len(self.rows_for_name(name)) > 1
+
+    def record(self, row):
+        """
+        Build the compact record of the player stored at the given row
+        """
+        position = str(self.position[row])
+        return PlayerRecord(row             = int(row),
+                            id              = self.ids[row].item(),
+                            name            = str(self.names[row]),
+                            position        = position,
+                            overall         = self.overall[row].item(),
+                            ability_columns = feature_columns(position),
+                            abilities       = self.ability_matrix(position)[row].tolist())
+
+    def lookup(self, name):
+        """
+        Return the record of the first player with the given name
+        """
+        return self.record(self.rows_for_name(name)[0])
+
+    def lookup_unique(self, name):
+        """
+        Return the record of the player with the given name, refusing ambiguous names
+        """
+        rows = self.rows_for_name(name)
+        if len(rows) > 1:
+            raise AmbiguousPlayerName(name)
+        return self.record(rows[0])
+
+    def lookup_id(self, player_id):
+        """
+        Return the record of the player with the given FIFA ID
+        """
+        if player_id not in self.row_by_id:
+            raise PlayerNotFound(player_id)
+        return self.record(self.row_by_id[player_id])
+
+    def candidate_count(self, row):
+        """
+        Return the number of candidates most_similar_rows() scores for the player at the given row
+        """
+        matrix = self.matrix
+        bucket = np.flatnonzero(matrix['bucket_positions'] == self.position[row])
+        if len(bucket) == 0:
+            return 0
+        start, stop = matrix['bucket_offsets'][bucket[0]], matrix['bucket_offsets'][bucket[0]+1]
+        rows = matrix['bucket_rows'][start:stop]
+        return int(np.count_nonzero((matrix['bucket_overall'][start:stop] > self.overall[row]*0.8) &
+                                    (rows == matrix['bucket_first_row'][start:stop]) & (rows != row)))
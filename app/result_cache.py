@@ -0,0 +1,127 @@
+"""
+Result Cache
+Bounded LRU cache, with an optional time to live, in front of the similarity search
+
+Entries are keyed by (player, n, feature set). The cache is bound to the object
+that produces its entries (the SimilarityEngine of the loaded dataset): binding
+another one, when the dataset is reloaded, drops every entry. Requests still
+running on a previous dataset get their results computed, not cached.
+
+The cache also counts the requests per key, so the most requested players can
+be saved at exit and computed again at the next startup (warming). Only the
+counts of the maxsize most requested keys are kept: once twice as many keys
+are counted, the least requested ones are dropped.
+"""
+
+import json
+import time
+import threading
+import collections
+
+#############################################################
+class LRUCache(object):
+    """
+    Thread-safe least recently used cache
+
+    Parameter:
+    maxsize: maximum number of entries, the least recently used one is evicted first
+    ttl:     seconds an entry stays valid, None to keep entries until evicted
+    """
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize   = maxsize
+        self.ttl       = ttl
+        self.entries   = collections.OrderedDict()
+        self.requests  = collections.Counter()
+        self.source    = None
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+        self.lock      = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def bind(self, source):
+        """
+        Bind the cache to the object its values are computed from, dropping
+        every entry if it is a different one
+        """
+        with self.lock:
+            if source is not self.source:
+                self.entries.clear()
+                self.source = source
+
+    def get_or_compute(self, key, compute, source=None):
+        """
+        Return the cached value of key, or compute(), cache and return it
+
+        Parameter:
+        key:     hashable cache key
+        compute: function without arguments computing the value
+        source:  object the value is computed from, values of another source
+                 than the bound one are not cached
+        """
+        with self.lock:
+            self.requests[key] += 1
+            if len(self.requests) > 2 * self.maxsize:
+                self.requests = collections.Counter(dict(self.requests.most_common(self.maxsize)))
+            stale = source is not self.source
+        if stale:
+            return compute()
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.time() - entry[1] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        # computed outside of the lock, concurrent misses of the same key may compute it twice
+        value = compute()
+
+        with self.lock:
+            if source is self.source:
+                self.entries[key] = (value, time.time())
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        return value
+
+    def stats(self):
+        """
+        Return the size and the hit/miss/eviction counters of the cache
+        """
+        with self.lock:
+            return {'size': len(self.entries), 'maxsize': self.maxsize,
+                    'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def most_requested(self, k):
+        """
+        Return the k most requested keys, most requested first
+        """
+        with self.lock:
+            return [key for key, _ in self.requests.most_common(k)]
+
+#############################################################
+def save_warm_keys(cache, filepath, k=100):
+    """
+    Save the k most requested keys of the cache as a JSON list
+    """
+    with open(filepath, 'w') as f:
+        json.dump(cache.most_requested(k), f)
+
+def load_warm_keys(filepath):
+    """
+    Load the keys saved by save_warm_keys(), an empty list if the file does not exist
+    """
+    try:
+        with open(filepath) as f:
+            return [tuple(tuple(part) if isinstance(part, list) else part for part in key) for key in json.load(f)]
+    except (IOError, ValueError):
+        return []
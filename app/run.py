@@ -1,23 +1,140 @@
+import os
+import sys
 import json
+import time
+import atexit
 import plotly
 import pandas as pd
 import numpy  as np
 from math  import sqrt
 from flask import Flask
-from flask import render_template, request, jsonify
-from plotly.graph_objs import Bar
-from plotly.graph_objs import Pie
-from plotly.graph_objs import Heatmap
+from flask import render_template, request, jsonify, make_response
 from plotly.graph_objs import Scatterpolar
 from sklearn.externals import joblib
 
+#modules shared with the ETL pipeline live next to process_data.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from similarity import SimilarityEngine, NeighbourTableEngine, feature_columns, cols_GK, cols_nGK
+from ann_index import ApproximateSimilarityEngine
+from player_store import PlayerStore, PlayerNotFound
+from dashboard import feature_list, dashboard_columns
+from result_cache import LRUCache, save_warm_keys, load_warm_keys
+from snapshot import DataSnapshot, SnapshotManager, SnapshotOutdated
+from sqlite_backend import SqliteSnapshot, BackendUnavailable
+from compute_pool import ComputePool, PoolSaturated, ComputeTimeout
+from valuation import Valuator, ValuationUnavailable
+from player_filter import InvalidQuery, Result_Columns, filter_columns
+from aggregate_cube import InvalidCubeQuery, Dimensions, cube_columns
+from metrics import RequestMetrics
+
 app = Flask(__name__)
 
-# load data
-cleaned_df = pd.read_csv('../data/cleaned_data.csv')
-#feature list for graph five: FIFA 19 dataset important feature correlation heatmap display
-feature_list = ['Age','Overall','Potential','International Reputation','PAC','SHO','PAS','DRI','DEF','PHY',
-                'DIV','HAN','KIC','REF','SPD','POS','Value_Number_K','Wage_Number_K','ReleaseClause_Number_K']
+# load data, only the columns used by the app
+data_filepath  = '../data/cleaned_data.csv'
+app_columns    = list(dict.fromkeys(['ID', 'Name', 'Position', 'Overall'] + cols_nGK + cols_GK + dashboard_columns +
+                                    filter_columns + cube_columns))
+
+# FIFA19_BACKEND=sqlite queries the database written by process_data.py --sqlite instead of loading
+# the dataset, see sqlite_backend.py: near-instant startup, memory independent of the number of players
+backend        = os.environ.get('FIFA19_BACKEND', 'memory')
+
+# approximate similar-player search (see ann_index.py), off unless FIFA19_ANN_PROBE is set; only the
+# positions with at least FIFA19_ANN_MIN_SIZE candidates are indexed
+ann_n_probe    = int(os.environ.get('FIFA19_ANN_PROBE', 0))
+ann_list_size  = int(os.environ.get('FIFA19_ANN_LIST_SIZE', 256))
+ann_min_size   = int(os.environ.get('FIFA19_ANN_MIN_SIZE', 1024))
+
+# largest squad and most similar players per player accepted by /api/similar, largest list of players valued by /api/value,
+# most names suggested by /api/autocomplete, most players returned by /search, most cells returned by /api/cube,
+# most departing players replaced by /api/replace
+max_batch_size = 500
+max_neighbours = 100
+max_valuation_size = 10000
+max_suggestions = 50
+max_search_size = 1000
+max_cube_cells = 10000
+max_squad_size = 11
+
+# market value model, loaded at the first /api/value request; concurrent valuations arriving
+# within FIFA19_VALUATION_WAIT seconds share one predict call
+valuator       = Valuator(os.environ.get('FIFA19_MODEL', '../Jupyter Notebook/model.p'),
+                          max_wait=float(os.environ.get('FIFA19_VALUATION_WAIT', 0.002)))
+
+# most_similar() results cache; FIFA19_CACHE_WARM names a file keeping the most requested players between runs
+result_cache   = LRUCache(maxsize=int(os.environ.get('FIFA19_CACHE_SIZE', 1024)),
+                          ttl=float(os.environ['FIFA19_CACHE_TTL']) if os.environ.get('FIFA19_CACHE_TTL') else None)
+cache_warm_filepath = os.environ.get('FIFA19_CACHE_WARM')
+
+# similarity searches run in a bounded pool: FIFA19_COMPUTE_WORKERS running, FIFA19_COMPUTE_QUEUE
+# waiting, FIFA19_COMPUTE_TIMEOUT seconds per request, HTTP 503 beyond
+compute_pool   = ComputePool(workers=int(os.environ.get('FIFA19_COMPUTE_WORKERS', os.cpu_count() or 1)),
+                             max_queue=int(os.environ.get('FIFA19_COMPUTE_QUEUE', 16)),
+                             timeout=float(os.environ.get('FIFA19_COMPUTE_TIMEOUT', 10)))
+
+# hot reload of the dataset: FIFA19_RELOAD_INTERVAL polls the data files every N seconds,
+# FIFA19_ADMIN_TOKEN enables POST /admin/reload with the token in the X-Admin-Token header
+reload_interval = float(os.environ.get('FIFA19_RELOAD_INTERVAL', 0))
+admin_token     = os.environ.get('FIFA19_ADMIN_TOKEN')
+
+# request counters and latency histograms on /metrics; requests slower than FIFA19_SLOW_MS milliseconds
+# are logged, and with FIFA19_PROFILE_DIR their stacks, sampled every FIFA19_PROFILE_INTERVAL seconds,
+# are saved there as flamegraph input
+metrics         = RequestMetrics(slow_threshold=float(os.environ['FIFA19_SLOW_MS']) / 1000
+                                                if os.environ.get('FIFA19_SLOW_MS') else None,
+                                 profile_dirpath=os.environ.get('FIFA19_PROFILE_DIR'),
+                                 sample_interval=float(os.environ.get('FIFA19_PROFILE_INTERVAL', 0.005)))
+metrics.init_app(app)
+metrics.register('fifa19_compute_pending', 'gauge', 'Similarity searches running or queued in the compute pool',
+                 lambda: compute_pool.stats()['pending'])
+metrics.register('fifa19_compute_rejected_total', 'counter', 'Similarity searches refused because the pool was full',
+                 lambda: compute_pool.stats()['rejected'])
+metrics.register('fifa19_compute_timeouts_total', 'counter', 'Similarity searches that did not finish in time',
+                 lambda: compute_pool.stats()['timeouts'])
+metrics.register('fifa19_cache_entries', 'gauge', 'Similar-player results in the result cache',
+                 lambda: result_cache.stats()['size'])
+metrics.register('fifa19_cache_hits_total', 'counter', 'Similar-player searches answered from the result cache',
+                 lambda: result_cache.stats()['hits'])
+metrics.register('fifa19_cache_misses_total', 'counter', 'Similar-player searches computed and cached',
+                 lambda: result_cache.stats()['misses'])
+metrics.register('fifa19_cache_evictions_total', 'counter', 'Results evicted from the full result cache',
+                 lambda: result_cache.stats()['evictions'])
+metrics.register('fifa19_players', 'gauge', 'Players of the dataset being served',
+                 lambda: len(snapshots.current.player_store))
+metrics.register('fifa19_reloads_total', 'counter', 'Datasets swapped in since the app started',
+                 lambda: snapshots.reloads)
+
+def build_similarity_engine(store, neighbour_table=None):
+    #precomputed position-filtered ability matrices used by most_similar()
+    if ann_n_probe > 0:
+        engine = ApproximateSimilarityEngine(store, list_size=ann_list_size, n_probe=ann_n_probe,
+                                             min_size=ann_min_size)
+    else:
+        engine = SimilarityEngine(store)
+    #similar players precomputed by process_data.py --neighbours, searched live beyond its K
+    if neighbour_table is not None:
+        engine = NeighbourTableEngine(neighbour_table, engine)
+    return engine
+
+def load_snapshot():
+    if backend == 'sqlite':
+        return SqliteSnapshot(data_filepath)
+    #with hot reload, each snapshot keeps the dashboard of its own dataset
+    return DataSnapshot(data_filepath, app_columns, build_similarity_engine,
+                        watch_dashboard=not (reload_interval > 0 or admin_token))
+
+snapshots = SnapshotManager(load_snapshot)
+
+def use_snapshot(snapshot):
+    #module level names of the current dataset, requests read snapshots.current instead
+    global cleaned_df, player_store, similarity_engine, dashboard
+    cleaned_df        = snapshot.cleaned_df
+    player_store      = snapshot.player_store
+    similarity_engine = snapshot.similarity_engine
+    dashboard         = snapshot.dashboard
+    result_cache.bind(similarity_engine)
+
+use_snapshot(snapshots.current)
+snapshots.on_swap(use_snapshot)
 
 ################################################################################
 #Use this function to measure the similarity by Pearson correlation coefficient.
@@ -59,39 +176,65 @@ def sim_pearson(data, feature_to_compare, player1, player2):
     return r
 
 ################################################################################
-def most_similar(data, player, n=4):
+def most_similar(data, player, n=4, snapshot=None, row=None):
     """
     This function find the most similar player to the provided player
+    The ranking is computed by SimilarityEngine, which gives the same result
+    as scoring every candidate name once with sim_pearson()
     
     Parameter:
     data:   input dataset
     player: a player name as the Recommendation template
+    n:      number of similar players to return
+    snapshot: DataSnapshot the request works on, the current one by default
+    row:    row of the template player, e.g. looked up by FIFA ID when several players
+            share its name; the first player with the name by default
 
     return:
     another player who is most similar to the Recommendation template player
     """
-    scores = [ ]
-    
-    player_position = data.loc[data['Name']==player, 'Position'].values[0]
-    player_overall  = data.loc[data['Name']==player, 'Overall'].values[0]
-    
-    if player_position == "GK":
-        feature_to_compare = ['DIV', 'HAN', 'KIC', 'REF', 'SPD', 'POS']
-    else:
-        feature_to_compare = ['PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']
-    
-    for candidate in data['Name']:
-        if candidate != player:
-            candidate_position = data.loc[data['Name']==candidate, 'Position'].values[0]
-            candidate_overall  = data.loc[data['Name']==candidate, 'Overall'].values[0]
-            if ((candidate_position == player_position) and (candidate_overall > player_overall*0.8)):
-                scores += [(sim_pearson(data, feature_to_compare, player, candidate), candidate)]
-    
-    # Sort the list so the highest scores appear at the top scores.sort( )
-    scores.sort( )
-    scores.reverse( )
-    return scores[0:n]
-
+    snapshot = snapshot or snapshots.current
+    if data is not snapshot.cleaned_df:
+        engine = SimilarityEngine(PlayerStore.from_frame(data))
+        if row is None:
+            return engine.most_similar(player, n)
+        return [(score, name) for score, name, _ in engine.most_similar_rows([row], n)[0]]
+
+    # results of the loaded dataset are cached, by player, n and compared features;
+    # the players after the first one of a name are keyed by FIFA ID
+    engine = snapshot.similarity_engine
+    first  = engine.store.rows_for_name(player)[0]
+    if row is None or row == first:
+        position = str(engine.store.position[first])
+        key      = (player, n, tuple(feature_columns(position)))
+        return list(result_cache.get_or_compute(key, lambda: engine.most_similar(player, n), source=engine))
+    position = str(engine.store.position[row])
+    key      = (engine.store.ids[row].item(), n, tuple(feature_columns(position)))
+    return list(result_cache.get_or_compute(
+        key, lambda: [(score, name) for score, name, _ in engine.most_similar_rows([row], n)[0]], source=engine))
+
+
+def warm_cache(snapshot, keys):
+    for player, n, _ in keys:
+        if isinstance(player, int):
+            # a player keyed by FIFA ID, see most_similar()
+            try:
+                template = snapshot.player_store.lookup_id(player)
+            except PlayerNotFound:
+                continue
+            most_similar(snapshot.cleaned_df, template.name, n, snapshot=snapshot, row=template.row)
+        elif player in snapshot.player_store:
+            most_similar(snapshot.cleaned_df, player, n, snapshot=snapshot)
+
+#warm the cache with the players most requested by the previous run,
+#and with the most requested players after each reload
+if cache_warm_filepath:
+    warm_cache(snapshots.current, load_warm_keys(cache_warm_filepath))
+    atexit.register(save_warm_keys, result_cache, cache_warm_filepath)
+snapshots.on_swap(lambda snapshot: warm_cache(snapshot, result_cache.most_requested(100)))
+
+if reload_interval > 0:
+    snapshots.watch(reload_interval)
 
 
 # index webpage displays cool visuals and receives user input text for model
@@ -99,211 +242,68 @@ def most_similar(data, player, n=4):
 @app.route('/index')
 def index():
     
-    # create visuals
-    graphs = [
-        # Graph 1: FIFA19 Players' Age Distribution 
-        {
-            'data': [
-                Pie(
-                    labels = cleaned_df.Age.value_counts().to_frame().index,
-                    values = cleaned_df.Age.value_counts().to_frame().Age
-                )
-            ],
-            'layout': { 'title': 'FIFA 19 Players Age Distribution' }
-        },
-        
-        # Graph 2: FIFA19 Players' Position Distribution 
-        {
-            'data': [
-                Pie(
-                    labels = cleaned_df.Position.value_counts().to_frame().index,
-                    values = cleaned_df.Position.value_counts().to_frame().Position
-                )
-            ],
-            'layout': { 'title': 'FIFA 19 Players Position Distribution' }
-        },
-        
-        # Graph 3: FIFA 19 Top 20 clubs with highest total player market value
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Club")["Value_Number_K"].sum().sort_values(ascending=False).head(20).to_frame().index,
-                    y=cleaned_df.groupby("Club")["Value_Number_K"].sum().sort_values(ascending=False).head(20).to_frame().Value_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'FIFA 19 Top 20 clubs with highest total player market value',
-                'yaxis': { 'title': "Total Market Value of the Players (in thousands)" },
-                'xaxis': { 'title': "Club" }
-            }
-        },
-
-        # Graph 4: FIFA 19 Top 20 clubs with highest average wage
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Club")["Wage_Number_K"].mean().sort_values(ascending=False).head(20).to_frame().index,
-                    y=cleaned_df.groupby("Club")["Wage_Number_K"].mean().sort_values(ascending=False).head(20).to_frame().Wage_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'FIFA 19 Top 20 clubs with highest average wage',
-                'yaxis': { 'title': "Average wage of the Players (in thousands)" },
-                'xaxis': { 'title': "Club" }
-            }
-        },
-
-        # Graph 5: Average value for each position
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Position")["Value_Number_K"].mean().sort_values(ascending=False).to_frame().index,
-                    y=cleaned_df.groupby("Position")["Value_Number_K"].mean().sort_values(ascending=False).to_frame().Value_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'Average value for each position',
-                'yaxis': { 'title': "Average value for each position (in thousands)" },
-                'xaxis': { 'title': "Position" }
-            }
-        },
-
-        # Graph 6: Average wage for each position
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Position")["Wage_Number_K"].mean().sort_values(ascending=False).to_frame().index,
-                    y=cleaned_df.groupby("Position")["Wage_Number_K"].mean().sort_values(ascending=False).to_frame().Wage_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'Average wage for each position',
-                'yaxis': { 'title': "Average wage for each position (in thousands)" },
-                'xaxis': { 'title': "Position" }
-            }
-        },
-
-        # Graph 7: Average value for each age
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Age")["Value_Number_K"].mean().sort_values(ascending=False).to_frame().index,
-                    y=cleaned_df.groupby("Age")["Value_Number_K"].mean().sort_values(ascending=False).to_frame().Value_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'Average value for each age',
-                'yaxis': { 'title': "Average value for each age (in thousands)" },
-                'xaxis': { 'title': "Age" }
-            }
-        },
-
-        # Graph 8: Average wage for each age
-        {
-            'data': [
-                Bar(
-                    x=cleaned_df.groupby("Age")["Wage_Number_K"].mean().sort_values(ascending=False).to_frame().index,
-                    y=cleaned_df.groupby("Age")["Wage_Number_K"].mean().sort_values(ascending=False).to_frame().Wage_Number_K
-                )
-            ],
-
-            'layout': {
-                'title': 'Average wage for each age',
-                'yaxis': { 'title': "Average wage for each Age (in thousands)" },
-                'xaxis': { 'title': "Age" }
-            }
-        },
-        
-        # Graph 9: FIFA 19 dataset important feature correlation heatmap display
-        {
-            'data': [
-                Heatmap(
-                    z=np.array(cleaned_df[feature_list].corr()),
-                    x=feature_list,
-                    y=feature_list,
-                    colorscale='Jet'
-                )
-            ],
-
-            'layout': { 'title': 'FIFA19 dataset important feature correlation heatmap display' }
-        },
-        
-
-    ]
-    
-    # encode plotly graphs in JSON
-    ids = ["graph-{}".format(i) for i, _ in enumerate(graphs)]
-    graphJSON = json.dumps(graphs, cls=plotly.utils.PlotlyJSONEncoder)
+    # visuals are built and encoded in JSON once per version of the data file
+    with metrics.phase('dashboard'):
+        payload = snapshots.current.dashboard.get()
     
     # render web page with plotly graphs
-    return render_template('master.html', ids=ids, graphJSON=graphJSON)
+    if payload.html is None:
+        with metrics.phase('render'):
+            payload.html = render_template('master.html', ids=payload.ids, graphJSON=payload.graphJSON)
+    
+    # let browsers and proxies revalidate with If-None-Match / If-Modified-Since
+    response = make_response(payload.html)
+    response.set_etag(payload.etag)
+    response.last_modified = payload.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # web page that handles user input, a player's name and displays similar players
 @app.route('/go')
 def go():
-    # save user input in query
-    query = request.args.get('query', '') 
-
-    # use most_similar() function to find the most similar players
-    Results = most_similar(cleaned_df, query)
+    # save user input in query, a FIFA player ID can be given instead of the name
+    query     = request.args.get('query', '') 
+    player_id = request.args.get('id', type=int)
+
+    # the whole request works on the dataset loaded when it started
+    snapshot     = snapshots.current
+    player_store = snapshot.player_store
+    # the row of the player is kept: an ID designates one of the players sharing a name
+    with metrics.phase('lookup'):
+        if player_id is not None:
+            row = player_store.lookup_id(player_id).row
+        elif query in player_store:
+            row = player_store.rows_for_name(query)[0]
+        else:
+            # a misspelt or partial name goes to the player it matches best, see name_index.py
+            row = snapshot.name_index.resolve(query)
+            if row is None:
+                raise PlayerNotFound(query)
+        query = str(player_store.names[row])
+    metrics.note(player=query, candidates=lambda: player_store.candidate_count(row))
+
+    # use most_similar() function to find the most similar players, in the compute pool
+    with metrics.phase('most_similar'):
+        Results = compute_pool.run(metrics.traced(most_similar), snapshot.cleaned_df, query, snapshot=snapshot,
+                                   row=row)
 
     # create radar visuals
     # Basic Abailties
-    cols_nGK  = ['PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']
-    cols_GK   = ['DIV', 'HAN', 'KIC', 'REF', 'SPD', 'POS']
-    position_type = cleaned_df.loc[cleaned_df['Name'] == query, 'Position'].values[0]
-    
-    if position_type == "GK":
-        cols = cols_GK
-    else:
-        cols = cols_nGK
+    template = player_store.record(row)
+    similar  = [player_store.lookup(name) for _, name in Results]
+    cols     = template.ability_columns
 
     graphs = [
         # Graph 1: FIFA19 Players' Age Distribution 
         {
             'data': [
                 Scatterpolar(
-                	r = [
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[0]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[1]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[2]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[3]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[4]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == query, cols[5]].values[0]
-                	],
-                    theta = cols,
-                    name  = query
-                ),
-                Scatterpolar(
-                	r = [
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[0]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[1]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[2]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[3]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[4]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[0][1], cols[5]].values[0]
-                	],
-                    theta = cols,
-                    name  = Results[0][1]
-                ),
-                Scatterpolar(
-                	r = [
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[0]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[1]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[2]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[3]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[4]].values[0],
-                	cleaned_df.loc[cleaned_df['Name'] == Results[1][1], cols[5]].values[0]
-                	],
+                    r     = player.abilities,
                     theta = cols,
-                    name  = Results[1][1]
-                ),
+                    name  = player.name
+                )
+                for player in [template] + similar[0:2]
             ],
             'layout': {
             	'title': 'FIFA 19 Players Age Distribution',
@@ -314,20 +314,341 @@ def go():
     ]
 
     # This will render the go.html Please see that file. 
-    return render_template(
-        'go.html',
-        query=query,
-        TPlayer1=Results[0][1],
-        TPlayer2=Results[1][1],
-        TPlayer3=Results[2][1],
-        TPlayer4=Results[3][1],
-    )
+    with metrics.phase('render'):
+        return render_template(
+            'go.html',
+            query=query,
+            TPlayer1=Results[0][1],
+            TPlayer2=Results[1][1],
+            TPlayer3=Results[2][1],
+            TPlayer4=Results[3][1],
+        )
+
+
+# JSON API: player names matching what the user typed so far, exact, prefix and fuzzy matches
+@app.route('/api/autocomplete')
+def api_autocomplete():
+    """
+    Query string:  q=<text>&limit=10
+    Response body: {"query", "results": [{"id", "name", "position", "overall", "match", "score"}]}
+    """
+    query = request.args.get('q', '')
+    try:
+        limit = max(min(int(request.args.get('limit', 10)), max_suggestions), 1)
+    except ValueError:
+        return jsonify(error='limit must be an integer'), 400
+    with metrics.phase('name_search'):
+        results = snapshots.current.name_index.search(query, limit)
+    with metrics.phase('serialize'):
+        return jsonify(query=query, results=results)
+
+
+# JSON API: players meeting conditions on several columns, e.g. young CBs with a high Potential
+@app.route('/search', methods=['GET', 'POST'])
+def search():
+    """
+    Request body:  {"filters": {"Position": ["CB"], "Age": {"max": 23}, "Potential": {"min": 80}},
+                    "order_by": "Potential", "descending": true, "limit": 20, "offset": 0}
+    or query string: /search?Position=CB&Age=..23&Potential=80..&order_by=Potential&limit=20
+    Response body: {"found", "results": [{"ID", "Name", ...}], "took_ms"}
+    """
+    start         = time.perf_counter()
+    player_filter = snapshots.current.player_filter
+    if request.method == 'POST':
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict) or not isinstance(payload.get('filters', {}), dict):
+            return jsonify(error='expected a JSON body {"filters": {column: condition}, "order_by", "limit"}'), 400
+        filters = payload.get('filters', {})
+    else:
+        payload = request.args.to_dict()
+        filters = player_filter.parse_arguments(dict((column, text) for column, text in payload.items()
+                                                     if column not in ('order_by', 'descending', 'limit', 'offset')))
+    order_by   = payload.get('order_by')
+    descending = str(payload.get('descending', True)).lower() not in ('0', 'false')
+    try:
+        limit  = max(min(int(payload.get('limit', 20)), max_search_size), 0)
+        offset = max(int(payload.get('offset', 0)), 0)
+    except (TypeError, ValueError):
+        return jsonify(error='limit and offset must be integers'), 400
+
+    try:
+        with metrics.phase('filter'):
+            found, rows = player_filter.search(filters, order_by, descending, limit, offset)
+    except InvalidQuery as error:
+        return jsonify(error=str(error)), 400
+    metrics.note(filters=filters, found=found)
+    columns = list(dict.fromkeys(Result_Columns + list(filters) + ([order_by] if order_by else [])))
+    with metrics.phase('serialize'):
+        return jsonify(found=found, results=player_filter.records(rows, columns),
+                       took_ms=(time.perf_counter() - start) * 1000)
+
+
+# JSON API: count/sum/mean/min/max of the players' values, wages and ratings by Club, Position,
+# Age, Nationality, Work Rate and Body Type, read from the aggregate cube instead of the player rows
+@app.route('/api/cube')
+def api_cube():
+    """
+    Query string:  /api/cube?group_by=Nationality,Position&Club=Chelsea&measure=Value_Number_K&stat=mean
+                   &order_by=Value_Number_K_mean&descending=true&limit=100
+    Response body: {"group_by", "found", "cells": [{"Nationality", "Position", "count", "Value_Number_K_mean"}],
+                    "took_ms"}
+    Every dimension not grouped by is rolled up; measure and stat default to all of them.
+    """
+    start    = time.perf_counter()
+    split    = lambda text: [item for item in text.split(',') if item] if text else None
+    group_by = split(request.args.get('group_by')) or []
+    where    = dict((column, text.split(',')) for column, text in request.args.items() if column in Dimensions)
+    order_by = request.args.get('order_by')
+    try:
+        limit = max(min(int(request.args.get('limit', 100)), max_cube_cells), 0)
+    except ValueError:
+        return jsonify(error='limit must be an integer'), 400
+
+    try:
+        with metrics.phase('cube_query'):
+            cells = snapshots.current.aggregate_cube.query(group_by, where, split(request.args.get('measure')),
+                                                           split(request.args.get('stat')))
+    except InvalidCubeQuery as error:
+        return jsonify(error=str(error)), 400
+    if order_by is not None:
+        if order_by not in cells:
+            return jsonify(error='cannot order by {!r}'.format(order_by)), 400
+        descending = request.args.get('descending', 'true').lower() not in ('0', 'false')
+        cells = cells.sort_values(order_by, ascending=not descending, kind='stable')
+    elif group_by:
+        cells = cells.sort_values(group_by, kind='stable')
+
+    found = len(cells)
+    cells = cells.head(limit).astype(object)
+    with metrics.phase('serialize'):
+        return jsonify(group_by=group_by, found=found, cells=cells.where(cells.notnull(), None).to_dict('records'),
+                       took_ms=(time.perf_counter() - start) * 1000)
+
+
+# JSON API: similar players of a whole squad, scored in one batched matrix operation
+@app.route('/api/similar', methods=['POST'])
+def api_similar():
+    """
+    Request body:  {"players": [names or FIFA IDs], "n": 4}
+    Response body: {"n": 4, "results": [{"query", "id", "name", "similar": [{"id", "name", "score"}]}]}
+    A player that is not found gets an "error" entry instead of "similar". A FIFA ID is searched with the
+    position, Overall and abilities of its own player, a name with those of the first player carrying it;
+    a name shared by several players is a similar player once, as its first player.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('players'), list):
+        return jsonify(error='expected a JSON body {"players": [names or IDs], "n": 4}'), 400
+    players = payload['players']
+    n       = payload.get('n', 4)
+    if len(players) > max_batch_size:
+        return jsonify(error='at most {} players per request'.format(max_batch_size)), 400
+    if not isinstance(n, int) or isinstance(n, bool) or n < 1 or n > max_neighbours:
+        return jsonify(error='n must be an integer between 1 and {}'.format(max_neighbours)), 400
+
+    snapshot     = snapshots.current
+    player_store = snapshot.player_store
+    with metrics.phase('lookup'):
+        results, rows, found = resolve_players(player_store, players)
+    metrics.note(players=len(rows), candidates=lambda: sum(player_store.candidate_count(row) for row in rows))
+
+    with metrics.phase('most_similar'):
+        similars = compute_pool.run(metrics.traced(snapshot.similarity_engine.most_similar_rows), rows, n)
+    for result, similar in zip(found, similars):
+        result['similar'] = [{'id': player_store.ids[row].item(), 'name': name, 'score': score}
+                             for score, name, row in similar]
+
+    with metrics.phase('serialize'):
+        return jsonify(n=n, results=results)
+
+
+# JSON API: best similar replacements of departing players, within a transfer budget
+@app.route('/api/replace', methods=['POST'])
+def api_replace():
+    """
+    Request body:  {"players": [names or FIFA IDs leaving], "budget_k": 150000, "exclude": [names or FIFA IDs],
+                    "time_limit": 1.0}
+    Response body: {"budget_k", "cost_k", "score", "optimal", "candidates", "results": [{"query", "id", "name",
+                    "replacement": {"id", "name", "position", "overall", "score", "value_k", "wage_k"}}], "took_ms"}
+    The replacements are picked among each player's most_similar() candidates, none twice, maximizing
+    the sum of the scores with a total Value_Number_K + Wage_Number_K within budget_k. "replacement" is
+    null when no squad fits the budget; "optimal" is false when time_limit stopped the search first.
+    """
+    start   = time.perf_counter()
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('players'), list) or \
+       not isinstance(payload.get('exclude', []), list):
+        return jsonify(error='expected a JSON body {"players": [names or IDs], "budget_k": 150000}'), 400
+    players = payload['players']
+    if len(players) > max_squad_size:
+        return jsonify(error='at most {} players per request'.format(max_squad_size)), 400
+    try:
+        budget     = float(payload['budget_k'])
+        time_limit = min(float(payload.get('time_limit', 1.0)), compute_pool.timeout or float('inf'))
+    except (KeyError, TypeError, ValueError):
+        return jsonify(error='budget_k and time_limit must be numbers'), 400
+
+    snapshot     = snapshots.current
+    player_store = snapshot.player_store
+    with metrics.phase('lookup'):
+        results, rows, found = resolve_players(player_store, players)
+        _, exclude, _        = resolve_players(player_store, payload.get('exclude', []))
+    metrics.note(players=len(rows), budget_k=budget)
+
+    with metrics.phase('optimize'):
+        squad = compute_pool.run(metrics.traced(snapshot.squad_optimizer.optimize), rows, budget, exclude,
+                                 time_limit)
+    metrics.note(candidates=squad['scored'], kept=squad['kept'], nodes=squad['nodes'])
+    for result, pick in zip(found, squad['picks']):
+        if pick is None:
+            result['replacement'] = None
+            continue
+        row, score, _ = pick
+        player = player_store.record(row)
+        result['replacement'] = {'id': player.id, 'name': player.name, 'position': player.position,
+                                 'overall': player.overall, 'score': score,
+                                 'value_k': snapshot.money['Value_Number_K'][row].item(),
+                                 'wage_k': snapshot.money['Wage_Number_K'][row].item()}
+
+    with metrics.phase('serialize'):
+        return jsonify(budget_k=budget, cost_k=squad['cost'], score=squad['score'], optimal=squad['optimal'],
+                       candidates={'scored': squad['scored'], 'kept': squad['kept'], 'nodes': squad['nodes']},
+                       results=results, took_ms=(time.perf_counter() - start) * 1000)
+
+
+def resolve_players(player_store, players):
+    """
+    Look the players of a JSON API request up by FIFA ID or name
+
+    Returns:
+    results: one entry per requested player, {"query", "id", "name"} or {"query", "error"}
+    rows:    store rows of the players found
+    found:   the results entries of the players found, in the order of rows
+    """
+    results, rows, found = [], [], []
+    for query in players:
+        try:
+            if isinstance(query, int) and not isinstance(query, bool):
+                player = player_store.lookup_id(query)
+            else:
+                player = player_store.lookup(str(query))
+        except PlayerNotFound:
+            results.append({'query': query, 'error': 'player not found'})
+            continue
+        results.append({'query': query, 'id': player.id, 'name': player.name})
+        rows.append(player.row)
+        found.append(results[-1])
+    return results, rows, found
+
+
+# JSON API: predicted market values of a list of players, in thousands of euros
+@app.route('/api/value', methods=['POST'])
+def api_value():
+    """
+    Request body:  {"players": [names or FIFA IDs]}
+    Response body: {"results": [{"query", "id", "name", "value_k", "predicted_value_k"}]}
+    A player that is not found gets an "error" entry instead of the values.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or not isinstance(payload.get('players'), list):
+        return jsonify(error='expected a JSON body {"players": [names or IDs]}'), 400
+    players = payload['players']
+    if len(players) > max_valuation_size:
+        return jsonify(error='at most {} players per request'.format(max_valuation_size)), 400
+
+    snapshot = snapshots.current
+    with metrics.phase('lookup'):
+        results, rows, found = resolve_players(snapshot.player_store, players)
+    metrics.note(players=len(rows))
+    with metrics.phase('predict'):
+        predicted, actual = valuator.value_rows(snapshot, rows, timeout=compute_pool.timeout)
+    for result, value_k, predicted_value_k in zip(found, actual.tolist(), predicted.tolist()):
+        result['value_k']           = value_k
+        result['predicted_value_k'] = predicted_value_k
+
+    with metrics.phase('serialize'):
+        return jsonify(results=results)
+
+
+# throughput of the valuations so far
+@app.route('/api/value/stats')
+def api_value_stats():
+    return jsonify(valuator.stats() or {})
+
+
+# Prometheus metrics of the requests served by this process, see metrics.py
+@app.route('/metrics')
+def prometheus_metrics():
+    response = make_response(metrics.render())
+    response.mimetype = 'text/plain; version=0.0.4'
+    return response
+
+
+# no player matches the name or ID of /go
+@app.errorhandler(PlayerNotFound)
+def player_not_found(error):
+    response = make_response('No player matches {}'.format(error), 404)
+    response.mimetype = 'text/plain'
+    return response
+
+
+# the compute pool is full or too slow: ask the client to come back later
+@app.errorhandler(PoolSaturated)
+@app.errorhandler(ComputeTimeout)
+def compute_unavailable(error):
+    if request.path.startswith('/api/'):
+        response = jsonify(error=str(error))
+    else:
+        response = make_response('Too many searches in progress, please retry in a moment.')
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+# the data files changed before the structures of a request were built: served after the reload
+@app.errorhandler(SnapshotOutdated)
+def snapshot_outdated(error):
+    response = jsonify(error=str(error))
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+# the model or the features of the dataset cannot be loaded
+@app.errorhandler(ValuationUnavailable)
+def valuation_unavailable(error):
+    return jsonify(error=str(error)), 503
+
+
+# /search, /api/cube and /api/replace with FIFA19_BACKEND=sqlite
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(error):
+    return jsonify(error=str(error)), 501
+
+
+# reload the dataset now, off the request path of every other request
+@app.route('/admin/reload', methods=['POST'])
+def admin_reload():
+    if not admin_token or request.headers.get('X-Admin-Token') != admin_token:
+        return jsonify(error='forbidden'), 403
+    try:
+        reloaded = snapshots.reload(force=request.args.get('force') == '1')
+    except Exception as error:
+        # the previous dataset is still served
+        return jsonify(reloaded=False, error=repr(error)), 500
+    snapshot = snapshots.current
+    return jsonify(reloaded=reloaded, reloads=snapshots.reloads, players=len(snapshot.player_store),
+                   loaded_at=snapshot.loaded_at)
 
 
 ################################################################################
 def main():
     #app.run(host='0.0.0.0', port=3001, debug=True)
-    app.run()
+    #FIFA19_SERVER=asgi serves the app with uvicorn, see asgi.py
+    if os.environ.get('FIFA19_SERVER') == 'asgi':
+        import asgi
+        asgi.serve(app)
+    else:
+        app.run(threaded=True)
 
 ################################################################################
 if __name__ == '__main__':
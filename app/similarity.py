@@ -0,0 +1,248 @@
+"""
+Similarity Engine
+Vectorized replacement for the per-candidate loop of most_similar() in run.py
+
+The engine works on the position-filtered ability matrices (PAC..PHY for
+outfield players, DIV..POS for goalkeepers) and the per-candidate Pearson
+partial sums precomputed once per dataset by the player matrix. A query then
+scores every candidate of the same position with a handful of NumPy column
+operations and picks the top-n with a partial sort.
+"""
+
+import numpy  as np
+
+from player_matrix import cols_GK, cols_nGK, pearson_score_matrix
+
+#############################################################
+def feature_columns(position):
+    """
+    Return the six ability columns compared for a player at the given position
+    """
+    if position == "GK":
+        return cols_GK
+    else:
+        return cols_nGK
+
+#############################################################
+class PositionBucket(object):
+    """
+    Candidate arrays of a single position, slices of the player matrix
+    """
+    def __init__(self, matrix, start, stop):
+        self.rows      = matrix['bucket_rows'][start:stop]
+        self.first_row = matrix['bucket_first_row'][start:stop]
+        self.overall   = matrix['bucket_overall'][start:stop]
+        self.features  = matrix['bucket_features'][start:stop]
+        self.sum_2     = matrix['bucket_sum_2'][start:stop]
+        self.sum_2_sq  = matrix['bucket_sum_2_sq'][start:stop]
+
+    def take(self, index):
+        """
+        Return the bucket restricted to the candidates at the given positions
+        """
+        subset = PositionBucket.__new__(PositionBucket)
+        for key, array in vars(self).items():
+            setattr(subset, key, array[index])
+        return subset
+
+#############################################################
+class SimilarityEngine(object):
+    """
+    Rank the players most similar to a template player by Pearson correlation
+    of their six ability values, among the candidates playing the same position
+    whose Overall is above 80% of the template player's Overall.
+
+    A name is resolved to its first row in the dataset, like in the original
+    loop, while most_similar_rows() searches for the given rows themselves, e.g.
+    a player looked up by FIFA ID: the template is the player at that row, with
+    its own position, Overall and abilities. A name shared by several players
+    is one candidate, its first row, scored on its own abilities.
+
+    Parameter:
+    store: PlayerStore of the cleaned dataset
+    """
+    def __init__(self, store):
+        self.store = store
+
+        matrix  = store.matrix
+        offsets = matrix['bucket_offsets']
+        self.buckets = {}
+        for i, pos in enumerate(matrix['bucket_positions']):
+            bucket = PositionBucket(matrix, offsets[i], offsets[i+1])
+            # matrices of earlier process_data.py runs also list the other players of a name
+            if not np.array_equal(bucket.rows, bucket.first_row):
+                bucket = bucket.take(np.flatnonzero(bucket.rows == bucket.first_row))
+            self.buckets[str(pos)] = bucket
+
+    def pearson_scores(self, player_vector, bucket):
+        """
+        Pearson correlation coefficient between one ability vector and every
+        candidate of a position bucket, following sim_pearson() step by step.
+        """
+        n = len(player_vector)
+
+        sum_1    = 0
+        sum_1_sq = 0
+        p_sum    = np.zeros(len(bucket.rows))
+        for k, value1 in enumerate(player_vector):
+            sum_1    += value1
+            sum_1_sq += value1 * value1
+            p_sum    += value1 * bucket.features[:, k]
+
+        num = p_sum - (sum_1 * bucket.sum_2/n)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            den    = np.sqrt((sum_1_sq - sum_1 * sum_1/n) * (bucket.sum_2_sq - bucket.sum_2 * bucket.sum_2/n))
+            scores = num/den
+
+        scores[(den == 0) | np.isnan(den)] = 0
+        return scores
+
+    def most_similar(self, player, n=4):
+        """
+        This function find the most similar players to the provided player
+
+        Parameter:
+        player: a player name as the Recommendation template
+        n:      number of similar players to return
+
+        return:
+        list of (score, name) tuples, highest score first
+        """
+        row             = self.store.rows_for_name(player)[0]
+        player_position = str(self.store.position[row])
+        player_overall  = self.store.overall[row]
+        player_vector   = self.store.ability_matrix(player_position)[row]
+
+        bucket     = self.buckets[player_position]
+        candidates = (bucket.rows != row) & (bucket.overall > player_overall*0.8)
+        candidates = np.flatnonzero(candidates)
+        if len(candidates) == 0 or n <= 0:
+            return []
+
+        scores = self.pearson_scores(player_vector, bucket)[candidates]
+        return self.top_n(scores, bucket.rows[candidates], n)
+
+    def most_similar_rows(self, rows, n=4, block=1 << 22):
+        """
+        Batched most_similar() for several template players at once
+
+        The templates of a position are scored against every candidate of the
+        position bucket in one (templates x candidates) matrix operation, block
+        by block of at most `block` scores, with the same arithmetic as
+        pearson_scores(), so each result equals the single query one.
+
+        Parameter:
+        rows:  rows of the template players in the store, each one searched with its own
+               position, Overall and abilities, also when another player has its name
+        n:     number of similar players to return per template
+        block: maximum number of scores computed at once
+
+        return:
+        list, per template row, of (score, name, row) tuples, highest score first
+        """
+        rows    = np.asarray(rows, dtype=np.int64)
+        results = [[] for _ in rows]
+        if n <= 0:
+            return results
+
+        player_position = self.store.position[rows]
+        for pos in np.unique(player_position):
+            bucket  = self.buckets.get(str(pos))
+            queries = np.flatnonzero(player_position == pos)
+            if bucket is None:
+                # no other player of that position, e.g. a second player of a name
+                continue
+            step    = max(1, block // max(1, len(bucket.rows)))
+            for start in range(0, len(queries), step):
+                batch   = queries[start:start+step]
+                vectors = self.store.ability_matrix(str(pos))[rows[batch]]
+                scores  = self.pearson_score_matrix(vectors, bucket)
+
+                overall    = self.store.overall[rows[batch]]
+                candidates = (bucket.rows[None, :] != rows[batch, None]) & \
+                             (bucket.overall[None, :] > overall[:, None]*0.8)
+
+                # Partial sort of every template at once, see top_n_rows()
+                scores[~candidates] = -np.inf
+                if scores.shape[1] > n:
+                    threshold  = np.partition(scores, scores.shape[1] - n, axis=1)[:, scores.shape[1] - n]
+                    candidates = candidates & (scores >= threshold[:, None])
+                for i, query in enumerate(batch):
+                    keep = np.flatnonzero(candidates[i])
+                    results[query] = self.top_n_rows(scores[i, keep], bucket.rows[keep], n)
+        return results
+
+    def pearson_score_matrix(self, player_vectors, bucket):
+        """
+        pearson_scores() of several ability vectors at once, one row of scores per vector
+        """
+        return pearson_score_matrix(player_vectors, bucket.features, bucket.sum_2, bucket.sum_2_sq)
+
+    def top_n(self, scores, rows, n):
+        """
+        Return the n best (score, name) tuples of the scored candidate rows
+        """
+        return [(score, name) for score, name, _ in self.top_n_rows(scores, rows, n)]
+
+    def top_n_rows(self, scores, rows, n):
+        """
+        Return the n best (score, name, row) tuples of the scored candidate rows
+        """
+        if len(scores) == 0:
+            return []
+
+        # Partial sort: keep everything scoring at least the n-th best score,
+        # ties included, then order the survivors exactly like the old
+        # scores.sort() / scores.reverse() on (score, name) tuples
+        if len(scores) > n:
+            threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+            keep      = np.flatnonzero(scores >= threshold)
+        else:
+            keep      = np.arange(len(scores))
+
+        names = self.store.names[rows[keep]].tolist()
+        top   = sorted(zip(scores[keep].tolist(), names, rows[keep].tolist()),
+                       key=lambda item: item[0:2], reverse=True)
+        return top[0:n]
+
+#############################################################
+class NeighbourTableEngine(object):
+    """
+    Answer the similar-player searches from the neighbour table precomputed by
+    process_data.py --neighbours K, with a single lookup per template player.
+    Searches for more than K players are passed to the fallback engine.
+
+    Parameter:
+    table:    neighbour table arrays of the store's dataset, see neighbour_table.py
+    fallback: SimilarityEngine (or ApproximateSimilarityEngine) of the same store
+    """
+    def __init__(self, table, fallback):
+        self.table    = table
+        self.fallback = fallback
+        self.store    = fallback.store
+        self.k        = table['neighbours'].shape[1]
+
+    def most_similar(self, player, n=4):
+        """
+        Same result as SimilarityEngine.most_similar()
+        """
+        if n > self.k:
+            return self.fallback.most_similar(player, n)
+        return [(score, name) for score, name, _ in self.neighbours(self.store.rows_for_name(player)[0], n)]
+
+    def most_similar_rows(self, rows, n=4):
+        """
+        Same result as SimilarityEngine.most_similar_rows()
+        """
+        if n > self.k:
+            return self.fallback.most_similar_rows(rows, n)
+        return [self.neighbours(row, n) for row in rows]
+
+    def neighbours(self, row, n):
+        """
+        Return the n first (score, name, row) tuples of the table row of a player
+        """
+        ids    = self.table['neighbours'][row, :max(n, 0)].tolist()
+        scores = self.table['scores'][row, :max(n, 0)].tolist()
+        rows   = [self.store.row_by_id[player_id] for player_id in ids if player_id >= 0]
+        return list(zip(scores, self.store.names[rows].tolist(), rows))
@@ -0,0 +1,241 @@
+"""
+Data Snapshot
+Everything the web app derives from one version of cleaned_data.csv, replaced as a whole on reload
+
+A DataSnapshot groups the loaded dataset, its PlayerStore, name search index,
+player filter, aggregate cube, similarity engine, squad optimizer and dashboard.
+The player filter, squad optimizer and aggregate cube are built at the first
+request using them, so the workers of the shared --player-matrix mode only read
+their columns when they serve /search, /api/replace or /api/cube.
+
+SnapshotManager builds the snapshot of new data files off the request
+path, in a background watcher thread or on demand, then swaps it in with a
+single reference assignment. A request reads manager.current once and works on
+that snapshot until it returns, so requests in flight during a reload finish on
+the previous dataset and no request ever waits for the reload.
+"""
+
+import os
+import time
+import threading
+import numpy as np
+
+from player_matrix   import player_matrix_dirpath, open_player_matrix
+from neighbour_table import neighbour_table_dirpath
+from aggregate_cube  import AggregateCube, cube_filepath, cube_columns
+from sqlite_store    import sqlite_filepath
+from player_store    import PlayerStore
+from name_index      import NameIndex
+from player_filter   import PlayerFilter, filter_columns
+from squad_optimizer import SquadOptimizer
+from dashboard       import DashboardCache
+from data_loader     import load_cleaned_data, is_current, columnar_filepath
+
+#############################################################
+def data_signature(data_filepath):
+    """
+    Return the (mtime, size) of the cleaned csv file, of its columnar copy, of its
+    player matrix, neighbour table, aggregate cube and SQLite database, None for the missing ones
+    """
+    signature = []
+    for path in (data_filepath, columnar_filepath(data_filepath), player_matrix_dirpath(data_filepath),
+                 neighbour_table_dirpath(data_filepath), cube_filepath(data_filepath), sqlite_filepath(data_filepath)):
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_neighbour_table(data_filepath, store):
+    """
+    Map the neighbour table written by process_data.py --neighbours read-only,
+    None when it is missing, older than the data file or of another dataset
+    """
+    dirpath = neighbour_table_dirpath(data_filepath)
+    if not is_current(dirpath, data_filepath):
+        return None
+    table = open_player_matrix(dirpath)
+    if not np.array_equal(table.get('ids'), store.ids):
+        return None
+    return table
+
+def load_aggregate_cube(data_filepath, players):
+    """
+    Read the aggregate cube written by process_data.py --cube, None when it is
+    missing, older than the data file or does not count its players
+    """
+    filepath = cube_filepath(data_filepath)
+    if not is_current(filepath, data_filepath):
+        return None
+    cube = AggregateCube.load(filepath)
+    if cube.query(measures=[], statistics=['count'])['count'].sum() != players:
+        return None
+    return cube
+
+class SnapshotOutdated(RuntimeError):
+    """Raised when the data file no longer holds the players of the snapshot reading it"""
+    pass
+
+#columns of the cost of a replacement
+Money_Columns = ['Value_Number_K', 'Wage_Number_K']
+
+#############################################################
+class DataSnapshot(object):
+    """
+    Read-only view of one version of the cleaned dataset
+
+    Parameter:
+    data_filepath:   path of cleaned_data.csv
+    columns:         columns loaded when the player matrix cannot be used
+    engine_factory:  function building the similarity engine of a PlayerStore and
+                     of its neighbour table (None without one)
+    watch_dashboard: let the dashboard rebuild itself when the data file changes,
+                     False when snapshots are reloaded
+    """
+    def __init__(self, data_filepath, columns, engine_factory, watch_dashboard=True):
+        self.data_filepath = data_filepath
+        self.signature     = data_signature(data_filepath)
+        self.loaded_at     = time.time()
+
+        matrix_dirpath = player_matrix_dirpath(data_filepath)
+        if is_current(matrix_dirpath, data_filepath):
+            #shared mode: the player matrix written by process_data.py --player-matrix is memory-mapped
+            #read-only, so every worker process shares it, and no full DataFrame is kept in memory
+            self.cleaned_df   = None
+            self.player_store = PlayerStore.from_matrix_dir(matrix_dirpath)
+        else:
+            self.cleaned_df   = load_cleaned_data(data_filepath, columns)
+            self.player_store = PlayerStore.from_frame(self.cleaned_df)
+        self.name_index = NameIndex(self.player_store)
+
+        #the structures of /search, /api/replace and /api/cube are built at their first request, see built():
+        #a worker that never serves them does not read their columns
+        self.lock       = threading.RLock()
+        self.structures = {}
+
+        #serialized index page visuals
+        self.dashboard         = DashboardCache(data_filepath, data=self.cleaned_df, watch=watch_dashboard)
+        self.neighbour_table   = load_neighbour_table(data_filepath, self.player_store)
+        self.similarity_engine = engine_factory(self.player_store, self.neighbour_table)
+
+    def built(self, name, build):
+        """
+        Return the structure of the given name, built by build() the first time it is requested
+        """
+        if name not in self.structures:
+            with self.lock:
+                if name not in self.structures:
+                    self.structures[name] = build()
+        return self.structures[name]
+
+    def load_columns(self, columns):
+        """
+        Return the given columns: the loaded dataset when it has them all, otherwise read from the data file,
+        which must still hold the players of the snapshot
+        """
+        if self.cleaned_df is not None and set(columns) <= set(self.cleaned_df.columns):
+            return self.cleaned_df
+        data = load_cleaned_data(self.data_filepath, list(dict.fromkeys(['ID'] + list(columns))))
+        if not np.array_equal(data['ID'].to_numpy(), self.player_store.ids):
+            raise SnapshotOutdated('{} changed since it was loaded'.format(self.data_filepath))
+        return data
+
+    @property
+    def player_filter(self):
+        #indexed columns of /search
+        return self.built('player_filter', lambda: PlayerFilter(self.load_columns(filter_columns)))
+
+    @property
+    def money(self):
+        #values and wages of the players, in float64
+        return self.built('money', lambda: dict((column, values.to_numpy(dtype=np.float64)) for column, values in
+                                                self.load_columns(Money_Columns)[Money_Columns].items()))
+
+    @property
+    def squad_optimizer(self):
+        #replacement searches of /api/replace, a pick costs its value and wage
+        return self.built('squad_optimizer', lambda: SquadOptimizer(self.player_store, self.money['Value_Number_K'] +
+                                                                                         self.money['Wage_Number_K']))
+
+    @property
+    def aggregate_cube(self):
+        #aggregates of /api/cube, computed from the dataset when process_data.py --cube did not write them
+        def build():
+            cube = load_aggregate_cube(self.data_filepath, len(self.player_store))
+            return cube if cube is not None else AggregateCube.build(self.load_columns(cube_columns))
+        return self.built('aggregate_cube', build)
+
+#############################################################
+class SnapshotManager(object):
+    """
+    Hold the current DataSnapshot and replace it when the data files change
+
+    Parameter:
+    load: function building the DataSnapshot of the current data files
+    """
+    def __init__(self, load):
+        self.load       = load
+        self.current    = load()
+        self.lock       = threading.Lock()
+        self.listeners  = []
+        self.reloads    = 0
+        self.last_error = None
+        self.watcher    = None
+
+    def on_swap(self, callback):
+        """
+        Register callback(snapshot), called after each new snapshot is swapped in
+        """
+        self.listeners.append(callback)
+
+    def is_stale(self):
+        return data_signature(self.current.data_filepath) != self.current.signature
+
+    def reload(self, force=False):
+        """
+        Load the current data files and swap the new snapshot in
+
+        Parameter:
+        force: reload even if the data files did not change
+
+        Returns:
+        True if a new snapshot was swapped in
+        """
+        with self.lock:
+            if not force and not self.is_stale():
+                return False
+            snapshot = self.load()
+            snapshot.dashboard.get()
+
+            # a single reference assignment: requests already holding the previous snapshot finish on it
+            self.current  = snapshot
+            self.reloads += 1
+
+        for callback in self.listeners:
+            callback(snapshot)
+        return True
+
+    def watch(self, interval):
+        """
+        Start a daemon thread polling the data files every interval seconds. A reload
+        starts once the files changed and then stayed the same for a whole interval,
+        so a process_data.py run still writing them is not picked up half-way.
+        """
+        def poll():
+            seen = None
+            while True:
+                time.sleep(interval)
+                signature = data_signature(self.current.data_filepath)
+                if signature != self.current.signature and signature == seen:
+                    try:
+                        self.reload()
+                        self.last_error = None
+                    except Exception as error:
+                        # keep serving the previous snapshot, retried at the next poll
+                        self.last_error = repr(error)
+                seen = signature
+
+        self.watcher = threading.Thread(target=poll, name='snapshot-watcher')
+        self.watcher.daemon = True
+        self.watcher.start()
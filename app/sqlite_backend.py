@@ -0,0 +1,419 @@
+"""
+SQLite Backend
+Serve the players from the database written by process_data.py --sqlite instead of loading the dataset
+
+With FIFA19_BACKEND=sqlite, the snapshot of run.py is a SqliteSnapshot: nothing
+is loaded at startup, every request queries cleaned_data.sqlite through its
+indexes, and the memory of a worker does not grow with the number of players
+(the database pages are read through the OS page cache, shared by every
+process).
+
+    player lookup   - by name or FIFA ID, one indexed query
+    similar players - the candidate names of a position above the Overall
+                      threshold come from a single range of the (Position,
+                      Overall) index and are scored with the arithmetic of
+                      SimilarityEngine, so the results are the ones of the
+                      in-memory backend
+    names           - exact, prefix (name index range) and contains matches
+    dashboard       - GROUP BY queries, the correlation heatmap from sums of
+                      products accumulated batch by batch
+
+Each thread keeps its own read-only connection (ConnectionPool), and the
+queries are module constants: the sqlite3 module keeps the statements it
+prepared per connection, so they are parsed once per thread, not per request.
+
+/search, /api/cube and /api/replace need the in-memory indexes and answer
+HTTP 501 with this backend.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from datetime import datetime, timezone
+from urllib.request import pathname2url
+
+import numpy  as np
+import pandas as pd
+
+from player_matrix import cols_GK, cols_nGK, pearson_score_matrix
+from sqlite_store  import sqlite_filepath
+from player_store  import PlayerRecord, PlayerNotFound, AmbiguousPlayerName
+from similarity    import feature_columns
+from dashboard     import DashboardPayload, build_graphs, feature_list
+from data_loader   import is_current
+from snapshot      import data_signature
+from metrics       import phase
+
+Abilities = ', '.join('a."{}"'.format(column) for column in cols_nGK + cols_GK)
+
+Select_Count      = 'SELECT COUNT(*) FROM players'
+Select_Record     = 'SELECT p.row, p."ID", p."Name", p."Position", p."Overall", {} FROM players AS p ' \
+                    'JOIN abilities AS a ON a.row = p.row WHERE p.row = ?'.format(Abilities)
+Select_Name_Rows  = 'SELECT row FROM players WHERE "Name" = ? ORDER BY row'
+Select_Id_Row     = 'SELECT row FROM players WHERE "ID" = ?'
+Select_Column     = 'SELECT "{}" FROM players WHERE row = ?'
+Select_All        = 'SELECT "{}" FROM players ORDER BY row'
+
+# candidate names of a position, each one the first row of the name, compared on its own Position, Overall and abilities
+Select_Candidates = dict((position, 'SELECT f.row, f."Overall", {} FROM players AS f JOIN abilities AS a ON a.row = f.row '
+                                    'WHERE f."Position" = ? AND f."Overall" > ? AND f.first_row = f.row'.format(
+                                    ', '.join('a."{}"'.format(column) for column in feature_columns(position))))
+                         for position in ("GK", "nGK"))
+Count_Candidates  = 'SELECT COUNT(*) FROM players WHERE "Position" = ? AND "Overall" > ? AND first_row = row AND row != ?'
+
+Select_Names      = 'SELECT "ID", "Name", "Position", "Overall" FROM players WHERE row = first_row AND {} ' \
+                    'ORDER BY "Overall" DESC, "Name" LIMIT ?'
+Exact_Name        = Select_Names.format('"Name" = ?')
+Prefix_Name       = Select_Names.format('"Name" >= ? AND "Name" < ?')
+Contains_Name     = Select_Names.format('"Name" LIKE ? ESCAPE \'\\\'')
+
+# one scan per grouping column: players, total value, average value and wage of each group
+Group_By          = 'SELECT "{0}", COUNT(*), TOTAL("Value_Number_K"), AVG("Value_Number_K"), ' \
+                    'AVG("Wage_Number_K") FROM players WHERE "{0}" IS NOT NULL GROUP BY "{0}"'
+Select_Features   = 'SELECT {} FROM players AS p JOIN abilities AS a ON a.row = p.row'.format(
+                    ', '.join('{}."{}"'.format('a' if feature in cols_nGK + cols_GK else 'p', feature)
+                              for feature in feature_list))
+
+#############################################################
+class BackendUnavailable(RuntimeError):
+    """Raised by the features the SQLite backend does not serve"""
+    pass
+
+class Unavailable(object):
+    """
+    Stand-in for a snapshot attribute the SQLite backend does not have, raising BackendUnavailable on use
+    """
+    def __init__(self, feature):
+        self.feature = feature
+
+    def __getattr__(self, name):
+        raise BackendUnavailable('{} is not available with FIFA19_BACKEND=sqlite'.format(self.feature))
+
+#############################################################
+class ConnectionPool(object):
+    """
+    One read-only connection to a SQLite database per thread, opened on first use
+
+    Parameter:
+    filepath:          database file
+    cached_statements: prepared statements kept per connection
+    mmap_size:         bytes of the database read through a memory map, shared by the processes
+    """
+    def __init__(self, filepath, cached_statements=64, mmap_size=1 << 30):
+        self.uri               = 'file:{}?mode=ro'.format(pathname2url(os.path.abspath(filepath)))
+        self.cached_statements = cached_statements
+        self.mmap_size         = mmap_size
+        self.local             = threading.local()
+        self.lock              = threading.Lock()
+        self.opened            = 0
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.uri, uri=True, cached_statements=self.cached_statements)
+            connection.execute('PRAGMA query_only = ON')
+            connection.execute('PRAGMA mmap_size = {}'.format(int(self.mmap_size)))
+            self.local.connection = connection
+            with self.lock:
+                self.opened += 1
+        return connection
+
+    def execute(self, sql, parameters=()):
+        return self.connection().execute(sql, parameters)
+
+    def scalar(self, sql, parameters=()):
+        row = self.execute(sql, parameters).fetchone()
+        return None if row is None else row[0]
+
+#############################################################
+class Column(object):
+    """
+    One players column read by row, e.g. store.names[row], with the NumPy scalar types of PlayerStore
+    """
+    def __init__(self, pool, column, dtype):
+        self.pool   = pool
+        self.column = column
+        self.dtype  = dtype
+
+    def __getitem__(self, row):
+        value = self.pool.scalar(Select_Column.format(self.column), (int(row),))
+        return np.array(value, dtype=self.dtype)[()]
+
+    def __array__(self, dtype=None, copy=None):
+        # the whole column, e.g. for the valuation model, which loads every player anyway
+        values = [value for value, in self.pool.execute(Select_All.format(self.column))]
+        return np.array(values, dtype=dtype or self.dtype)
+
+class SqlitePlayerStore(object):
+    """
+    PlayerStore of the players of a SQLite database, every lookup an indexed query
+    """
+    def __init__(self, pool):
+        self.pool     = pool
+        self.count    = pool.scalar(Select_Count)
+        self.ids      = Column(pool, 'ID', np.int64)
+        self.names    = Column(pool, 'Name', object)
+        self.position = Column(pool, 'Position', object)
+        self.overall  = Column(pool, 'Overall', np.float64)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, name):
+        return self.pool.scalar(Select_Name_Rows, (name,)) is not None
+
+    def rows_for_name(self, name):
+        rows = [row for row, in self.pool.execute(Select_Name_Rows, (name,))]
+        if not rows:
+            raise PlayerNotFound(name)
+        return np.array(rows, dtype=np.int64)
+
+    def is_ambiguous(self, name):
+        return len(self.rows_for_name(name)) > 1
+
+    def record(self, row):
+        values = self.pool.execute(Select_Record, (int(row),)).fetchone()
+        if values is None:
+            raise PlayerNotFound(row)
+        row, player_id, name, position, overall = values[0:5]
+        abilities = values[5:11] if position != "GK" else values[11:17]
+        return PlayerRecord(row=row, id=player_id, name=name, position=position, overall=overall,
+                            ability_columns=feature_columns(position), abilities=list(abilities))
+
+    def lookup(self, name):
+        return self.record(self.rows_for_name(name)[0])
+
+    def lookup_unique(self, name):
+        rows = self.rows_for_name(name)
+        if len(rows) > 1:
+            raise AmbiguousPlayerName(name)
+        return self.record(rows[0])
+
+    def lookup_id(self, player_id):
+        row = self.pool.scalar(Select_Id_Row, (player_id,))
+        if row is None:
+            raise PlayerNotFound(player_id)
+        return self.record(row)
+
+    def candidate_count(self, row):
+        template = self.record(row)
+        return self.pool.scalar(Count_Candidates, (template.position, template.overall*0.8, template.row))
+
+    def candidates(self, position, min_overall):
+        """
+        Return the candidate names of a position with an Overall above min_overall: their
+        first rows, Overall and ability vectors
+        """
+        values = self.pool.execute(Select_Candidates["GK" if position == "GK" else "nGK"],
+                                   (position, min_overall)).fetchall()
+        if not values:
+            return np.zeros(0, dtype=np.int64), np.zeros(0), np.zeros((0, len(cols_nGK)))
+        columns = list(zip(*values))
+        return np.array(columns[0], dtype=np.int64), np.array(columns[1], dtype=np.float64), \
+               np.array(columns[2:], dtype=np.float64).T
+
+#############################################################
+class SqliteSimilarityEngine(object):
+    """
+    SimilarityEngine answering from the SQLite database: the candidates of a search are
+    read from the (Position, Overall) index, scored like pearson_score_matrix() does
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def most_similar(self, player, n=4):
+        row = self.store.rows_for_name(player)[0]
+        return [(score, name) for score, name, _ in self.most_similar_rows([row], n)[0]]
+
+    def most_similar_rows(self, rows, n=4):
+        """
+        Same result as SimilarityEngine.most_similar_rows(), the candidates of each
+        position read once for every template player of that position
+        """
+        results = [[] for _ in rows]
+        if n <= 0:
+            return results
+
+        templates = {}
+        for i, row in enumerate(rows):
+            template = self.store.record(row)
+            templates.setdefault(template.position, []).append((i, template))
+
+        for position, queries in templates.items():
+            thresholds = [template.overall*0.8 for _, template in queries]
+            candidate_rows, overall, features = self.store.candidates(position, min(thresholds))
+
+            # candidate partial sums, accumulated column by column like the player matrix
+            sum_2    = np.zeros(len(candidate_rows))
+            sum_2_sq = np.zeros(len(candidate_rows))
+            for k in range(features.shape[1]):
+                sum_2    += features[:, k]
+                sum_2_sq += features[:, k] * features[:, k]
+
+            for (i, template), threshold in zip(queries, thresholds):
+                keep = np.flatnonzero((candidate_rows != template.row) & (overall > threshold))
+                if len(keep) == 0:
+                    continue
+                vector = np.array([template.abilities], dtype=np.float64)
+                scores = pearson_score_matrix(vector, features[keep], sum_2[keep], sum_2_sq[keep])[0]
+                results[i] = self.top_n_rows(scores, candidate_rows[keep], n)
+        return results
+
+    def top_n_rows(self, scores, rows, n):
+        """
+        Return the n best (score, name, row) tuples of the scored candidate names, ordered like
+        SimilarityEngine.top_n_rows()
+        """
+        if len(scores) > n:
+            threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+            keep      = np.flatnonzero(scores >= threshold)
+        else:
+            keep      = np.arange(len(scores))
+        names = [self.store.names[row] for row in rows[keep].tolist()]
+        top   = sorted(zip(scores[keep].tolist(), names, rows[keep].tolist()), key=lambda item: item[0:2], reverse=True)
+        return top[0:n]
+
+#############################################################
+class SqliteNameIndex(object):
+    """
+    Name search of the SQLite backend: exact names, names starting with the query (case
+    sensitive, on the name index), then names containing it (ASCII case insensitive)
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def search(self, query, limit=10, min_score=0.2):
+        query = query.strip()
+        if not query or limit <= 0:
+            return []
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        results, seen = [], set()
+        for match, sql, parameters in (('exact', Exact_Name, (query,)),
+                                       ('prefix', Prefix_Name, (query, query + '\U0010ffff')),
+                                       ('contains', Contains_Name, ('%' + escaped + '%',))):
+            for player_id, name, position, overall in self.store.pool.execute(sql, parameters + (limit,)):
+                if player_id not in seen:
+                    seen.add(player_id)
+                    results.append({'id': player_id, 'name': name, 'position': position, 'overall': overall,
+                                    'match': match, 'score': 1.0})
+            if len(results) >= limit:
+                break
+        return results[0:limit]
+
+    def resolve(self, query):
+        if query in self.store:
+            return self.store.rows_for_name(query)[0]
+        results = self.search(query, limit=1)
+        if not results:
+            return None
+        return self.store.lookup_id(results[0]['id']).row
+
+#############################################################
+def correlation_matrix(pool, batch_rows=65536):
+    """
+    Pairwise Pearson correlation of the feature_list columns, like DataFrame.corr(), from
+    sums accumulated over batches of rows: memory does not depend on the number of players
+    """
+    cursor = pool.execute(Select_Features)
+    k      = len(feature_list)
+    count, sums, squares, products = np.zeros((k, k)), np.zeros((k, k)), np.zeros((k, k)), np.zeros((k, k))
+    shift  = None
+    while True:
+        batch = cursor.fetchmany(batch_rows)
+        if not batch:
+            break
+        values = np.array(batch, dtype=np.float64)
+        if shift is None:
+            # values are shifted by the means of the first batch, to keep the sums of squares small
+            with np.errstate(invalid='ignore'):
+                shift = np.nan_to_num(np.nanmean(values, axis=0))
+        present = ~np.isnan(values)
+        values  = np.where(present, values - shift, 0.0)
+        weights = present.astype(np.float64)
+        # entry i, j only counts the rows where both features i and j are present
+        count    += weights.T @ weights
+        sums     += values.T @ weights
+        squares  += (values * values).T @ weights
+        products += values.T @ values
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        covariance = products - sums * sums.T / count
+        variance   = (squares - sums * sums / count) * (squares - sums * sums / count).T
+        correlation = covariance / np.sqrt(variance)
+    correlation[count < 2] = np.nan
+    return correlation
+
+def dashboard_aggregates(pool):
+    """
+    dashboard.dashboard_aggregates() of the players of the database, from one GROUP BY query
+    per grouping column
+    """
+    groups = {}
+    for column in ('Age', 'Position', 'Club'):
+        groups[column] = pd.DataFrame(pool.execute(Group_By.format(column)).fetchall(),
+                                      columns=['key', 'count', 'value_sum', 'value_mean', 'wage_mean'])
+
+    def ranked(column, statistic):
+        # highest first, missing values last, ties by key
+        cells = groups[column].sort_values([statistic, 'key'], ascending=[False, True])
+        return pd.Series(cells[statistic].to_numpy(dtype=np.float64), index=cells['key'].to_numpy())
+
+    return {
+        'age_counts':          ranked('Age', 'count'),
+        'position_counts':     ranked('Position', 'count'),
+        'club_value_sum':      ranked('Club', 'value_sum').head(20),
+        'club_wage_mean':      ranked('Club', 'wage_mean').head(20),
+        'position_value_mean': ranked('Position', 'value_mean'),
+        'position_wage_mean':  ranked('Position', 'wage_mean'),
+        'age_value_mean':      ranked('Age', 'value_mean'),
+        'age_wage_mean':       ranked('Age', 'wage_mean'),
+        'correlation':         correlation_matrix(pool),
+    }
+
+class SqliteDashboard(object):
+    """
+    Dashboard payload of the database, computed by the first request that needs it
+    """
+    def __init__(self, pool, filepath):
+        self.pool          = pool
+        self.last_modified = datetime.fromtimestamp(os.path.getmtime(filepath), tz=timezone.utc)
+        self.lock          = threading.Lock()
+        self.payload       = None
+
+    def get(self):
+        if self.payload is None:
+            with self.lock:
+                if self.payload is None:
+                    with phase('dashboard_figures'):
+                        graphs = build_graphs(aggregates=dashboard_aggregates(self.pool))
+                    self.payload = DashboardPayload(graphs, self.last_modified)
+        return self.payload
+
+#############################################################
+class SqliteSnapshot(object):
+    """
+    DataSnapshot of the SQLite backend, see the module documentation
+
+    Parameter:
+    data_filepath: path of cleaned_data.csv, the database being cleaned_data.sqlite next to it
+    """
+    def __init__(self, data_filepath):
+        self.data_filepath = data_filepath
+        self.signature     = data_signature(data_filepath)
+        self.loaded_at     = time.time()
+
+        filepath = sqlite_filepath(data_filepath)
+        if not is_current(filepath, data_filepath):
+            raise IOError('{} is missing or older than {}, run process_data.py with --sqlite'.format(
+                filepath, data_filepath))
+        self.pool              = ConnectionPool(filepath)
+        self.cleaned_df        = None
+        self.player_store      = SqlitePlayerStore(self.pool)
+        self.name_index        = SqliteNameIndex(self.player_store)
+        self.similarity_engine = SqliteSimilarityEngine(self.player_store)
+        self.dashboard         = SqliteDashboard(self.pool, filepath)
+        self.neighbour_table   = None
+        self.player_filter     = Unavailable('/search')
+        self.aggregate_cube    = Unavailable('/api/cube')
+        self.squad_optimizer   = Unavailable('/api/replace')
@@ -0,0 +1,111 @@
+"""
+Squad Benchmark
+Latency and quality of the squad replacement search for squads of 1 to 11 departing players
+
+Usage:
+> python squad_benchmark.py [../data/cleaned_data.csv] [--sizes 1 3 5 7 9 11] [--squads 20] [--budget-ratio 0.5]
+                            [--time-limit 1.0]
+For each squad size, random squads of departing players are replaced within a
+budget of budget-ratio times the cost of their unconstrained best replacements.
+The script prints the candidates scored and kept after pruning, the search
+nodes, the share of searches proven optimal, the mean and worst latency, and
+the score of the greedy baseline (the best affordable most_similar() candidate
+of each player in turn) relative to the optimized one.
+"""
+
+import os
+import sys
+import time
+import argparse
+import numpy  as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from similarity import cols_GK, cols_nGK
+from player_store import PlayerStore
+from squad_optimizer import SquadOptimizer
+from data_loader import load_cleaned_data
+
+#############################################################
+def greedy(optimizer, rows, budget):
+    """
+    Baseline: each departing player in turn takes its best scoring candidate that still fits the budget
+    """
+    used, total_score, total_cost = set(), 0.0, 0.0
+    for i, (candidates, scores) in enumerate(optimizer.candidate_scores(rows)):
+        others = sum(optimizer.cost[c].min() if len(c) else np.inf
+                     for c, _ in optimizer.candidate_scores(rows[i+1:]))
+        for j in np.argsort(-scores, kind='stable'):
+            row, cost = int(candidates[j]), optimizer.cost[candidates[j]]
+            if row not in used and total_cost + cost + others <= budget:
+                used.add(row)
+                total_score += scores[j]
+                total_cost  += cost
+                break
+        else:
+            return None
+    return total_score
+
+#############################################################
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the benchmark
+    """
+    parser = argparse.ArgumentParser(
+        description='Latency and quality of the squad replacement search',
+        epilog='Example: python squad_benchmark.py ../data/cleaned_data.csv --sizes 3 11')
+    parser.add_argument('data_filepath', nargs='?', default='../data/cleaned_data.csv',
+                        help='cleaned csv file written by process_data.py')
+    parser.add_argument('--sizes',        type=int, nargs='+', default=[1, 3, 5, 7, 9, 11],
+                        help='numbers of departing players')
+    parser.add_argument('--squads',       type=int, default=20,  help='random squads per size')
+    parser.add_argument('--budget-ratio', type=float, default=0.5,
+                        help='budget, relative to the cost of the unconstrained best replacements')
+    parser.add_argument('--time-limit',   type=float, default=1.0, help='seconds of search per squad')
+    parser.add_argument('--seed',         type=int, default=0,   help='seed of the squad sampling')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+
+    data      = load_cleaned_data(args.data_filepath, ['ID', 'Name', 'Position', 'Overall', 'Value_Number_K',
+                                                       'Wage_Number_K'] + cols_nGK + cols_GK)
+    store     = PlayerStore.from_frame(data)
+    optimizer = SquadOptimizer(store, data['Value_Number_K'].to_numpy(dtype=np.float64) +
+                                      data['Wage_Number_K'].to_numpy(dtype=np.float64))
+    rng       = np.random.RandomState(args.seed)
+    print('{} players, {} squads per size, budget {:.0%} of the unconstrained picks'.format(
+        len(store), args.squads, args.budget_ratio))
+
+    print('{:>4} {:>9} {:>6} {:>9} {:>8} {:>9} {:>9} {:>8}'.format(
+        'size', 'scored', 'kept', 'nodes', 'optimal', 'mean_ms', 'max_ms', 'greedy'))
+    for size in args.sizes:
+        scored, kept, nodes, optimal, seconds, ratios = [], [], [], [], [], []
+        for _ in range(args.squads):
+            rows = rng.choice(len(store), size, replace=False)
+
+            # budget: a share of what the best replacements would cost without a budget
+            unconstrained = optimizer.optimize(rows, np.inf, time_limit=args.time_limit)
+            if unconstrained['cost'] is None:
+                continue
+            budget = unconstrained['cost'] * args.budget_ratio
+
+            start  = time.perf_counter()
+            result = optimizer.optimize(rows, budget, time_limit=args.time_limit)
+            seconds.append(time.perf_counter() - start)
+            scored.append(result['scored'])
+            kept.append(result['kept'])
+            nodes.append(result['nodes'])
+            optimal.append(result['optimal'])
+            baseline = greedy(optimizer, rows, budget)
+            if result['score'] and baseline is not None:
+                ratios.append(baseline / result['score'])
+
+        if not seconds:
+            continue
+        print('{:>4} {:>9.0f} {:>6.0f} {:>9.0f} {:>8.0%} {:>9.2f} {:>9.2f} {:>8}'.format(
+            size, np.mean(scored), np.mean(kept), np.mean(nodes), np.mean(optimal), np.mean(seconds) * 1000,
+            np.max(seconds) * 1000, '{:.3f}'.format(np.mean(ratios)) if ratios else '-'))
+
+
+if __name__ == '__main__':
+    main()
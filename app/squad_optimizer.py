@@ -0,0 +1,255 @@
+"""
+Squad Optimizer
+Best similar replacements of several departing players at once, within a budget
+
+Given the players leaving a squad, pick one replacement per departing player,
+each among that player's most_similar() candidates (same position, Overall
+above 80% of the departing player's), no player picked twice, so that the sum
+of the Pearson scores is the highest possible while the total Value_Number_K +
+Wage_Number_K of the picks stays within the budget.
+
+Like most_similar_rows(), each departing player is scored with its own
+position, Overall and abilities, also when another player has its name, and a
+name shared by several players is one candidate, its first row, scored and
+charged on its own abilities and cost. A departing player given twice (by name
+and by ID) is replaced once.
+
+    1. scoring   - every departing player of a position is scored against every
+                   candidate of the position bucket in one matrix operation, with
+                   the arithmetic of SimilarityEngine, so the scores are the ones
+                   of /api/similar
+    2. pruning   - a candidate is dropped when it cannot fit in the budget next to
+                   the cheapest picks of the other players, or when at least as
+                   many candidates as there are departing players are both better
+                   and cheaper: one of them is always free to replace it. What is
+                   left are the first Pareto layers of (score, cost), a few dozen
+                   candidates per player instead of thousands
+    3. search    - depth-first branch and bound over the departing players, the
+                   candidates of each tried best score first; a branch is cut when
+                   even the best affordable candidate of every remaining player
+                   cannot beat the best squad found so far
+
+The search stops at the time limit with the best squad found so far, reported as
+not proven optimal.
+"""
+
+import time
+import bisect
+
+import numpy  as np
+
+from similarity import SimilarityEngine
+
+#############################################################
+class SquadOptimizer(object):
+    """
+    Replacement search over the players of a PlayerStore
+
+    Parameter:
+    store: PlayerStore of the cleaned dataset
+    cost:  Value_Number_K + Wage_Number_K of every player of the store, NaN for
+           the players that cannot be picked
+    """
+    def __init__(self, store, cost):
+        self.store  = store
+        self.cost   = np.asarray(cost, dtype=np.float64)
+        self.engine = SimilarityEngine(store)
+
+    #############################################################
+    def candidate_scores(self, rows, exclude=()):
+        """
+        Score the candidates of every departing player, one batched computation per position
+
+        Arguments:
+            rows    - store rows of the departing players, each one scored with its own profile
+            exclude - store rows that cannot be picked, besides the departing players
+        Outputs:
+            list, per departing player, of (candidate rows, scores) arrays
+        """
+        rows     = np.asarray(rows, dtype=np.int64)
+        excluded = np.concatenate([rows, np.asarray(list(exclude), dtype=np.int64)])
+        position = self.store.position[rows]
+        results  = [(np.zeros(0, dtype=np.int64), np.zeros(0))] * len(rows)
+        for pos in np.unique(position):
+            # no candidate at all when no other player has that position
+            bucket  = self.engine.buckets.get(str(pos))
+            if bucket is None:
+                continue
+            queries = np.flatnonzero(position == pos)
+            vectors = self.store.ability_matrix(str(pos))[rows[queries]]
+            scores  = self.engine.pearson_score_matrix(vectors, bucket)
+
+            overall    = self.store.overall[rows[queries]]
+            candidates = (bucket.overall[None, :] > overall[:, None]*0.8) & \
+                         ~np.isin(bucket.rows, excluded)[None, :] & \
+                         ~np.isnan(self.cost[bucket.rows])[None, :]
+            for i, query in enumerate(queries):
+                keep = np.flatnonzero(candidates[i])
+                results[query] = (bucket.rows[keep], scores[i, keep])
+        return results
+
+    @staticmethod
+    def pareto_layers(scores, cost, layers):
+        """
+        Return the positions of the candidates in the first Pareto layers of (highest score, lowest cost):
+        any other candidate is beaten, on both, by at least `layers` candidates
+        """
+        # by increasing cost, best score first among equal costs; removing a layer keeps that order
+        remaining = np.lexsort((-scores, cost))
+        kept      = []
+        for _ in range(layers):
+            if len(remaining) == 0:
+                break
+            # on the frontier: a better score than every cheaper candidate
+            ordered  = scores[remaining]
+            frontier = np.ones(len(remaining), dtype=bool)
+            frontier[1:] = ordered[1:] > np.maximum.accumulate(ordered)[:-1]
+            kept.append(remaining[frontier])
+            remaining = remaining[~frontier]
+        return np.concatenate(kept) if kept else remaining
+
+    def prune(self, candidates, budget):
+        """
+        Keep the candidates that can belong to an optimal squad, see the module documentation
+
+        Returns:
+        list, per departing player, of (candidate rows, scores, costs) arrays, best score first
+        """
+        costs    = [self.cost[rows] for rows, _ in candidates]
+        cheapest = [cost.min() if len(cost) else np.inf for cost in costs]
+        pruned   = []
+        for i, ((rows, scores), cost) in enumerate(zip(candidates, costs)):
+            # room left for this player when every other one gets its cheapest candidate
+            room = budget - (sum(cheapest) - cheapest[i])
+            keep = np.flatnonzero(cost <= room)
+            keep = keep[self.pareto_layers(scores[keep], cost[keep], len(candidates))]
+            keep = keep[np.lexsort((cost[keep], -scores[keep]))]
+            pruned.append((rows[keep], scores[keep], cost[keep]))
+        return pruned
+
+    #############################################################
+    def optimize(self, rows, budget, exclude=(), time_limit=1.0):
+        """
+        Pick the replacements of the departing players
+
+        Arguments:
+            rows       - store rows of the departing players, a row given twice is replaced once
+            budget     - highest total Value_Number_K + Wage_Number_K of the picks
+            exclude    - store rows that cannot be picked, e.g. the players staying in the squad
+            time_limit - seconds of search, the best squad found so far is returned after it
+        Outputs:
+            dict with
+            picks     - per departing player, (candidate row, score, cost), None when no squad fits the budget
+            score     - total score of the picks
+            cost      - total cost of the picks
+            optimal   - True when the search proved no squad scores higher
+            nodes     - number of partial squads searched
+            scored    - candidates scored, before pruning
+            kept      - candidates searched, after pruning
+        """
+        # a player given twice gets one slot, its replacement is reported for both
+        rows, slots = np.unique(np.asarray(rows, dtype=np.int64), return_inverse=True)
+        candidates  = self.candidate_scores(rows, exclude)
+        pruned      = self.prune(candidates, budget)
+        search      = BranchAndBound(pruned, budget, time_limit)
+        search.run()
+
+        picks = [None] * len(pruned)
+        if search.best is not None:
+            for slot, choice in zip(search.order, search.best):
+                picks[slot] = (int(pruned[slot][0][choice]), float(pruned[slot][1][choice]),
+                               float(pruned[slot][2][choice]))
+        return {'picks':   [picks[slot] for slot in slots.reshape(-1)],
+                'score':   search.best_score if search.best is not None else None,
+                'cost':    search.best_cost if search.best is not None else None,
+                'optimal': not search.timed_out,
+                'nodes':   search.nodes,
+                'scored':  sum(len(rows) for rows, _ in candidates),
+                'kept':    sum(len(rows) for rows, _, _ in pruned)}
+
+#############################################################
+class BranchAndBound(object):
+    """
+    Depth-first search of the highest scoring picks within the budget, one candidate per
+    slot (departing player), no candidate row picked twice
+
+    Parameter:
+    slots:      per slot, (candidate rows, scores, costs) arrays sorted by decreasing score
+    budget:     highest total cost
+    time_limit: seconds before the search stops with the best picks found so far
+    """
+    def __init__(self, slots, budget, time_limit):
+        # slots with the fewest candidates first: the deepest levels branch the most
+        self.order  = sorted(range(len(slots)), key=lambda slot: len(slots[slot][0]))
+        self.rows   = [slots[slot][0].tolist() for slot in self.order]
+        self.scores = [slots[slot][1].tolist() for slot in self.order]
+        self.costs  = [slots[slot][2].tolist() for slot in self.order]
+        self.budget = budget
+
+        # per slot, the candidates by increasing cost and the best score up to each cost,
+        # to bound a slot by its best candidate within a cost cap
+        self.sorted_costs = []
+        self.best_scores  = []
+        for scores, costs in zip(self.scores, self.costs):
+            order = sorted(range(len(costs)), key=costs.__getitem__)
+            self.sorted_costs.append([costs[i] for i in order])
+            self.best_scores.append(np.maximum.accumulate([scores[i] for i in order]).tolist() if order else [])
+        self.min_costs = [costs[0] if costs else float('inf') for costs in self.sorted_costs]
+        self.suffix_min_cost = np.concatenate([np.cumsum(self.min_costs[::-1])[::-1], [0.0]]).tolist() \
+                               if self.min_costs else [0.0]
+
+        self.deadline   = time.perf_counter() + time_limit
+        self.nodes      = 0
+        self.timed_out  = False
+        self.best       = None
+        self.best_score = -float('inf')
+        self.best_cost  = float('inf')
+
+    def run(self):
+        if len(self.rows) == 0:
+            self.best, self.best_score, self.best_cost = [], 0.0, 0.0
+            return
+        self.search(0, [], set(), 0.0, 0.0)
+
+    def bound(self, depth, remaining):
+        """
+        Highest score the slots from depth on can add with the remaining budget: the best candidate
+        of each slot within the budget left by the cheapest candidates of the other slots
+        """
+        total = 0.0
+        for slot in range(depth, len(self.rows)):
+            cap = remaining - (self.suffix_min_cost[depth] - self.min_costs[slot])
+            i   = bisect.bisect_right(self.sorted_costs[slot], cap)
+            if i == 0:
+                return -float('inf')
+            total += self.best_scores[slot][i-1]
+        return total
+
+    def search(self, depth, choices, used, score, cost):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and time.perf_counter() > self.deadline:
+            self.timed_out = True
+        if self.timed_out:
+            return
+        if depth == len(self.rows):
+            if score > self.best_score:
+                self.best, self.best_score, self.best_cost = list(choices), score, cost
+            return
+
+        remaining = self.budget - cost
+        if score + self.bound(depth, remaining) <= self.best_score:
+            return
+        rest = self.suffix_min_cost[depth+1]
+        for i, (row, candidate_score, candidate_cost) in enumerate(zip(self.rows[depth], self.scores[depth],
+                                                                       self.costs[depth])):
+            if candidate_cost + rest > remaining or row in used:
+                continue
+            if score + candidate_score + self.bound(depth+1, remaining - candidate_cost) <= self.best_score:
+                continue
+            choices.append(i)
+            used.add(row)
+            self.search(depth+1, choices, used, score + candidate_score, cost + candidate_cost)
+            used.discard(row)
+            choices.pop()
+            if self.timed_out:
+                return
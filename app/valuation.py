@@ -0,0 +1,252 @@
+"""
+Player Valuation
+Market values predicted by the xgboost model trained in the notebook (Jupyter Notebook/model.p)
+
+The model predicts Value_Number_K, a player's value in thousands of euros, from
+the columns of the cleaned dataset listed in its feature_names: Age, Overall,
+the skills, wage, release clause, contract months, the *_Final position ratings
+and the PAC..PHY ability aggregates. The feature matrix of many players is
+those columns taken at once from the cleaned data, in the model's order.
+
+PredictionBatcher lets concurrent requests share one predict call: the rows of
+the requests arriving within max_wait seconds of each other are stacked and
+predicted together, up to max_rows rows per call.
+
+Usage:
+> python valuation.py ../data/cleaned_data.csv [--model "../Jupyter Notebook/model.p"] [--output values.csv]
+                                               [--batch-rows 65536]
+"""
+
+import os
+import sys
+import time
+import queue
+import argparse
+import threading
+import concurrent.futures
+import numpy  as np
+import pandas as pd
+from sklearn.externals import joblib
+
+try:
+    import xgboost
+except ImportError:
+    xgboost = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data'))
+from data_loader  import load_cleaned_data
+from compute_pool import ComputeTimeout
+
+#############################################################
+class ValuationUnavailable(RuntimeError):
+    """Raised when the model cannot be loaded, or the features of the dataset cannot be read"""
+    pass
+
+#############################################################
+class ValueModel(object):
+    """
+    The market value model and the columns it is computed from
+
+    Parameter:
+    booster: trained xgboost Booster, use load() to read the pickled model
+    """
+    def __init__(self, booster):
+        self.booster       = booster
+        self.feature_names = list(booster.feature_names)
+
+    @classmethod
+    def load(cls, filepath):
+        if xgboost is None:
+            raise ValuationUnavailable('the valuation model requires xgboost: pip install xgboost')
+        try:
+            return cls(joblib.load(filepath))
+        except OSError as error:
+            raise ValuationUnavailable('cannot load the valuation model: {}'.format(error))
+
+    def feature_matrix(self, df):
+        """
+        Return the (players x features) float32 matrix of a cleaned DataFrame, the type xgboost predicts on
+        """
+        return df[self.feature_names].to_numpy(dtype=np.float32)
+
+    def predict(self, features):
+        """
+        Return the predicted Value_Number_K of every row of a feature matrix
+        """
+        return self.booster.predict(xgboost.DMatrix(features, feature_names=self.feature_names))
+
+#############################################################
+class PredictionBatcher(object):
+    """
+    Micro-batching of the predict calls of concurrent callers, in one worker thread
+
+    Parameter:
+    predict:  function predicting a feature matrix, one value per row
+    max_rows: rows predicted by one call at most
+    max_wait: seconds the first request of a batch waits for others to join it
+    """
+    def __init__(self, predict, max_rows=65536, max_wait=0.002):
+        self.predict  = predict
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.queue    = queue.Queue()
+        self.lock     = threading.Lock()
+        self.calls    = 0
+        self.requests = 0
+        self.rows     = 0
+        self.seconds  = 0.0
+        self.worker   = threading.Thread(target=self.run, name='prediction-batcher')
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, features):
+        """
+        Queue a feature matrix, return the future of its predictions
+        """
+        future = concurrent.futures.Future()
+        self.queue.put((features, future))
+        return future
+
+    def run(self):
+        while True:
+            batch    = [self.queue.get()]
+            rows     = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while rows < self.max_rows:
+                try:
+                    batch.append(self.queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+                rows += len(batch[-1][0])
+            self.predict_batch(batch)
+
+    def predict_batch(self, batch):
+        """
+        Predict the stacked feature matrices of a batch and hand each caller its own rows
+        """
+        start = time.perf_counter()
+        try:
+            values = self.predict(np.concatenate([features for features, _ in batch]))
+        except Exception as error:
+            for _, future in batch:
+                future.set_exception(error)
+            return
+        seconds = time.perf_counter() - start
+
+        offsets = np.cumsum([0] + [len(features) for features, _ in batch])
+        for i, (_, future) in enumerate(batch):
+            future.set_result(values[offsets[i]:offsets[i+1]])
+
+        with self.lock:
+            self.calls    += 1
+            self.requests += len(batch)
+            self.rows     += int(offsets[-1])
+            self.seconds  += seconds
+
+    def stats(self):
+        """
+        Return the predict calls, requests and rows so far, and the prediction throughput
+        """
+        with self.lock:
+            return {'calls': self.calls, 'requests': self.requests, 'rows': self.rows,
+                    'rows_per_call':   self.rows / self.calls if self.calls else None,
+                    'rows_per_second': self.rows / self.seconds if self.seconds else None}
+
+#############################################################
+class Valuator(object):
+    """
+    Predicted market values of the players of the web app's current dataset.
+    The model is loaded once per process, at the first valuation, and the
+    feature matrix once per dataset snapshot.
+
+    Parameter:
+    model_filepath: pickled model
+    max_rows:       rows predicted by one call at most, see PredictionBatcher
+    max_wait:       seconds a valuation waits for others to share its predict call
+    """
+    def __init__(self, model_filepath, max_rows=65536, max_wait=0.002):
+        self.model_filepath = model_filepath
+        self.max_rows       = max_rows
+        self.max_wait       = max_wait
+        self.lock           = threading.Lock()
+        self.model          = None
+        self.batcher        = None
+        self.snapshot       = None
+        self.features       = None
+        self.values         = None
+
+    def load(self, snapshot):
+        """
+        Return the feature matrix and the actual values of a snapshot, loading the model and them if needed
+        """
+        with self.lock:
+            if self.model is None:
+                self.model   = ValueModel.load(self.model_filepath)
+                self.batcher = PredictionBatcher(self.model.predict, self.max_rows, self.max_wait)
+            if self.snapshot is not snapshot:
+                df = load_cleaned_data(snapshot.data_filepath, ['ID', 'Value_Number_K'] + self.model.feature_names)
+                if not np.array_equal(df['ID'].to_numpy(), snapshot.player_store.ids):
+                    raise ValuationUnavailable('the data file changed since the dataset was loaded')
+                self.snapshot = snapshot
+                self.features = self.model.feature_matrix(df)
+                self.values   = df['Value_Number_K'].to_numpy(dtype=np.float64)
+            return self.features, self.values
+
+    def value_rows(self, snapshot, rows, timeout=None):
+        """
+        Predict the values of the players at the given store rows of a snapshot
+
+        Returns:
+        predicted and actual Value_Number_K arrays, in the order of rows
+        """
+        features, values = self.load(snapshot)
+        rows   = np.asarray(rows, dtype=np.int64)
+        future = self.batcher.submit(features[rows])
+        try:
+            return future.result(timeout=timeout), values[rows]
+        except concurrent.futures.TimeoutError:
+            raise ComputeTimeout('no valuation after {} seconds'.format(timeout))
+
+    def stats(self):
+        return self.batcher.stats() if self.batcher is not None else None
+
+#############################################################
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the valuation script
+    """
+    parser = argparse.ArgumentParser(
+        description='Predict the market value of every player of a cleaned FIFA19 dataset',
+        epilog='Example: python valuation.py ../data/cleaned_data.csv --output values.csv')
+    parser.add_argument('data_filepath',  help='cleaned csv file written by process_data.py')
+    parser.add_argument('--model',        default='../Jupyter Notebook/model.p', help='pickled xgboost model')
+    parser.add_argument('--output',       help='write ID, Name, Value_Number_K and Predicted_Value_K to this csv file')
+    parser.add_argument('--batch-rows',   type=int, default=65536,
+                        help='rows read and predicted at a time, bounds the memory use')
+    return parser.parse_args(argv)
+
+def main():
+    args  = parse_arguments(sys.argv[1:])
+    model = ValueModel.load(args.model)
+
+    columns  = ['ID', 'Name', 'Value_Number_K'] + model.feature_names
+    rows     = 0
+    seconds  = 0.0
+    start    = time.perf_counter()
+    for i, df in enumerate(pd.read_csv(args.data_filepath, usecols=columns, chunksize=args.batch_rows)):
+        features = model.feature_matrix(df)
+        predict_start = time.perf_counter()
+        predicted = model.predict(features)
+        seconds  += time.perf_counter() - predict_start
+        rows     += len(df)
+        if args.output:
+            output = df[['ID', 'Name', 'Value_Number_K']].assign(Predicted_Value_K=predicted)
+            output.to_csv(args.output, mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+    total = time.perf_counter() - start
+    print('{} players valued in {:.2f} s: {:.0f} rows/s predicting, {:.0f} rows/s end to end'.format(
+        rows, total, rows / seconds if seconds else 0, rows / total if total else 0))
+
+
+if __name__ == '__main__':
+    main()
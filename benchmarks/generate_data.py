@@ -0,0 +1,142 @@
+"""
+Synthetic FIFA19 Data Generator
+Raw players data with the schema of the Kaggle FIFA19 data.csv, at any size
+
+Usage:
+> python generate_data.py 100000 data_100k.csv [--seed 0]
+
+The values are random but follow the formats process_data.py parses: money
+amounts like €110.5M/€565K/€0, contract dates as years or "Jun 30, 2021",
+position ratings like 88+2, heights like 5'7 and weights like 159lbs. About half
+of the names are shared by two players, goalkeepers have no position ratings, a
+few rows miss most of their values and some miss only their contract date or
+release clause, like in the real file. The same seed gives the same file.
+"""
+
+import sys
+import argparse
+import numpy  as np
+import pandas as pd
+
+Position_List = ['LS','ST','RS','LW','LF','CF','RF','RW','LAM','CAM','RAM','LM','LCM','CM','RCM','RM',
+                 'LWB','LDM','CDM','RDM','RWB','LB','LCB','CB','RCB','RB']
+Skill_List    = ['Crossing','Finishing','HeadingAccuracy','ShortPassing','Volleys','Dribbling','Curve',
+                 'FKAccuracy','LongPassing','BallControl','Acceleration','SprintSpeed','Agility','Reactions',
+                 'Balance','ShotPower','Jumping','Stamina','Strength','LongShots','Aggression','Interceptions',
+                 'Positioning','Vision','Penalties','Composure','Marking','StandingTackle','SlidingTackle',
+                 'GKDiving','GKHandling','GKKicking','GKPositioning','GKReflexes']
+Club_List     = ['FC Barcelona','Juventus','Paris Saint-Germain','Manchester United','Manchester City',
+                 'Chelsea','Real Madrid','Atlético Madrid','FC Bayern München','Tottenham Hotspur',
+                 'Liverpool','Napoli','Arsenal','Borussia Dortmund','Inter','Ajax','FC Porto','Olympique Lyonnais']
+Nation_List   = ['Argentina','Portugal','Brazil','Spain','Belgium','Croatia','Uruguay','Slovenia',
+                 'Poland','Germany','France','England','Italy','Egypt','Colombia','Côte d\'Ivoire']
+Month_List    = ['Jan','Feb','Mar','Apr','May','Jun','Jul','Aug','Sep','Oct','Nov','Dec']
+
+#############################################################
+def random_strings(rng, n, low, high, format='{}'):
+    """
+    n random integers in [low, high) formatted as strings, through a table of the
+    formatted values so that millions of rows are generated quickly
+    """
+    table = np.array([format.format(i) for i in range(low, high)], dtype=object)
+    return table[rng.integers(low, high, n) - low]
+
+def money_strings(rng, n):
+    """
+    Amounts formatted like €110.5M, €565K or €0
+    """
+    kind      = rng.integers(0, 3, n)
+    thousands = random_strings(rng, n, 1, 1000, '€{}K')
+    millions  = np.array(['€{:.1f}M'.format(i / 10.0) for i in range(1201)], dtype=object)[rng.integers(0, 1201, n)]
+    return np.where(kind == 0, '€0', np.where(kind == 1, thousands, millions))
+
+def contract_strings(rng, n):
+    """
+    Contract end dates, as a year or as a full date like "Jun 30, 2021"
+    """
+    years = random_strings(rng, n, 2018, 2027)
+    dates = rng.choice(Month_List, n).astype(object) + random_strings(rng, n, 1, 29, ' {}, ') + years
+    return np.where(rng.random(n) < 0.7, years, dates)
+
+#############################################################
+def generate_players(n, seed=0):
+    """
+    Generate the raw data of n players
+
+    Arguments:
+        n    - number of players
+        seed - random seed
+    Outputs:
+        df   - raw data Pandas DataFrame, with the columns of data.csv and its
+               unnamed index column as index
+    """
+    rng      = np.random.default_rng(seed)
+    overall  = rng.integers(46, 95, n)
+    position = rng.choice(Position_List + ['GK'] * 3, n)
+    name_id  = rng.integers(0, max(1, n // 2), n)
+
+    df = pd.DataFrame({
+        'ID':                       rng.permutation(n * 3)[:n] + 100000,
+        'Name':                     np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ'), dtype=object)[name_id % 26] + '. Player' + name_id.astype(str).astype(object),
+        'Age':                      rng.integers(16, 42, n),
+        'Photo':                    'https://cdn.sofifa.org/players/4/19/' + np.arange(n).astype(str).astype(object) + '.png',
+        'Nationality':              rng.choice(Nation_List, n),
+        'Flag':                     'https://cdn.sofifa.org/flags/52.png',
+        'Overall':                  overall,
+        'Potential':                overall + rng.integers(0, 10, n),
+        'Club':                     rng.choice(Club_List, n).astype(object),
+        'Club Logo':                'https://cdn.sofifa.org/teams/2/light/241.png',
+        'Value':                    money_strings(rng, n),
+        'Wage':                     money_strings(rng, n),
+        'Special':                  rng.integers(700, 2400, n),
+        'Preferred Foot':           rng.choice(['Left', 'Right'], n),
+        'International Reputation': rng.integers(1, 6, n).astype(float),
+        'Weak Foot':                rng.integers(1, 6, n).astype(float),
+        'Skill Moves':              rng.integers(1, 6, n).astype(float),
+        'Work Rate':                rng.choice(['Medium/ Medium', 'High/ Low', 'Low/ High', 'High/ High'], n),
+        'Body Type':                rng.choice(['Lean', 'Normal', 'Stocky'], n),
+        'Real Face':                rng.choice(['Yes', 'No'], n),
+        'Position':                 position,
+        'Jersey Number':            rng.integers(1, 100, n).astype(float),
+        'Joined':                   'Jul 1, 2004',
+        'Loaned From':              np.where(rng.random(n) < 0.07, 'Juventus', None),
+        'Contract Valid Until':     contract_strings(rng, n),
+        'Height':                   random_strings(rng, n, 5, 7, "{}'") + random_strings(rng, n, 0, 12),
+        'Weight':                   random_strings(rng, n, 110, 240, '{}lbs'),
+    })
+    for pos in Position_List:
+        df[pos] = np.where(position == 'GK', np.nan, random_strings(rng, n, 30, 95, '{}+') + random_strings(rng, n, 0, 4))
+    for skill in Skill_List:
+        df[skill] = rng.integers(5, 95, n).astype(float)
+    df['Release Clause'] = money_strings(rng, n)
+
+    # missing values like in the real file
+    df.loc[rng.random(n) < 0.015, 'Club']                 = np.nan
+    df.loc[rng.random(n) < 0.08,  'Release Clause']       = np.nan
+    df.loc[rng.random(n) < 0.01,  'Contract Valid Until'] = np.nan
+    df.loc[rng.random(n) < 0.003, 'Jersey Number']        = np.nan
+    sparse = rng.random(n) < 0.003
+    df.loc[sparse, ['Club', 'Value', 'Wage', 'Position', 'Height', 'Weight', 'Preferred Foot', 'Body Type',
+                    'Work Rate', 'Contract Valid Until', 'Release Clause'] + Position_List + Skill_List] = np.nan
+    return df
+
+#############################################################
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the generator
+    """
+    parser = argparse.ArgumentParser(
+        description='Generate a synthetic FIFA19 data.csv',
+        epilog='Example: python generate_data.py 100000 data_100k.csv')
+    parser.add_argument('rows',         type=int, help='number of players')
+    parser.add_argument('csv_filepath', help='destination csv file')
+    parser.add_argument('--seed',       type=int, default=0, help='random seed')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    generate_players(args.rows, args.seed).to_csv(args.csv_filepath)
+
+
+if __name__ == '__main__':
+    main()
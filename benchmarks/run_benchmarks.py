@@ -0,0 +1,235 @@
+"""
+Benchmark Suite
+Timing and peak memory of the ETL pipeline and of the web app's recommendation path
+
+Usage:
+> python run_benchmarks.py [--rows 10000] [--repeat 3] [--queries 50] [--output results.json]
+                           [--baseline baseline.json] [--tolerance 0.10] [--only etl|app]
+
+The input is generated by generate_data.py in a temporary workspace with the
+layout of the repository (data/ and app/), so no Kaggle file is needed and the
+same --rows/--seed always benchmark the same data.
+
+Cases:
+    etl.load_data, etl.<stage> for each step of clean_data(), etl.clean_data, etl.save_data
+        seconds: median wall time over --repeat runs
+        peak_mb: peak Python/NumPy memory allocated by the step (tracemalloc, separate run)
+    app.most_similar        - seconds per query, result cache emptied first
+    app.most_similar_cached - seconds per query, same queries again
+    app.index_payload       - seconds to build and serialize the index page figures
+    app.go                  - seconds per /go request through Flask's test client
+
+The results are written as JSON. With --baseline, each case is compared with
+the same case of a previous results file, and the script exits with status 1
+when one is slower (or, for peak_mb, larger) than the baseline by more than
+--tolerance.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import warnings
+import tracemalloc
+import numpy  as np
+import pandas as pd
+
+repo_dirpath = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(repo_dirpath, 'data'))
+import process_data as etl
+from generate_data import generate_players
+
+# steps of clean_data(), in order
+Clean_Stages = ['handle_missing_values', 'global_statistics', 'convert_money_values', 'convert_contract_dates',
+                'convert_position_ratings', 'encode_categorical_features', 'normalize_height_weight',
+                'combine_ability_ratings', 'compact_schema']
+
+#############################################################
+def run_stage(name, df, state):
+    """
+    Run one step of clean_data() on df, state keeps the GlobalStatistics between steps
+    and the compacted DataFrame
+    """
+    if name == 'global_statistics':
+        state['stats'] = etl.GlobalStatistics()
+        state['stats'].update(df)
+    elif name == 'compact_schema':
+        state['df'] = etl.compact_schema(df, state['stats'])
+    elif name in ('encode_categorical_features', 'normalize_height_weight'):
+        getattr(etl, name)(df, state['stats'])
+    else:
+        getattr(etl, name)(df)
+
+def measure(function, memory=False):
+    """
+    Return the wall time of function(), or its peak allocated memory in MB
+    """
+    if not memory:
+        start = time.perf_counter()
+        function()
+        return time.perf_counter() - start
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1] / 2.0**20
+    finally:
+        tracemalloc.stop()
+
+#############################################################
+def benchmark_etl(raw_filepath, cleaned_filepath, repeat):
+    """
+    Time every step of the ETL pipeline, then measure their peak memory in one more run
+    """
+    timings = {}
+    peaks   = {}
+    for run in range(repeat + 1):
+        memory  = run == repeat
+        results = peaks if memory else timings
+        state   = {}
+        record  = lambda name, value: results.setdefault(name, []).append(value)
+
+        record('etl.load_data', measure(lambda: state.update(df=etl.load_data(raw_filepath)), memory))
+        df = state['df']
+        for stage in Clean_Stages:
+            record('etl.' + stage, measure(lambda: run_stage(stage, df, state), memory))
+        record('etl.save_data', measure(lambda: etl.save_data(state['df'], cleaned_filepath), memory))
+
+        df = etl.load_data(raw_filepath)
+        record('etl.clean_data', measure(lambda: etl.clean_data(df), memory))
+
+    cases = {}
+    for name, values in timings.items():
+        cases[name] = {'seconds': float(np.median(values)), 'peak_mb': peaks[name][0]}
+    return cases
+
+def benchmark_app(workspace, repeat, queries, seed):
+    """
+    Time the recommendation path of the web app on the cleaned data of the workspace
+    """
+    # run.py loads ../data/cleaned_data.csv relative to the working directory
+    os.chdir(os.path.join(workspace, 'app'))
+    sys.path.insert(0, os.path.join(repo_dirpath, 'app'))
+    import run
+    from data_loader import load_cleaned_data
+
+    snapshot = run.snapshots.current
+    store    = snapshot.player_store
+    rng      = np.random.RandomState(seed)
+    names    = list(dict.fromkeys(store.names[rng.choice(len(store), queries, replace=False)].tolist()))
+    client   = run.app.test_client()
+    frame    = load_cleaned_data(run.data_filepath, run.dashboard_columns)
+
+    def most_similar():
+        for name in names:
+            run.most_similar(snapshot.cleaned_df, name, snapshot=snapshot)
+
+    def go():
+        for name in names:
+            client.get('/go', query_string={'query': name})
+
+    timings = {}
+    for _ in range(repeat):
+        run.result_cache.clear()
+        timings.setdefault('app.most_similar', []).append(measure(most_similar) / len(names))
+        timings.setdefault('app.most_similar_cached', []).append(measure(most_similar) / len(names))
+        timings.setdefault('app.index_payload', []).append(
+            measure(lambda: snapshot.dashboard.build(frame, snapshot.dashboard.file_signature())))
+        run.result_cache.clear()
+        timings.setdefault('app.go', []).append(measure(go) / len(names))
+
+    return dict((name, {'seconds': float(np.median(values))}) for name, values in timings.items())
+
+#############################################################
+def compare(results, baseline, tolerance):
+    """
+    Print each case next to its baseline, return the names of the regressed cases
+    """
+    regressions = []
+    print('{:<44} {:>12} {:>12} {:>8}'.format('case', 'baseline', 'current', 'ratio'))
+    for name, case in sorted(results['cases'].items()):
+        if name not in baseline['cases']:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            if metric not in case or metric not in baseline['cases'][name]:
+                continue
+            old, new = baseline['cases'][name][metric], case[metric]
+            ratio    = new / old if old > 0 else float('inf') if new > 0 else 1.0
+            flag     = ''
+            if ratio > 1 + tolerance:
+                flag = '  REGRESSION'
+                regressions.append('{} {}'.format(name, metric))
+            print('{:<44} {:>12.6g} {:>12.6g} {:>7.2f}x{}'.format(name + ' ' + metric, old, new, ratio, flag))
+    return regressions
+
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the benchmark suite
+    """
+    parser = argparse.ArgumentParser(
+        description='Benchmark the ETL pipeline and the recommendation path on synthetic data',
+        epilog='Example: python run_benchmarks.py --rows 100000 --output new.json --baseline old.json')
+    parser.add_argument('--rows',      type=int, default=10000, help='number of synthetic players')
+    parser.add_argument('--seed',      type=int, default=0,     help='seed of the data and of the queries')
+    parser.add_argument('--repeat',    type=int, default=3,     help='timed runs per case, the median is kept')
+    parser.add_argument('--queries',   type=int, default=50,    help='players queried by the app cases')
+    parser.add_argument('--only',      choices=['etl', 'app'],  help='run only the ETL or only the app cases')
+    parser.add_argument('--output',    help='write the results to this JSON file')
+    parser.add_argument('--baseline',  help='results JSON file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed slowdown ratio over the baseline')
+    return parser.parse_args(argv)
+
+def main():
+    args = parse_arguments(sys.argv[1:])
+    # keep the output readable, the pandas deprecation warnings of the ETL are not measured
+    warnings.simplefilter('ignore', FutureWarning)
+
+    workspace = tempfile.mkdtemp(prefix='fifa19_benchmarks_')
+    try:
+        os.makedirs(os.path.join(workspace, 'data'))
+        os.makedirs(os.path.join(workspace, 'app'))
+        raw_filepath     = os.path.join(workspace, 'data', 'data.csv')
+        cleaned_filepath = os.path.join(workspace, 'data', 'cleaned_data.csv')
+        print('Generating {} players...'.format(args.rows))
+        generate_players(args.rows, args.seed).to_csv(raw_filepath)
+
+        cases = {}
+        if args.only != 'app':
+            print('Benchmarking the ETL pipeline...')
+            cases.update(benchmark_etl(raw_filepath, cleaned_filepath, args.repeat))
+        if args.only != 'etl':
+            if not os.path.exists(cleaned_filepath):
+                etl.save_data(etl.clean_data(etl.load_data(raw_filepath)), cleaned_filepath)
+            print('Benchmarking the web app...')
+            cases.update(benchmark_app(workspace, args.repeat, args.queries, args.seed))
+    finally:
+        os.chdir(repo_dirpath)
+        shutil.rmtree(workspace, ignore_errors=True)
+
+    results = {
+        'meta': {'rows': args.rows, 'seed': args.seed, 'repeat': args.repeat, 'queries': args.queries,
+                 'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+                 'machine': platform.machine(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+        'cases': cases,
+    }
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('Regressions: ' + ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
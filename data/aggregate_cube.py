@@ -0,0 +1,244 @@
+"""
+Aggregate Cube
+Count, sum, min and max of the players' values and wages over their categorical dimensions
+
+The cube groups the players by Club, Position, Age, Nationality, Work Rate and
+Body Type. Its cuboids are the aggregates of one subset of those dimensions:
+
+    base cuboid - every dimension, one cell per combination that exists
+    roll-ups    - every subset of at most three dimensions, down to the grand total
+
+All of them are materialized by build(): the base cuboid from the player rows,
+each roll-up from the smallest cuboid it can be computed from, since counts,
+sums, mins and maxes of cells combine into those of bigger cells. A query (a group-by with filters, e.g. the average value by
+Nationality x Position of the players of one club) reads the smallest cuboid
+holding every dimension it uses, and rolls it up further if needed: no player
+row is read, and the mean is sum / count.
+
+update() applies the players removed and added since the cube was built: counts
+and sums change by the difference, a min or max only needs the player rows of
+the few cells that lost their extreme value.
+
+save() writes every cuboid to a single csv file, cleaned_data_cube.csv, which
+load() reads back.
+"""
+
+import os
+import itertools
+
+import numpy  as np
+import pandas as pd
+
+Dimensions         = ['Club', 'Position', 'Age', 'Nationality', 'Work Rate', 'Body Type']
+Numeric_Dimensions = ['Age']
+Measures           = ['Value_Number_K', 'Wage_Number_K', 'Overall', 'Potential']
+Statistics         = ['count', 'sum', 'mean', 'min', 'max']
+
+# roll-ups materialized besides the base cuboid
+Max_Rollup_Dimensions = 3
+
+cube_columns = Dimensions + Measures
+
+#############################################################
+class InvalidCubeQuery(ValueError):
+    """Raised for a query on an unknown dimension, measure or statistic, or with a malformed value"""
+    pass
+
+#############################################################
+def cube_filepath(database_filename):
+    """
+    Return the path of the aggregate cube of a cleaned csv file: cleaned_data.csv -> cleaned_data_cube.csv
+    """
+    return os.path.splitext(database_filename)[0] + '_cube.csv'
+
+def aggregate(df, dimensions):
+    """
+    Aggregate player rows into the cells of the given dimensions: count, and sum/min/max of each measure
+    """
+    # float32 money of a compact dataset (see schema.py) is summed in float64
+    df = df[list(dimensions) + Measures].astype(dict((measure, np.float64) for measure in Measures
+                                                    if df[measure].dtype == np.float32))
+    aggregations = {'count': (Measures[0], 'size')}
+    for measure in Measures:
+        for statistic in ('sum', 'min', 'max'):
+            aggregations[measure + '_' + statistic] = (measure, statistic)
+    return group(df, dimensions).agg(**aggregations).reset_index(drop=not dimensions)
+
+def rollup(cells, dimensions):
+    """
+    Aggregate the cells of a cuboid into the cells of fewer dimensions
+    """
+    aggregations = {'count': 'sum'}
+    for measure in Measures:
+        aggregations.update({measure + '_sum': 'sum', measure + '_min': 'min', measure + '_max': 'max'})
+    return group(cells, dimensions).agg(aggregations).reset_index(drop=not dimensions)
+
+def group(df, dimensions):
+    # no dimension: a single group, the grand total (no cell at all for no row)
+    if not dimensions:
+        return df.groupby(np.zeros(len(df), dtype=np.int64), sort=False)
+    # only the categories of categorical dimensions that hold players
+    return df.groupby(list(dimensions), sort=False, dropna=False, observed=True)
+
+#############################################################
+class AggregateCube(object):
+    """
+    Materialized cuboids of the players' aggregates
+
+    Parameter:
+    cuboids: dict of sorted dimension tuple -> cells DataFrame, use build() or load()
+    """
+    def __init__(self, cuboids):
+        self.cuboids = cuboids
+
+    @classmethod
+    def build(cls, df):
+        """
+        Build the cube of a cleaned dataset, with the cube_columns at least
+        """
+        return cls.from_base(aggregate(df, Dimensions))
+
+    @classmethod
+    def from_base(cls, base):
+        """
+        Materialize the roll-ups of a base cuboid, each one from its smallest parent already computed
+        """
+        cube = cls({tuple(Dimensions): base})
+        for size in range(Max_Rollup_Dimensions, -1, -1):
+            for dimensions in itertools.combinations(Dimensions, size):
+                cube.cuboids[dimensions] = rollup(cube.smallest_cuboid(dimensions)[1], list(dimensions))
+        return cube
+
+    @property
+    def base(self):
+        return self.cuboids[tuple(Dimensions)]
+
+    def __len__(self):
+        return sum(len(cells) for cells in self.cuboids.values())
+
+    def smallest_cuboid(self, dimensions):
+        """
+        Return the (dimensions, cells) of the materialized cuboid with the fewest cells holding every given dimension
+        """
+        return min(((names, cells) for names, cells in self.cuboids.items() if set(dimensions) <= set(names)),
+                   key=lambda cuboid: len(cuboid[1]))
+
+    #############################################################
+    def query(self, group_by=(), where=None, measures=None, statistics=None):
+        """
+        Aggregates of the players grouped by some dimensions, among the players matching filters
+
+        Parameter:
+        group_by:   dimensions of the result cells, none for a grand total
+        where:      dict dimension -> list of accepted values, numbers or their text for Age
+        measures:   measures returned, all of them by default
+        statistics: statistics returned among count/sum/mean/min/max, all by default
+
+        Returns:
+        DataFrame, one row per cell: the group_by dimensions, count and <measure>_<statistic> columns
+        """
+        group_by   = list(group_by)
+        where      = where or {}
+        measures   = Measures if measures is None else measures
+        statistics = Statistics if statistics is None else statistics
+        for names, known, kind in ((group_by + list(where), Dimensions, 'dimension'), (measures, Measures, 'measure'),
+                                   (statistics, Statistics, 'statistic')):
+            for name in names:
+                if name not in known:
+                    raise InvalidCubeQuery('unknown {} {!r}, expected one of: {}'.format(kind, name, ', '.join(known)))
+
+        dimensions, cells = self.smallest_cuboid(set(group_by) | set(where))
+
+        for dimension, values in where.items():
+            if dimension in Numeric_Dimensions:
+                try:
+                    values = [float(value) for value in values]
+                except (TypeError, ValueError):
+                    raise InvalidCubeQuery('expected numbers for {!r}'.format(dimension))
+            cells = cells[cells[dimension].isin(values)]
+        if set(group_by) != set(dimensions):
+            cells = rollup(cells, group_by)
+
+        columns = dict((dimension, cells[dimension].to_numpy()) for dimension in group_by)
+        if 'count' in statistics:
+            columns['count'] = cells['count'].to_numpy()
+        for measure in measures:
+            for statistic in statistics:
+                if statistic == 'mean':
+                    columns[measure + '_mean'] = cells[measure + '_sum'].to_numpy() / cells['count'].to_numpy()
+                elif statistic != 'count':
+                    columns[measure + '_' + statistic] = cells[measure + '_' + statistic].to_numpy()
+        return pd.DataFrame(columns)
+
+    #############################################################
+    def update(self, removed, added, current_rows):
+        """
+        Apply the players removed and added since the cube was built
+
+        Arguments:
+            removed      - previous rows of the players removed or changed, with the cube_columns
+            added        - rows of the players added or changed, with the cube_columns
+            current_rows - function returning the rows of the whole updated dataset with the
+                           cube_columns, only called when a min or max has to be recomputed
+        Outputs:
+            the updated AggregateCube
+        """
+        key   = Dimensions
+        base  = self.base.set_index(key)
+        plus  = aggregate(added, key).set_index(key)
+        minus = aggregate(removed, key).set_index(key)
+        cells = base.index.union(plus.index).union(minus.index)
+        base, plus, minus = base.reindex(cells), plus.reindex(cells), minus.reindex(cells)
+
+        result = pd.DataFrame(index=cells)
+        result['count'] = base['count'].fillna(0) + plus['count'].fillna(0) - minus['count'].fillna(0)
+        stale = np.zeros(len(cells), dtype=bool)
+        for measure in Measures:
+            result[measure + '_sum'] = base[measure + '_sum'].fillna(0) + plus[measure + '_sum'].fillna(0) - \
+                                       minus[measure + '_sum'].fillna(0)
+            result[measure + '_min'] = np.fmin(base[measure + '_min'], plus[measure + '_min'])
+            result[measure + '_max'] = np.fmax(base[measure + '_max'], plus[measure + '_max'])
+            # a removed row held the extreme value of its cell: look at the rows of the cell again
+            stale |= (minus[measure + '_min'] <= base[measure + '_min']).to_numpy()
+            stale |= (minus[measure + '_max'] >= base[measure + '_max']).to_numpy()
+
+        result = result[result['count'] > 0]
+        stale  = pd.Series(stale, index=cells)[result.index]
+        if stale.any():
+            rows   = current_rows()
+            rows   = rows[pd.MultiIndex.from_frame(rows[key]).isin(result.index[stale.to_numpy()])]
+            recomputed = aggregate(rows, key).set_index(key)
+            extremes   = [measure + '_' + statistic for measure in Measures for statistic in ('min', 'max')]
+            result.loc[recomputed.index, extremes] = recomputed[extremes]
+
+        base = result.reset_index()
+        base['count'] = base['count'].astype(np.int64)
+        return AggregateCube.from_base(base[self.base.columns])
+
+    #############################################################
+    def save(self, filepath):
+        """
+        Write every cuboid in one csv file, the cuboid column lists the dimensions of each cell
+        """
+        frames = []
+        for dimensions, cells in self.cuboids.items():
+            frames.append(cells.assign(cuboid='|'.join(dimensions)))
+        pd.concat(frames, ignore_index=True)[['cuboid'] + Dimensions + list(self.base.columns[len(Dimensions):])] \
+          .to_csv(filepath, index=False)
+
+    @classmethod
+    def load(cls, filepath):
+        """
+        Read a cube written by save()
+        """
+        cells   = pd.read_csv(filepath, keep_default_na=False, na_values={'Age': [''], 'cuboid': []},
+                              dtype=dict((dimension, str) for dimension in Dimensions if dimension != 'Age'),
+                              float_precision='round_trip')
+        cuboids = {}
+        for name, group in cells.groupby('cuboid', sort=False):
+            dimensions = tuple(name.split('|')) if name else ()
+            cuboids[dimensions] = group[list(dimensions) + list(cells.columns[len(Dimensions)+1:])].reset_index(drop=True)
+        for size in range(Max_Rollup_Dimensions + 1):
+            for dimensions in itertools.combinations(Dimensions, size):
+                cuboids.setdefault(dimensions, cells.head(0)[list(dimensions) + list(cells.columns[len(Dimensions)+1:])])
+        return cls(cuboids)
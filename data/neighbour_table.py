@@ -0,0 +1,118 @@
+"""
+Neighbour Table
+Similar players of every player, precomputed by process_data.py --neighbours K
+
+For every player, the table keeps the K players the web app's most_similar()
+returns: the candidates playing the same position whose Overall is above 80% of
+the player's Overall, ranked by the Pearson correlation of their six abilities,
+ties by name. The web app then answers a search with a single lookup instead of
+scoring the whole position bucket.
+
+The table is built position bucket by position bucket, scoring a block of
+players against every candidate of their bucket at once with the same
+arithmetic as the web app, so the scores are the ones it would compute. At most
+`block` scores exist at a time, whatever the number of players. Every player is
+searched with its own position, Overall and abilities, also when another player
+has its name, and a name shared by several players is one candidate, its first
+row, like in the web app's search, see player_matrix.py.
+
+write_neighbour_table() stores the arrays as a directory of .npy files:
+    ids        - FIFA ID of every player, in dataset order
+    neighbours - (players x K) FIFA IDs of the neighbours, best first, -1 past the last candidate
+    scores     - (players x K) Pearson scores of the neighbours, NaN past the last candidate
+"""
+
+import os
+
+import numpy  as np
+
+from player_matrix import build_player_matrix, pearson_score_matrix, write_arrays
+
+#############################################################
+def neighbour_table_dirpath(database_filename):
+    """
+    Return the directory of the neighbour table of a cleaned csv file: cleaned_data.csv -> cleaned_data_neighbours
+    """
+    return os.path.splitext(database_filename)[0] + '_neighbours'
+
+#############################################################
+def build_neighbour_table(matrix, k, block=1 << 21):
+    """
+    Compute the k most similar players of every player
+
+    Arguments:
+        matrix - player matrix arrays, see player_matrix.py
+        k      - number of neighbours per player
+        block  - maximum number of scores computed at once
+    Outputs:
+        table  - dict of NumPy arrays, see the module documentation
+    """
+    position  = matrix['position']
+    overall   = matrix['overall']
+    offsets   = matrix['bucket_offsets']
+
+    # ties are ordered by name, highest first, like sorted() on (score, name) tuples
+    _, name_rank = np.unique(matrix['names'], return_inverse=True)
+
+    templates  = np.arange(len(position))
+    rows       = np.full((len(position), k), -1, dtype=np.int64)
+    scores     = np.full((len(position), k), np.nan)
+
+    for i, pos in enumerate(matrix['bucket_positions']):
+        start, stop  = offsets[i], offsets[i+1]
+        bucket_rows  = matrix['bucket_rows'][start:stop]
+        bucket_over  = matrix['bucket_overall'][start:stop]
+        bucket_rank  = name_rank[bucket_rows]
+        features     = matrix['bucket_features'][start:stop]
+        sum_2        = matrix['bucket_sum_2'][start:stop]
+        sum_2_sq     = matrix['bucket_sum_2_sq'][start:stop]
+        abilities    = matrix['abilities_GK'] if pos == "GK" else matrix['abilities_nGK']
+
+        queries = templates[position[templates] == pos]
+        step    = max(1, block // max(1, len(bucket_rows)))
+        for offset in range(0, len(queries), step):
+            batch       = queries[offset:offset+step]
+            block_score = pearson_score_matrix(abilities[batch], features, sum_2, sum_2_sq)
+            candidates  = (bucket_rows[None, :] != batch[:, None]) & \
+                          (bucket_over[None, :] > overall[batch, None]*0.8)
+
+            # keep every candidate scoring at least the k-th best score of its row
+            block_score[~candidates] = -np.inf
+            if block_score.shape[1] > k:
+                threshold  = np.partition(block_score, block_score.shape[1] - k, axis=1)[:, block_score.shape[1] - k]
+                candidates = candidates & (block_score >= threshold[:, None])
+
+            # order the survivors by query, score, name and bucket order, keep k per query
+            query, candidate = np.nonzero(candidates)
+            score = block_score[query, candidate]
+            order = np.lexsort((candidate, -bucket_rank[candidate], -score, query))
+            query, candidate, score = query[order], candidate[order], score[order]
+            rank  = np.arange(len(query)) - np.searchsorted(query, query)
+            top   = rank < k
+
+            rows[batch[query[top]], rank[top]]   = bucket_rows[candidate[top]]
+            scores[batch[query[top]], rank[top]] = score[top]
+
+    ids    = matrix['ids']
+    return {
+        'ids':        np.asarray(ids, dtype=np.int64),
+        'neighbours': np.where(rows >= 0, ids[rows], -1).astype(np.int64),
+        'scores':     scores,
+    }
+
+#############################################################
+def write_neighbour_table(df, dirpath, k, block=1 << 21):
+    """
+    Compute the neighbour table of a cleaned dataset and save it as a directory of .npy files
+
+    Arguments:
+        df      - cleaned data Pandas DataFrame
+        dirpath - destination directory
+        k       - number of neighbours per player
+        block   - maximum number of scores computed at once
+    Outputs:
+        table   - dict of NumPy arrays written
+    """
+    table = build_neighbour_table(build_player_matrix(df), k, block)
+    write_arrays(table, dirpath)
+    return table
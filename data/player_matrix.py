@@ -0,0 +1,189 @@
+"""
+Player Matrix
+Flat NumPy arrays of the players data used by the web app's similarity search and radar charts
+
+build_player_matrix() turns the cleaned DataFrame into a dict of arrays:
+    ids, names, position, overall        - one entry per player, in dataset order
+    abilities_nGK, abilities_GK          - PAC..PHY and DIV..POS ability matrices
+    first_row                            - row of the first player sharing each player's name
+    bucket_positions, bucket_offsets     - candidates grouped by position: bucket i spans
+                                           bucket_offsets[i]:bucket_offsets[i+1]
+    bucket_rows, bucket_first_row,       - candidate rows, first rows of their names, ability
+    bucket_features, bucket_overall,       vectors, Overall and the Pearson partial sums of the
+    bucket_sum_2, bucket_sum_2_sq          candidate side, in bucket order
+
+A name shared by several players is a single candidate, its first row: the
+player the name stands for in the web app. The other players of the name are
+still templates, searched with their own position, Overall and abilities.
+
+write_player_matrix() stores each array as a .npy file in a directory, and
+open_player_matrix() maps them back read-only, so every web server worker
+opening the same directory shares the same physical pages.
+
+pearson_score_matrix() scores ability vectors against the candidates of a
+bucket, it is shared by the web app's similarity search and the neighbour
+table precomputed by process_data.py.
+"""
+
+import os
+import shutil
+
+import numpy  as np
+import pandas as pd
+
+cols_nGK = ['PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY']
+cols_GK  = ['DIV', 'HAN', 'KIC', 'REF', 'SPD', 'POS']
+
+#############################################################
+def player_matrix_dirpath(database_filename):
+    """
+    Return the directory of the player matrix of a cleaned csv file: cleaned_data.csv -> cleaned_data_matrix
+    """
+    return os.path.splitext(database_filename)[0] + '_matrix'
+
+#############################################################
+def build_player_matrix(df):
+    """
+    Build the player matrix arrays of a cleaned dataset
+
+    Arguments:
+        df - cleaned data Pandas DataFrame
+    Outputs:
+        matrix - dict of NumPy arrays, see the module documentation
+    """
+    names    = df['Name'].to_numpy(dtype=str)
+    position = df['Position'].to_numpy(dtype=str)
+    overall  = df['Overall'].to_numpy(dtype=np.float64)
+    abilities_nGK = df[cols_nGK].to_numpy(dtype=np.float64)
+    abilities_GK  = df[cols_GK].to_numpy(dtype=np.float64)
+
+    # Every row mapped to the first row carrying the same name
+    codes, _       = pd.factorize(names)
+    _, first_index = np.unique(codes, return_index=True)
+    first_row      = first_index[codes]
+
+    # Candidates are the first rows of the names, grouped by position
+    candidates       = np.flatnonzero(first_row == np.arange(len(first_row)))
+    bucket_positions = pd.unique(position[candidates]).astype(str)
+    bucket_codes     = pd.Index(bucket_positions).get_indexer(position[candidates])
+    bucket_rows      = candidates[np.argsort(bucket_codes, kind='stable')]
+    bucket_offsets   = np.concatenate([[0], np.cumsum(np.bincount(bucket_codes, minlength=len(bucket_positions)))])
+
+    is_GK           = (position == "GK")[bucket_rows]
+    bucket_features = np.where(is_GK[:, None], abilities_GK[bucket_rows], abilities_nGK[bucket_rows])
+
+    # Accumulate column by column, in the same order sim_pearson() adds
+    # the features up, so the scores are bit-identical to the loop version
+    bucket_sum_2    = np.zeros(len(bucket_rows))
+    bucket_sum_2_sq = np.zeros(len(bucket_rows))
+    for k in range(bucket_features.shape[1]):
+        column = bucket_features[:, k]
+        bucket_sum_2    += column
+        bucket_sum_2_sq += column * column
+
+    return {
+        'ids':              df['ID'].to_numpy(dtype=np.int64),
+        'names':            names,
+        'position':         position,
+        'overall':          overall,
+        'abilities_nGK':    abilities_nGK,
+        'abilities_GK':     abilities_GK,
+        'first_row':        first_row.astype(np.int64),
+        'bucket_positions': bucket_positions,
+        'bucket_offsets':   bucket_offsets.astype(np.int64),
+        'bucket_rows':      bucket_rows.astype(np.int64),
+        'bucket_first_row': bucket_rows.astype(np.int64),
+        'bucket_features':  bucket_features,
+        'bucket_overall':   overall[bucket_rows],
+        'bucket_sum_2':     bucket_sum_2,
+        'bucket_sum_2_sq':  bucket_sum_2_sq,
+    }
+
+#############################################################
+def pearson_score_matrix(player_vectors, features, sum_2, sum_2_sq):
+    """
+    Pearson correlation coefficient between several ability vectors and every
+    candidate of a position bucket, one row of scores per vector, following
+    sim_pearson() step by step. A zero denominator gives a score of 0.
+
+    Arguments:
+        player_vectors - (vectors x 6) ability vectors
+        features       - (candidates x 6) candidate ability vectors, bucket_features
+        sum_2          - candidate partial sums, bucket_sum_2
+        sum_2_sq       - candidate partial sums of squares, bucket_sum_2_sq
+    Outputs:
+        scores         - (vectors x candidates) scores
+    """
+    n = player_vectors.shape[1]
+
+    # the (vectors x candidates) arrays are computed in place, in two buffers
+    sum_1    = np.zeros((len(player_vectors), 1))
+    sum_1_sq = np.zeros((len(player_vectors), 1))
+    p_sum    = np.zeros((len(player_vectors), len(features)))
+    buffer   = np.empty_like(p_sum)
+    for k in range(n):
+        value1    = player_vectors[:, k:k+1]
+        sum_1    += value1
+        sum_1_sq += value1 * value1
+        p_sum    += np.multiply(value1, features[None, :, k], out=buffer)
+
+    # num = p_sum - (sum_1 * sum_2/n)
+    np.multiply(sum_1, sum_2, out=buffer)
+    buffer /= n
+    num     = np.subtract(p_sum, buffer, out=p_sum)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # den = sqrt((sum_1_sq - sum_1^2/n) * (sum_2_sq - sum_2^2/n))
+        den    = np.multiply(sum_1_sq - sum_1 * sum_1/n, sum_2_sq - sum_2 * sum_2/n, out=buffer)
+        den    = np.sqrt(den, out=den)
+        scores = np.divide(num, den, out=num)
+
+    scores[(den == 0) | np.isnan(den)] = 0
+    return scores
+
+#############################################################
+def write_arrays(arrays, dirpath):
+    """
+    Save a dict of NumPy arrays as a directory of .npy files, one per key
+
+    The files are written to a temporary directory which then replaces dirpath,
+    workers that already mapped the previous files keep reading them untouched.
+    """
+    tmppath = dirpath + '.tmp'
+    oldpath = dirpath + '.old'
+    shutil.rmtree(tmppath, ignore_errors=True)
+    os.makedirs(tmppath)
+    for key, array in arrays.items():
+        np.save(os.path.join(tmppath, key + '.npy'), array)
+
+    shutil.rmtree(oldpath, ignore_errors=True)
+    if os.path.exists(dirpath):
+        os.rename(dirpath, oldpath)
+    os.rename(tmppath, dirpath)
+    shutil.rmtree(oldpath, ignore_errors=True)
+
+def write_player_matrix(df, dirpath):
+    """
+    Save the player matrix of a cleaned dataset as a directory of .npy files, see write_arrays()
+
+    Arguments:
+        df      - cleaned data Pandas DataFrame
+        dirpath - destination directory
+    """
+    write_arrays(build_player_matrix(df), dirpath)
+
+#############################################################
+def open_player_matrix(dirpath):
+    """
+    Map a player matrix directory, or any directory written by write_arrays(), read-only
+
+    Arguments:
+        dirpath - directory written by write_player_matrix()
+    Outputs:
+        matrix  - dict of read-only memory-mapped NumPy arrays
+    """
+    matrix = {}
+    for filename in os.listdir(dirpath):
+        key, extension = os.path.splitext(filename)
+        if extension == '.npy':
+            matrix[key] = np.load(os.path.join(dirpath, filename), mmap_mode='r')
+    return matrix
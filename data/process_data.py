@@ -3,15 +3,41 @@ Data Processing Script
 For Udacity Data Scientist Nanodegree Program Project: Capstone Project-FIFA19 Scouting
 
 Usage:
-> python process_data.py data.csv
+> python process_data.py data.csv cleaned_data.csv [--columnar] [--player-matrix] [--chunksize N] [--workers N] [--incremental]
+                                                    [--neighbours K] [--cube] [--sqlite]
+                                                    [--report REPORT_JSON] [--trace-memory] [--profile PROFILE_FILE]
 Arguments:
     1) Input  File: data.csv         - CSV file containing FIFA19 players' data
     2) Output File: cleaned_data.csv - processed data
+Options:
+    --columnar: also write cleaned_data.parquet, a typed columnar copy of the output
+                that the web app loads instead of the CSV (requires pyarrow)
+    --player-matrix: also write cleaned_data_matrix/, the players' ability matrices and
+                metadata as .npy files that the web app workers memory-map and share
+    --chunksize N: read, clean and write the data N rows at a time, so that memory use
+                does not grow with the input size
+    --workers N: clean the data with N worker processes, the output does not depend on N
+    --incremental: only transform the players (by FIFA ID) that are new or changed since the
+                previous --incremental run that wrote cleaned_data.csv, see cleaned_data_state.npz
+    --neighbours K: also write cleaned_data_neighbours/, the K most similar players of every
+                player, that the web app serves instead of searching them, see neighbour_table.py
+    --cube: also write cleaned_data_cube.csv, the count/sum/mean/min/max of the values, wages
+                and ratings by Club, Position, Age, Nationality, Work Rate and Body Type, see aggregate_cube.py
+    --sqlite: also write cleaned_data.sqlite, the players, abilities and position ratings in indexed
+                tables that the web app can query instead of loading the dataset, see sqlite_store.py
+    --report REPORT_JSON: write the wall time, rows in/out and memory of each stage, see run_report.py
+    --trace-memory: also trace the peak memory allocated by each stage (tracemalloc, slower)
+    --profile PROFILE_FILE: profile the run with cProfile, read the file with pstats or snakeviz
 """
 
 # import libraries
+import os
 import sys
 import time
+import argparse
+import cProfile
+import multiprocessing
+import collections
 import math
 import calendar
 import numpy  as np
@@ -19,8 +45,15 @@ import pandas as pd
 from math    import sqrt
 from sklearn import preprocessing
 from sklearn.preprocessing import LabelEncoder
+from player_matrix   import player_matrix_dirpath, write_player_matrix
+from neighbour_table import neighbour_table_dirpath, write_neighbour_table
+from aggregate_cube  import AggregateCube, cube_filepath, cube_columns
+from sqlite_store    import SqliteWriter, sqlite_filepath, write_sqlite
+from schema          import Position_List, Encoded_Columns, Money_Columns, compact_frame, categorical_dtypes
+from run_report      import RunReport, stage, max_rss_mb
 
 #############################################################
+@stage('load_data')
 def load_data(csv_filepath):
     """
     Load Data function:
@@ -38,7 +71,58 @@ def load_data(csv_filepath):
     return df 
 
 #############################################################
-def clean_data(df):
+def read_data_chunks(csv_filepath, chunksize, dtype=None):
+    """
+    Read the input csv file containing FIFA19 players' data in chunks of chunksize rows,
+    the row index keeps counting across the chunks as if the file was read at once
+    
+    Arguments:
+        csv_filepath - CSV file containing FIFA19 players' data
+        chunksize    - number of rows per chunk
+        dtype        - optional column types, see unify_dtypes()
+    Outputs:
+        generator of Pandas DataFrames
+    """
+    for df in pd.read_csv(csv_filepath, chunksize=chunksize, dtype=dtype):
+        del df['Unnamed: 0']
+        yield df
+
+#############################################################
+class GlobalStatistics(object):
+    """
+    Dataset-wide statistics used by the cleaning steps that do not work row by row:
+    the classes of the label encoded categorical features, and the min/max of Height and Weight
+    
+    update() can be called on successive parts of the dataset, each part having gone
+    through handle_missing_values(), the result is the same as for the whole dataset at once.
+    Cleaned rows, whose raw Height and Weight are dropped, count with their Height_float and Weight_float.
+    """
+    def __init__(self):
+        self.classes = dict((column, np.array([], dtype=object)) for column in Encoded_Columns)
+        self.minimum = {}
+        self.maximum = {}
+    
+    @stage('global_statistics')
+    def update(self, df):
+        for column in Encoded_Columns:
+            self.classes[column] = np.union1d(self.classes[column], df[column].unique())
+        
+        for column in ['Height', 'Weight']:
+            if column + '_float' in df:
+                values = df[column + '_float']
+            else:
+                values = convertHeightsWeights2floatnumbers(df[column], column)
+            if len(values) == 0:
+                continue
+            self.minimum[column] = min(self.minimum.get(column, values.min()), values.min())
+            self.maximum[column] = max(self.maximum.get(column, values.max()), values.max())
+    
+    def same_as(self, other):
+        return all(np.array_equal(self.classes[column], other.classes[column]) for column in Encoded_Columns) and \
+               self.minimum == other.minimum and self.maximum == other.maximum
+
+#############################################################
+def clean_data(df, stats=None):
     """Clean FIFA19 data for a visualizaiton dashboard
     Clean Data function
     1. Check & Impute Missing Values
@@ -46,12 +130,106 @@ def clean_data(df):
     3. Dealing with categorical features
     4. Normalization of feature "Height", "Weight"
     5. Combine Position Rating features with average value, this is for Radar Plotting
+    6. Compact types: categoricals, narrow integers and float32 money, without the raw
+       columns replaced by derived ones, see schema.py
+
+    Arguments:
+        df    - raw     data Pandas DataFrame
+        stats - GlobalStatistics of the whole dataset when df is only a part of it,
+                by default they are computed on df
+    Outputs:
+        df - cleaned data Pandas DataFrame
+    """
+    handle_missing_values(df)
+    if stats is None:
+        stats = GlobalStatistics()
+        stats.update(df)
+    
+    # output clean csv file
+    return transform_data(df, stats)
+
+#############################################################
+def transform_data(df, stats):
+    """
+    Steps 2 to 6 of clean_data(), for data whose missing values are already handled.
+    Given the statistics of the whole dataset, every row is transformed independently
+    
+    Arguments:
+        df    - Pandas DataFrame that went through handle_missing_values()
+        stats - GlobalStatistics of the whole dataset
+    Outputs:
+        df - cleaned data Pandas DataFrame
+    """
+    convert_money_values(df)
+    convert_contract_dates(df)
+    convert_position_ratings(df)
+    encode_categorical_features(df, stats)
+    normalize_height_weight(df, stats)
+    combine_ability_ratings(df)
+    return compact_schema(df, stats)
+
+#############################################################
+#Data shared with the worker processes of clean_data_parallel(), inherited when they are forked
+shared_frame = None
+shared_stats = None
+
+def transform_partition(bounds):
+    """
+    Worker process task: transform the rows start:stop of the shared frame
+    """
+    start, stop = bounds
+    return transform_data(shared_frame.iloc[start:stop].copy(), shared_stats)
 
+def clean_data_parallel(df, workers):
+    """
+    clean_data() spread over a pool of worker processes
+    
+    The missing values and the GlobalStatistics are handled first, then the rows are
+    split in one contiguous partition per worker. The workers are forked after the frame
+    is published in shared_frame, so they read it from the parent's memory pages without
+    any copy or serialization, and the partitions are put back together in order: the output
+    does not depend on the number of workers.
+    
     Arguments:
-        df - raw     data Pandas DataFrame
+        df      - raw data Pandas DataFrame
+        workers - number of worker processes
     Outputs:
         df - cleaned data Pandas DataFrame
     """
+    handle_missing_values(df)
+    stats = GlobalStatistics()
+    stats.update(df)
+    
+    if workers <= 1 or len(df) < workers or 'fork' not in multiprocessing.get_all_start_methods():
+        return transform_data(df, stats)
+    
+    return transform_in_workers(df, stats, workers)
+
+@stage('transform_in_workers')
+def transform_in_workers(df, stats, workers):
+    """
+    transform_data() of one contiguous partition of df per forked worker process
+    """
+    global shared_frame, shared_stats
+    
+    bounds = np.linspace(0, len(df), workers + 1).astype(int)
+    shared_frame, shared_stats = df, stats
+    try:
+        with multiprocessing.get_context('fork').Pool(workers) as pool:
+            partitions = pool.map(transform_partition, list(zip(bounds[:-1], bounds[1:])))
+    finally:
+        shared_frame, shared_stats = None, None
+    
+    return pd.concat(partitions)
+
+#############################################################
+# Cleaning steps of clean_data(), each one works in place on the DataFrame, except compact_schema()
+# which returns the compacted DataFrame
+@stage('missing_values')
+def handle_missing_values(df):
+    """
+    Check & Impute Missing Values, rows are considered one at a time
+    """
     #Keep only the rows with at least half non-NA values.
     df.dropna(thresh=14, inplace=True)
     
@@ -59,8 +237,6 @@ def clean_data(df):
     df.drop('Loaned From', axis=1,inplace=True)
     
     #For GK, fill missing value at other positions as "0+0"
-    Position_List = ['LS', 'ST', 'RS', 'LW', 'LF', 'CF', 'RF', 'RW', 'LAM', 'CAM', 'RAM', 'LM', 'LCM',
-                     'CM', 'RCM', 'RM', 'LWB', 'LDM', 'CDM', 'RDM', 'RWB', 'LB', 'LCB', 'CB', 'RCB', 'RB']
     df.loc[df.Position == 'GK', Position_List] = '0+0'
     
     #Fill Missing Value in "Release Clause" with "€0"
@@ -77,42 +253,55 @@ def clean_data(df):
     
     #Drop the rows still with Missing Values(only 12 rows with lots of feature missing
     df.dropna(axis=0, inplace=True)
-    
+
+@stage('money_values')
+def convert_money_values(df):
     #Create New Value_Number_K, Wage_Number_K, ReleaseClause_Number_K column to store numerical type Value info
-    df['Value_Number_K'] = df['Value'].map(lambda x: str2number(x)/1000)
-    df['Wage_Number_K']  = df['Wage'].map(lambda x: str2number(x)/1000)
-    df['ReleaseClause_Number_K'] = df['Release Clause'].map(lambda x: str2number(x)/1000)
+    df['Value_Number_K'] = amounts2numbers(df['Value'])/1000
+    df['Wage_Number_K']  = amounts2numbers(df['Wage'])/1000
+    df['ReleaseClause_Number_K'] = amounts2numbers(df['Release Clause'])/1000
 
+@stage('contract_months')
+def convert_contract_dates(df):
     #Create New Contract_Remaining_Month_Number column to store numerical type Remaining Contract info
-    df['Contract_Remaining_Month_Number'] = df['Contract Valid Until'].map(lambda x: date2monthsnumber(x))
+    df['Contract_Remaining_Month_Number'] = dates2monthsnumbers(df['Contract Valid Until'])
 
+@stage('position_ratings')
+def convert_position_ratings(df):
     #Calculate the final rating and the total increment
+    Final_Ratings, Increment_Ratings = ratings2finalandincrement(df[Position_List])
     Increment_List= []
     for pos in Position_List:
         new_column_name_Final     = pos+"_Final"
         new_column_name_Increment = pos+"_Increment"
-        df[new_column_name_Final]     = df[pos].map(lambda x: rating2finalandincrement(str(x),"final"))
-        df[new_column_name_Increment] = df[pos].map(lambda x: rating2finalandincrement(str(x),"increment"))
+        df[new_column_name_Final]     = Final_Ratings[pos]
+        df[new_column_name_Increment] = Increment_Ratings[pos]
     Increment_List.append(new_column_name_Increment)
     
     df['Total_Increment'] = df[Increment_List].sum(axis=1)
     df.drop(Increment_List, axis=1,inplace=True)
-    
+
+@stage('encodings')
+def encode_categorical_features(df, stats):
     # One-hot encode the feature: "Nationality", "Club", "Work Rate", "Body Type", "Preferred Foot", and "Position"
+    # The encoder classes come from the whole dataset
     le = LabelEncoder()
-    df['Nationality_onehot_encode']   = le.fit_transform(df['Nationality'])
-    df['Club_onehot_encode']          = le.fit_transform(df['Club'])
-    df['WorkRate_onehot_encode']      = le.fit_transform(df['Work Rate'])
-    df['BodyType_onehot_encode']      = le.fit_transform(df['Body Type'])
-    df['PreferredFoot_onehot_encode'] = le.fit_transform(df['Preferred Foot'])
-    df['Position_onehot_encode']      = le.fit_transform(df['Position'])
-    
-    # Normalization of feature "Height", "Weight" using min max normalization
-    df['Height_float'] = df['Height'].map(lambda x: convertHeightWeight2floatnumber(str(x),"Height"))
-    df['Weight_float'] = df['Weight'].map(lambda x: convertHeightWeight2floatnumber(str(x),"Weight"))
-    df['Height_Normalized'] = (df['Height_float'] - df['Height_float'].min())/(df['Height_float'].max() - df['Height_float'].min())
-    df['Weight_Normalized'] = (df['Weight_float'] - df['Weight_float'].min())/(df['Weight_float'].max() - df['Weight_float'].min())
-    
+    for column, encoded_column in Encoded_Columns.items():
+        le.classes_ = stats.classes[column]
+        df[encoded_column] = le.transform(df[column])
+
+@stage('normalization')
+def normalize_height_weight(df, stats):
+    # Normalization of feature "Height", "Weight" using min max normalization over the whole dataset
+    # Rows already cleaned keep Height_float and Weight_float only
+    if 'Height' in df:
+        df['Height_float'] = convertHeightsWeights2floatnumbers(df['Height'],"Height")
+        df['Weight_float'] = convertHeightsWeights2floatnumbers(df['Weight'],"Weight")
+    df['Height_Normalized'] = (df['Height_float'] - stats.minimum['Height'])/(stats.maximum['Height'] - stats.minimum['Height'])
+    df['Weight_Normalized'] = (df['Weight_float'] - stats.minimum['Weight'])/(stats.maximum['Weight'] - stats.minimum['Weight'])
+
+@stage('ability_aggregates')
+def combine_ability_ratings(df):
     #Combine Position Rating with average value
     PAC_List = ['Acceleration','SprintSpeed','Agility']
     SHO_List = ['ShotPower','LongShots','Finishing','FKAccuracy','HeadingAccuracy','Penalties','Curve']
@@ -140,9 +329,11 @@ def clean_data(df):
     df['REF'] = df[REF_List].mean(axis=1)
     df['SPD'] = df[SPD_List].mean(axis=1)
     df['POS'] = df[POS_List].mean(axis=1)
-    
-    # output clean csv file
-    return df
+
+@stage('compact_schema', footprint=True)
+def compact_schema(df, stats):
+    # Categorical codes are the label encodings of encode_categorical_features(), see schema.py
+    return compact_frame(df, stats.classes)
 
 #############################################################
 # Supporting function to convert string values into numbers
@@ -253,17 +444,610 @@ def convertHeightWeight2floatnumber(data,type):
         return float(c)        
 
 #############################################################
-def save_data(df, database_filename):
+# Vectorized counterparts of the supporting functions above, used by clean_data()
+# Each one converts a whole column at once and gives the same values as mapping
+# the scalar function over it
+def amounts2numbers(amounts):
+    """
+    Vectorized str2number()
+    
+    Parameter:
+    amounts(Series): Amount values in string type with M & K as Abbreviation for Million and Thousands
+    
+    Returns:
+    Series: float numbers represent the numerical values of the amounts
+    """
+    amounts     = amounts.astype(str)
+    suffix      = amounts.str[-1]
+    abbreviated = suffix.isin(['M', 'K'])
+    
+    digits      = amounts.str[1:].where(~abbreviated, amounts.str[1:-1]).astype(float)
+    multiplier  = suffix.map({'M': 1000000.0, 'K': 1000.0}).fillna(1.0)
+    return digits*multiplier
+
+def dates2monthsnumbers(dates):
+    """
+    Vectorized date2monthsnumber(), the current date is read once for the whole column
+    
+    Parameter:
+    dates(Series): Date values as YYYY, DD-MM-YYYY or "Mon DD, YYYY" strings
+    
+    Returns:
+    Series: remaining months numbers from the current date, not lower than 0
+    """
+    now           = time.localtime()
+    current_month = now.tm_mon
+    current_year  = now.tm_year
+    month_number  = dict((v,k) for k,v in enumerate(calendar.month_abbr))
+    
+    dates  = dates.astype(str)
+    length = dates.str.len()
+    contract_end_month = pd.Series(np.nan, index=dates.index)
+    contract_end_year  = pd.Series(np.nan, index=dates.index)
+    
+    long_format = length.isin([11, 12])
+    if long_format.any():
+        parts = dates[long_format].str.split(" ")
+        month,day,year = parts.str[0], parts.str[1], parts.str[2]
+        contract_end_month[long_format] = month.map(month_number)
+        contract_end_year[long_format]  = year.astype(int)
+    
+    numeric_format = length == 10
+    if numeric_format.any():
+        parts = dates[numeric_format].str.split("-")
+        day,month,year = parts.str[0], parts.str[1], parts.str[2]
+        contract_end_month[numeric_format] = month.astype(int)
+        contract_end_year[numeric_format]  = year.astype(int)
+    
+    year_format = length == 4
+    if year_format.any():
+        contract_end_month[year_format] = 12
+        contract_end_year[year_format]  = dates[year_format].astype(int)
+    
+    contract_remain_month = ((contract_end_year-current_year)*12 + (contract_end_month-current_month)).clip(lower=0)
+    if contract_remain_month.isnull().any():
+        return contract_remain_month
+    return contract_remain_month.astype(int)
+
+def ratings2finalandincrement(ratings):
+    """
+    Vectorized rating2finalandincrement(), all the position columns are split in a single pass
+    
+    Parameter:
+    ratings(DataFrame): Position Rating Expressions, one column per position
+    
+    Returns:
+    (DataFrame, DataFrame): final ratings and increment ratings, with the same columns as ratings
+    """
+    expressions = ratings.astype(str).to_numpy().ravel()
+    try:
+        base_rating, increment_rating = split_rating_bytes(expressions)
+    except ValueError:
+        # Not plain "<digits>+<digits>" expressions, let the string parser report it
+        parts = pd.Series(expressions).str.split("+", n=1, expand=True)
+        base_rating, increment_rating = parts[0].astype(int).to_numpy(), parts[1].astype(int).to_numpy()
+    
+    base_rating      = base_rating.reshape(ratings.shape)
+    increment_rating = increment_rating.reshape(ratings.shape)
+    
+    final     = pd.DataFrame(base_rating + increment_rating, index=ratings.index, columns=ratings.columns)
+    increment = pd.DataFrame(increment_rating,               index=ratings.index, columns=ratings.columns)
+    return final, increment
+
+def split_rating_bytes(expressions):
+    """
+    Parse "<digits>+<digits>" rating expressions on their fixed width byte representation,
+    digit by digit with NumPy, instead of splitting every string in Python
+    
+    Parameter:
+    expressions(ndarray): Position Rating Expressions
+    
+    Returns:
+    (ndarray, ndarray): base ratings and increment ratings
+    
+    Raises:
+    ValueError: if any expression is not two non-negative integers joined by "+"
+    """
+    try:
+        encoded = expressions.astype('S')
+    except UnicodeEncodeError:
+        raise ValueError("Non ASCII rating expression")
+    width  = encoded.dtype.itemsize
+    chars  = encoded.view(np.uint8).reshape(len(encoded), width)
+    digits = chars.astype(np.int64) - ord('0')
+    
+    is_plus = chars == ord('+')
+    plus    = is_plus.argmax(axis=1)[:, None]
+    end     = (chars != 0).sum(axis=1)[:, None]
+    column  = np.arange(width)
+    before  = column < plus
+    after   = (column > plus) & (column < end)
+    
+    valid = (is_plus.sum(axis=1) == 1) & (plus[:, 0] > 0) & (end[:, 0] > plus[:, 0] + 1) & \
+            np.all(~(before | after) | ((digits >= 0) & (digits <= 9)), axis=1)
+    if not valid.all():
+        raise ValueError("Invalid rating expression")
+    
+    base_rating      = np.where(before, digits * 10**np.clip(plus - 1 - column, 0, None), 0).sum(axis=1)
+    increment_rating = np.where(after,  digits * 10**np.clip(end  - 1 - column, 0, None), 0).sum(axis=1)
+    return base_rating, increment_rating
+
+def convertHeightsWeights2floatnumbers(data,type):
+    """
+    Vectorized convertHeightWeight2floatnumber()
+    
+    Parameter:
+    data(Series): Height/Weight
+    type(str):    Type of the data, Height or Weight
+    
+    Returns:
+    Series: floating numbers of Height/Weight
+    """
+    data = data.astype(str)
+    if type == "Height":
+        parts = data.str.split("'", n=1, expand=True)
+        return parts[0].astype(float) + parts[1].astype(float)/10
+    elif type == "Weight":
+        return data.str[0:-3].astype(float)
+
+#############################################################
+def save_data(df, database_filename, columnar=False, player_matrix=False, neighbours=0, cube=False, sqlite=False):
     """
     Save Data function
     1. Save the clean dataset into csv file
+    2. Optionally save a typed columnar copy next to it, see columnar_filepath()
+    3. Optionally save the memory-mappable player matrix next to it, see player_matrix.py
+    4. Optionally save the table of the similar players of every player, see neighbour_table.py
+    5. Optionally save the aggregate cube of the players, see aggregate_cube.py
+    6. Optionally save the indexed SQLite database of the players, see sqlite_store.py
     
     Arguments:
         df                - Cleaned data Pandas DataFrame
         database_filename - csv file destination path
+        columnar          - also write the Parquet copy of the dataset
+        player_matrix     - also write the player matrix directory
+        neighbours        - number of similar players kept per player in the neighbour table, 0 for none
+        cube              - also write the aggregate cube csv file
+        sqlite            - also write the SQLite database
     """
+    save_csv(df, database_filename)
+    
+    if columnar:
+        save_columnar_copy(df, database_filename)
+    
+    if player_matrix:
+        save_player_matrix(df, database_filename)
+    
+    if neighbours:
+        save_neighbour_table(df, database_filename, neighbours)
+    
+    if cube:
+        save_aggregate_cube(AggregateCube.build(df), database_filename)
+    
+    if sqlite:
+        save_sqlite(df, database_filename)
+
+@stage('save_csv')
+def save_csv(df, database_filename):
     df.to_csv(database_filename)
-    pass
+
+@stage('save_player_matrix')
+def save_player_matrix(df, database_filename):
+    write_player_matrix(df, player_matrix_dirpath(database_filename))
+
+@stage('neighbour_table')
+def save_neighbour_table(df, database_filename, neighbours):
+    start = time.perf_counter()
+    table = write_neighbour_table(df, neighbour_table_dirpath(database_filename), neighbours)
+    print('    Neighbour table: {} players x {} neighbours in {:.1f} s, {:.1f} MB, peak RSS {} MB'.format(
+        len(table['ids']), neighbours, time.perf_counter() - start,
+        sum(array.nbytes for array in table.values()) / 2.0**20,
+        '-' if max_rss_mb() is None else '{:.0f}'.format(max_rss_mb())))
+
+@stage('aggregate_cube')
+def save_aggregate_cube(cube, database_filename):
+    cube.save(cube_filepath(database_filename))
+    print('    Aggregate cube: {} cells in {} cuboids'.format(len(cube), len(cube.cuboids)))
+
+def read_cube_rows(database_filename):
+    """
+    Read the columns of the aggregate cube back from a cleaned csv file, with the exact values that were written
+    """
+    return pd.read_csv(database_filename, usecols=cube_columns, float_precision='round_trip')
+
+@stage('save_sqlite')
+def save_sqlite(df, database_filename):
+    players = write_sqlite(df, sqlite_filepath(database_filename))
+    print('    SQLite database: {} players, {:.1f} MB'.format(
+        players, os.path.getsize(sqlite_filepath(database_filename)) / 2.0**20))
+
+@stage('save_columnar_copy')
+def save_columnar_copy(df, database_filename):
+    try:
+        df.to_parquet(columnar_filepath(database_filename), index=False)
+    except ImportError:
+        print('    pyarrow is not installed, the columnar copy was not written')
+
+#############################################################
+def columnar_filepath(database_filename):
+    """
+    Return the path of the Parquet copy of a cleaned csv file: cleaned_data.csv -> cleaned_data.parquet
+    """
+    return os.path.splitext(database_filename)[0] + '.parquet'
+
+#############################################################
+def unify_dtypes(chunk_dtypes):
+    """
+    Merge the column types pandas inferred for each chunk of a csv file into the types
+    to read every chunk with: integers and floats become floats, anything else mixed stays object
+    
+    Arguments:
+        chunk_dtypes - list of the dtypes Series of the chunks
+    Outputs:
+        dict column -> dtype
+    """
+    dtypes = {}
+    for column in chunk_dtypes[0].index:
+        kinds = set(chunk[column] for chunk in chunk_dtypes)
+        if len(kinds) == 1:
+            dtypes[column] = kinds.pop()
+        elif all(pd.api.types.is_numeric_dtype(kind) and not pd.api.types.is_bool_dtype(kind) for kind in kinds):
+            dtypes[column] = np.float64
+        else:
+            dtypes[column] = object
+    return dtypes
+
+#############################################################
+def process_data_in_chunks(csv_filepath, database_filename, chunksize, columnar=False, player_matrix=False, workers=1,
+                           neighbours=0, cube=False, sqlite=False):
+    """
+    Chunked ETL pipeline, memory use is bounded by the chunk size instead of the input size
+    
+    1. First pass: handle the missing values of every chunk and accumulate the
+       GlobalStatistics (encoder classes, Height/Weight min/max) and column types
+    2. Second pass: clean every chunk with the statistics of the whole dataset,
+       and append it to the output csv file (and Parquet copy, and SQLite database)
+    
+    With several workers, the chunks of the second pass are cleaned by a process pool,
+    at most two chunks per worker being in flight, and written back in input order.
+    
+    The output is the same as load_data() + clean_data() + save_data() on the whole file.
+    The player matrix, the neighbour table and the aggregate cube describe every player at
+    once, they are built afterwards from the few columns they need, read back from the output
+    csv file.
+    
+    Arguments:
+        csv_filepath      - CSV file containing FIFA19 players' data
+        database_filename - csv file destination path
+        chunksize         - number of input rows per chunk
+        columnar          - also write the Parquet copy of the dataset
+        player_matrix     - also write the player matrix directory
+        workers           - number of worker processes cleaning the chunks
+        neighbours        - number of similar players kept per player in the neighbour table, 0 for none
+        cube              - also write the aggregate cube csv file
+        sqlite            - also write the SQLite database
+    """
+    stats        = GlobalStatistics()
+    chunk_dtypes = []
+    for df in read_data_chunks(csv_filepath, chunksize):
+        chunk_dtypes.append(df.dtypes)
+        handle_missing_values(df)
+        stats.update(df)
+    dtypes = unify_dtypes(chunk_dtypes)
+    dtypes['Unnamed: 0'] = np.int64
+    
+    parquet_writer = None
+    if columnar:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print('    pyarrow is not installed, the columnar copy was not written')
+            columnar = False
+    
+    sqlite_writer = SqliteWriter(sqlite_filepath(database_filename)) if sqlite else None
+    
+    first_chunk = True
+    def write_chunk(df):
+        nonlocal first_chunk, parquet_writer
+        df.to_csv(database_filename, mode='w' if first_chunk else 'a', header=first_chunk)
+        
+        if sqlite_writer is not None:
+            sqlite_writer.append(df)
+        
+        if columnar:
+            # float32 money only in the chunks where float32 holds every value, one type per Parquet column
+            df = df.astype(dict((column, np.float64) for column in Money_Columns if column in df))
+            if parquet_writer is None:
+                table = pyarrow.Table.from_pandas(df, preserve_index=False)
+                parquet_writer = pyarrow.parquet.ParquetWriter(columnar_filepath(database_filename), table.schema)
+            else:
+                table = pyarrow.Table.from_pandas(df, schema=parquet_writer.schema, preserve_index=False)
+            parquet_writer.write_table(table)
+        first_chunk = False
+    
+    chunks = read_data_chunks(csv_filepath, chunksize, dtype=dtypes)
+    if workers <= 1:
+        for df in chunks:
+            write_chunk(clean_data(df, stats))
+    else:
+        with multiprocessing.Pool(workers) as pool:
+            pending = collections.deque()
+            for df in chunks:
+                pending.append(pool.apply_async(clean_data, (df, stats)))
+                if len(pending) >= 2 * workers:
+                    write_chunk(pending.popleft().get())
+            while pending:
+                write_chunk(pending.popleft().get())
+    
+    if parquet_writer is not None:
+        parquet_writer.close()
+    
+    if sqlite_writer is not None:
+        print('    SQLite database: {} players'.format(sqlite_writer.close()))
+    
+    if player_matrix or neighbours:
+        columns = ['ID', 'Name', 'Position', 'Overall', 'PAC', 'SHO', 'PAS', 'DRI', 'DEF', 'PHY',
+                   'DIV', 'HAN', 'KIC', 'REF', 'SPD', 'POS']
+        df = pd.read_csv(database_filename, usecols=columns, float_precision='round_trip')
+        if player_matrix:
+            save_player_matrix(df, database_filename)
+        if neighbours:
+            save_neighbour_table(df, database_filename, neighbours)
+    
+    if cube:
+        save_aggregate_cube(AggregateCube.build(read_cube_rows(database_filename)), database_filename)
+
+#############################################################
+def incremental_state_filepath(database_filename):
+    """
+    Return the path of the incremental run state of a cleaned csv file: cleaned_data.csv -> cleaned_data_state.npz
+    """
+    return os.path.splitext(database_filename)[0] + '_state.npz'
+
+def current_month_number():
+    now = time.localtime()
+    return now.tm_year*12 + now.tm_mon
+
+def file_signature(filepath):
+    stat = os.stat(filepath)
+    return np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+
+@stage('row_hashes')
+def row_hashes(df):
+    """
+    Content hash of every raw input row
+    """
+    return pd.util.hash_pandas_object(df, index=False).to_numpy()
+
+def save_incremental_state(df_raw_ids, df_raw_hashes, database_filename):
+    """
+    Save the FIFA IDs and content hashes of the raw rows behind the cleaned csv file,
+    together with the month of the run and the signature of the csv file written
+    """
+    np.savez(incremental_state_filepath(database_filename),
+             ids       = df_raw_ids,
+             hashes    = df_raw_hashes,
+             month     = current_month_number(),
+             signature = file_signature(database_filename))
+
+def load_incremental_state(database_filename):
+    """
+    Load the state saved by the previous run, None if it cannot be used for an incremental run:
+    missing state or output, output modified since, or contract months computed in another month
+    """
+    state_filepath = incremental_state_filepath(database_filename)
+    if not (os.path.exists(state_filepath) and os.path.exists(database_filename)):
+        return None
+    state = dict(np.load(state_filepath))
+    if state['month'] != current_month_number():
+        return None
+    if not np.array_equal(state['signature'], file_signature(database_filename)):
+        return None
+    return state
+
+#############################################################
+def process_data_incrementally(df, database_filename, columnar=False, player_matrix=False, neighbours=0, cube=False,
+                               sqlite=False):
+    """
+    Incremental cleaning: only the raw rows that are new or changed since the previous run
+    are transformed, the other rows are taken back from the previous cleaned csv file
+    
+    Rows are keyed by their FIFA "ID" and compared by the content hash of the raw row.
+    Rows with a missing "Contract Valid Until" are always transformed again since they are
+    filled with the current date.
+    
+    The label encodings and the Height/Weight normalization depend on the whole dataset.
+    When their GlobalStatistics are the same as in the previous run, the csv lines of the
+    unchanged players are copied as they are, only renumbered. Otherwise the domain changed:
+    the previous rows are loaded, those few columns are recomputed, and the whole csv file
+    is written again.
+    
+    Without a usable state from a previous run, this is a full clean_data() run.
+    The output is the same as clean_data() + save_data() on the raw data. The neighbour
+    table depends on every player of a position, it is always computed again, and so is the
+    SQLite database, whose rows are renumbered. The aggregate
+    cube of the previous run, if it is newer than its csv file, is updated with the rows of
+    the removed and changed players, see AggregateCube.update().
+    
+    Arguments:
+        df                - raw data Pandas DataFrame
+        database_filename - csv file written by the previous run, and destination path
+        columnar          - also write the Parquet copy of the dataset
+        player_matrix     - also write the player matrix directory
+        neighbours        - number of similar players kept per player in the neighbour table, 0 for none
+        cube              - also write the aggregate cube csv file
+        sqlite            - also write the SQLite database
+    Outputs:
+        summary - dict with the number of reused, transformed and removed rows
+    """
+    ids    = df['ID'].to_numpy()
+    hashes = row_hashes(df)
+    state  = load_incremental_state(database_filename)
+    
+    if state is None or len(np.unique(ids)) != len(ids):
+        # rows read, like the transformed rows of an incremental run: clean_data() drops rows in place
+        rows = len(df)
+        save_data(clean_data(df), database_filename, columnar=columnar, player_matrix=player_matrix,
+                  neighbours=neighbours, cube=cube, sqlite=sqlite)
+        save_incremental_state(ids, hashes, database_filename)
+        return {'mode': 'full', 'transformed': rows}
+    
+    previous_row = pd.Index(state['ids']).get_indexer(ids)
+    unchanged    = (previous_row >= 0) & (state['hashes'][previous_row] == hashes) & \
+                   df['Contract Valid Until'].notnull().to_numpy()
+    
+    # Columns of the previous output behind its GlobalStatistics
+    previous = pd.read_csv(database_filename, usecols=['ID', 'Height_float', 'Weight_float'] + list(Encoded_Columns),
+                           float_precision='round_trip')
+    previous_stats = GlobalStatistics()
+    previous_stats.update(previous)
+    
+    # Reuse the previous rows of the unchanged players. An unchanged player
+    # missing from the previous output had been dropped by handle_missing_values()
+    position     = pd.Series(df.index, index=ids)
+    reused       = previous['ID'].isin(ids[unchanged]).to_numpy()
+    reused_index = position[previous['ID'][reused]].to_numpy()
+    
+    changed = df[~unchanged].copy()
+    handle_missing_values(changed)
+    
+    stats = GlobalStatistics()
+    stats.update(previous[reused])
+    stats.update(changed)
+    changed = transform_data(changed, stats)
+    
+    summary = {'mode':           'incremental',
+               'reused':         int(reused.sum()),
+               'transformed':    int((~unchanged).sum()),
+               'removed':        int((~previous['ID'].isin(ids)).sum()),
+               'domain_changed': not stats.same_as(previous_stats)}
+    
+    # Previous rows of the removed and changed players, to take them out of the previous cube
+    previous_cube = load_previous_cube(database_filename, len(previous)) if cube else None
+    if previous_cube is not None:
+        removed_rows = read_cube_rows(database_filename)[~reused]
+    
+    if summary['domain_changed'] or not splice_csv_rows(database_filename, reused, reused_index, changed):
+        previous = load_previous_output(database_filename)
+        previous = previous[reused].copy()
+        previous.index = reused_index
+        encode_categorical_features(previous, stats)
+        normalize_height_weight(previous, stats)
+        save_data(compact_schema(pd.concat([previous[changed.columns], changed]).sort_index(), stats),
+                  database_filename)
+    
+    if columnar or player_matrix or neighbours or sqlite:
+        previous = load_previous_output(database_filename)
+        if columnar:
+            save_columnar_copy(previous, database_filename)
+        if player_matrix:
+            save_player_matrix(previous, database_filename)
+        if neighbours:
+            save_neighbour_table(previous, database_filename, neighbours)
+        if sqlite:
+            save_sqlite(previous, database_filename)
+    
+    if cube and previous_cube is not None:
+        summary['cube'] = 'updated'
+        save_aggregate_cube(previous_cube.update(removed_rows, changed[cube_columns],
+                                                 lambda: read_cube_rows(database_filename)), database_filename)
+    elif cube:
+        summary['cube'] = 'built'
+        save_aggregate_cube(AggregateCube.build(read_cube_rows(database_filename)), database_filename)
+    
+    save_incremental_state(ids, hashes, database_filename)
+    return summary
+
+def load_previous_cube(database_filename, players):
+    """
+    Load the aggregate cube of the previous run, None when it is missing, older than the
+    cleaned csv file, or does not count its players
+    """
+    filepath = cube_filepath(database_filename)
+    if not os.path.exists(filepath) or os.stat(filepath).st_mtime_ns < os.stat(database_filename).st_mtime_ns:
+        return None
+    previous_cube = AggregateCube.load(filepath)
+    if previous_cube.query(statistics=['count'], measures=[])['count'].sum() != players:
+        return None
+    return previous_cube
+
+@stage('load_previous_output')
+def load_previous_output(database_filename):
+    """
+    Read a cleaned csv file back with the exact values that were written, in the compact types of clean_data()
+    """
+    return compact_frame(pd.read_csv(database_filename, index_col=0, float_precision='round_trip',
+                                     dtype=categorical_dtypes(Encoded_Columns)))
+
+@stage('splice_csv_rows')
+def splice_csv_rows(database_filename, reused, reused_index, changed):
+    """
+    Rewrite a cleaned csv file keeping the text of the reused rows and adding the changed rows
+    
+    Arguments:
+        database_filename - cleaned csv file
+        reused            - boolean mask of the csv rows to keep
+        reused_index      - new row index of the kept rows
+        changed           - cleaned rows to add, with their row index
+    Outputs:
+        False, without writing anything, if the rows cannot be spliced line by line
+    """
+    with open(database_filename, encoding='utf-8', newline='') as f:
+        header = f.readline()
+        lines  = f.readlines()
+    
+    changed_lines = changed.to_csv(header=False).splitlines(keepends=True)
+    if len(lines) != len(reused) or len(changed_lines) != len(changed) or \
+       header != changed.head(0).to_csv():
+        return False
+    
+    rows = [(index, str(index) + lines[i][lines[i].index(','):])
+            for i, index in zip(np.flatnonzero(reused), reused_index.tolist())]
+    rows += zip(changed.index.tolist(), changed_lines)
+    rows.sort(key=lambda row: row[0])
+    
+    with open(database_filename, 'w', encoding='utf-8', newline='') as f:
+        f.write(header)
+        f.writelines(line for _, line in rows)
+    return True
+
+#############################################################
+def parse_arguments(argv):
+    """
+    Parse the command line arguments of the ETL pipeline
+    """
+    parser = argparse.ArgumentParser(
+        description='ETL Pipeline Script to process the FIFA19 dataset',
+        epilog='Example: python process_data.py data.csv cleaned_data.csv')
+    parser.add_argument('csv_filepath',      help='CSV file containing FIFA19 players\' data')
+    parser.add_argument('database_filepath', help='destination of the cleaned csv file')
+    parser.add_argument('--columnar', action='store_true',
+                        help='also write a typed Parquet copy of the cleaned data, loaded by the web app')
+    parser.add_argument('--player-matrix', action='store_true',
+                        help='also write the memory-mappable player matrix shared by the web app workers')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='process the input in chunks of this many rows, with bounded memory use')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of worker processes cleaning the data (default: 1, no process pool)')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only transform the players added or changed since the previous run into database_filepath')
+    parser.add_argument('--neighbours', type=int, default=0, metavar='K',
+                        help='also precompute the K most similar players of every player, served by the web app')
+    parser.add_argument('--cube', action='store_true',
+                        help='also write the aggregate cube of the players, served by the web app')
+    parser.add_argument('--sqlite', action='store_true',
+                        help='also write the indexed SQLite database of the players, queried by the web app')
+    parser.add_argument('--report', metavar='REPORT_JSON',
+                        help='write the time, rows and memory of each stage of the run to this JSON file')
+    parser.add_argument('--trace-memory', action='store_true',
+                        help='trace the peak memory allocated by each stage with tracemalloc (slower)')
+    parser.add_argument('--profile', metavar='PROFILE_FILE',
+                        help='profile the run with cProfile and save the statistics to this file')
+    args = parser.parse_args(argv)
+    if args.incremental and args.chunksize:
+        parser.error('--incremental cannot be combined with --chunksize')
+    return args
 
 #############################################################
 def main():
@@ -276,28 +1060,68 @@ def main():
         3) Data loading to csv file
     """
     print(sys.argv)
+    args = parse_arguments(sys.argv[1:])
+    
+    # optional instrumentation of the run, see run_report.py
+    report   = RunReport(trace_memory=args.trace_memory) if args.report or args.trace_memory else None
+    profiler = cProfile.Profile() if args.profile else None
+    if report is not None:
+        report.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        run_pipeline(args)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            print('Profile saved to {}'.format(args.profile))
+        if report is not None:
+            report.stop()
+            print('Stages ({:.3f} s):'.format(report.seconds))
+            print('\n'.join(report.summary()))
+            if args.report:
+                report.save(args.report, argv=sys.argv, options=vars(args))
+                print('Run report saved to {}'.format(args.report))
 
-    if len(sys.argv) == 3:
+def run_pipeline(args):
+    """
+    Run the ETL pipeline selected by the command line arguments
+    """
+    if args.chunksize:
+        print('Processing data in chunks of {} rows...\n    Players: {}\n    DATABASE: {}'.format(
+            args.chunksize, args.csv_filepath, args.database_filepath))
+        process_data_in_chunks(args.csv_filepath, args.database_filepath, args.chunksize,
+                               columnar=args.columnar, player_matrix=args.player_matrix,
+                               workers=args.workers, neighbours=args.neighbours, cube=args.cube,
+                               sqlite=args.sqlite)
+        print('Cleaned data saved to database!')
+        return
 
-        csv_filepath, database_filepath = sys.argv[1:]
+    print('Loading data...\n    Players: {}\n'.format(args.csv_filepath))
+    df = load_data(args.csv_filepath)
 
-        print('Loading data...\n    Players: {}\n'.format(csv_filepath))
-        df = load_data(csv_filepath)
+    if args.incremental:
+        print('Cleaning and saving the new or changed players...\n    DATABASE: {}'.format(args.database_filepath))
+        summary = process_data_incrementally(df, args.database_filepath,
+                                             columnar=args.columnar, player_matrix=args.player_matrix,
+                                             neighbours=args.neighbours, cube=args.cube, sqlite=args.sqlite)
+        print('    {}'.format(summary))
+        print('Cleaned data saved to database!')
+        return
 
-        print('Cleaning data...')
+    print('Cleaning data...')
+    if args.workers > 1:
+        df = clean_data_parallel(df, args.workers)
+    else:
         df = clean_data(df)
-        
-        print('Saving data...\n    DATABASE: {}'.format(database_filepath))
-        save_data(df, database_filepath)
-        
-        print('Cleaned data saved to database!')
     
-    else:
-        print('Please provide the filepaths of the FIFA19 csv dataset as the'\
-              'first argument respectively, as well as the filepath of the'\
-              'database to save the cleaned data to as the second argument.'\
-              '\n\nExample: python process_data.py data.csv cleaned_data.csv')
+    print('Saving data...\n    DATABASE: {}'.format(args.database_filepath))
+    save_data(df, args.database_filepath, columnar=args.columnar, player_matrix=args.player_matrix,
+              neighbours=args.neighbours, cube=args.cube, sqlite=args.sqlite)
+    
+    print('Cleaned data saved to database!')
 
 #############################################################
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
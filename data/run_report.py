@@ -0,0 +1,172 @@
+"""
+Run Report
+Per-stage instrumentation of the ETL pipeline
+
+The steps of process_data.py are decorated with @stage('name'). While a
+RunReport is active, every call of a step records its wall time, the rows of
+the DataFrame it received and returned (or modified in place) and the memory
+high-water mark of the process after it. Steps decorated with footprint=True
+also record the memory held by the DataFrames they received and returned,
+strings included (slower to measure). With trace_memory, the peak memory
+allocated during the step is traced too (tracemalloc, slower), and the report
+lists the lines that allocated the most. Calls of the same step, e.g. one per
+chunk, are added up. Without an active report the decorated steps run as they
+are.
+
+Steps running in forked worker processes are not recorded, only the time the
+parent waited for them.
+"""
+
+import sys
+import json
+import time
+import functools
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import pandas as pd
+
+from schema import memory_footprint
+
+# RunReport recording the decorated steps, None when the pipeline is not instrumented
+active_report = None
+
+#############################################################
+def max_rss_mb():
+    """
+    High-water mark of the resident memory of the process, in MB (None where unavailable)
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return maxrss / 2.0**20 if sys.platform == 'darwin' else maxrss / 2.0**10
+
+def rows(value):
+    return len(value) if isinstance(value, pd.DataFrame) else None
+
+def frame_mb(value):
+    return memory_footprint(value) / 2.0**20 if isinstance(value, pd.DataFrame) else None
+
+#############################################################
+class RunReport(object):
+    """
+    Timing, rows and memory of each stage of one ETL run
+
+    Parameter:
+    trace_memory: trace the peak memory allocated by each stage with tracemalloc
+    """
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages       = {}
+        self.started      = None
+        self.seconds      = None
+        self.top_allocations = []
+
+    def start(self):
+        global active_report
+        active_report = self
+        self.started  = time.time()
+        if self.trace_memory:
+            tracemalloc.start()
+
+    def stop(self):
+        global active_report
+        active_report = None
+        self.seconds  = time.time() - self.started
+        if self.trace_memory:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self.top_allocations = [{'line': str(statistic.traceback), 'mb': statistic.size / 2.0**20}
+                                    for statistic in snapshot.statistics('lineno')[:10]]
+
+    def record(self, name, seconds, rows_in, rows_out, traced_peak_mb, frame_mb_in=None, frame_mb_out=None):
+        entry = self.stages.setdefault(name, {'stage': name, 'calls': 0, 'seconds': 0.0,
+                                              'rows_in': None, 'rows_out': None,
+                                              'max_rss_mb': None, 'traced_peak_mb': None,
+                                              'frame_mb_in': None, 'frame_mb_out': None})
+        entry['calls']      += 1
+        entry['seconds']    += seconds
+        entry['max_rss_mb']  = max_rss_mb()
+        for key, value in (('rows_in', rows_in), ('rows_out', rows_out),
+                           ('frame_mb_in', frame_mb_in), ('frame_mb_out', frame_mb_out)):
+            if value is not None:
+                entry[key] = (entry[key] or 0) + value
+        if traced_peak_mb is not None:
+            entry['traced_peak_mb'] = max(entry['traced_peak_mb'] or 0, traced_peak_mb)
+
+    def to_dict(self, **details):
+        return dict(details,
+                    started=time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                    seconds=self.seconds,
+                    max_rss_mb=max_rss_mb(),
+                    stages=list(self.stages.values()),
+                    top_allocations=self.top_allocations)
+
+    def save(self, filepath, **details):
+        """
+        Write the report as JSON, with the given details (command line, options...)
+        """
+        with open(filepath, 'w') as f:
+            json.dump(self.to_dict(**details), f, indent=2)
+
+    def summary(self):
+        """
+        Return the stages as text lines, slowest first
+        """
+        lines = ['    {:<30} {:>6} {:>9} {:>9} {:>9} {:>10}'.format('stage', 'calls', 'seconds', 'rows in', 'rows out', 'peak MB')]
+        for entry in sorted(self.stages.values(), key=lambda entry: -entry['seconds']):
+            peak = entry['traced_peak_mb'] if entry['traced_peak_mb'] is not None else entry['max_rss_mb']
+            lines.append('    {:<30} {:>6} {:>9.3f} {:>9} {:>9} {:>10}'.format(
+                entry['stage'], entry['calls'], entry['seconds'],
+                '-' if entry['rows_in'] is None else entry['rows_in'],
+                '-' if entry['rows_out'] is None else entry['rows_out'],
+                '-' if peak is None else '{:.1f}'.format(peak)))
+        for entry in self.stages.values():
+            if entry['frame_mb_in'] and entry['frame_mb_out']:
+                lines.append('    {}: DataFrame {:.1f} MB in, {:.1f} MB out ({:.1f}x smaller)'.format(
+                    entry['stage'], entry['frame_mb_in'], entry['frame_mb_out'],
+                    entry['frame_mb_in'] / entry['frame_mb_out']))
+        return lines
+
+#############################################################
+def stage(name, footprint=False):
+    """
+    Decorator recording the calls of a pipeline step in the active RunReport.
+    The first argument of the step, when it is a DataFrame, gives the rows in, and
+    the returned DataFrame, or the first argument modified in place, the rows out.
+    With footprint, their memory footprints are recorded too.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            report = active_report
+            if report is None:
+                return function(*args, **kwargs)
+
+            rows_in     = rows(args[0]) if args else None
+            frame_mb_in = frame_mb(args[0]) if footprint and args else None
+            if report.trace_memory:
+                tracemalloc.reset_peak()
+                base = tracemalloc.get_traced_memory()[0]
+            start  = time.perf_counter()
+            result = function(*args, **kwargs)
+            seconds = time.perf_counter() - start
+
+            traced_peak_mb = None
+            if report.trace_memory:
+                traced_peak_mb = (tracemalloc.get_traced_memory()[1] - base) / 2.0**20
+            rows_out = rows(result)
+            if rows_out is None and args:
+                rows_out = rows(args[0])
+            frame_mb_out = None
+            if footprint:
+                frame_mb_out = frame_mb(result) if isinstance(result, pd.DataFrame) else frame_mb(args[0])
+            report.record(name, seconds, rows_in, rows_out, traced_peak_mb, frame_mb_in, frame_mb_out)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,131 @@
+"""
+Schema
+Compact in-memory types of the cleaned FIFA19 dataset, applied by clean_data() and by the web app loader
+
+Pandas gives every column its default type: one Python object per string, and
+int64/float64 for the numbers. compact_frame() stores the same values in less
+memory:
+
+    categoricals - Nationality, Club, Work Rate, Body Type, Preferred Foot and Position
+                   are dictionary encoded, each distinct string is stored once and
+                   each row holds a small integer code. The codes are the label
+                   encodings clean_data() writes to the *_onehot_encode columns
+    integers     - ages and 0-99 ratings are int8, label encodings, Special and contract
+                   months int16, IDs int32
+    money        - Value_Number_K, Wage_Number_K and ReleaseClause_Number_K are float32
+                   when float32 holds every value exactly, as it does the thousands of
+                   euros of FIFA19 (whole or half thousands)
+    superseded   - the raw text columns replaced by derived ones are dropped: the
+                   "88+2" position ratings (<pos>_Final, <pos>_Increment), the "€110.5M"
+                   amounts (*_Number_K), the "5'9" heights and "159lbs" weights
+                   (Height_float, Weight_float) and the contract dates
+                   (Contract_Remaining_Month_Number)
+
+A column is only converted when every value fits the compact type, otherwise
+it keeps its type (missing, fractional or out of range values): a compact
+frame always holds the values of the default types. Sums of float32 money and
+differences of int8 ratings can round or overflow, consumers compute them on
+float64 copies of the columns.
+"""
+
+import numpy  as np
+import pandas as pd
+
+#Columns of the position ratings, like "88+2"
+Position_List = ['LS', 'ST', 'RS', 'LW', 'LF', 'CF', 'RF', 'RW', 'LAM', 'CAM', 'RAM', 'LM', 'LCM',
+                 'CM', 'RCM', 'RM', 'LWB', 'LDM', 'CDM', 'RDM', 'RWB', 'LB', 'LCB', 'CB', 'RCB', 'RB']
+
+#Categorical features and the columns storing their label encoding
+Encoded_Columns = {
+    'Nationality':    'Nationality_onehot_encode',
+    'Club':           'Club_onehot_encode',
+    'Work Rate':      'WorkRate_onehot_encode',
+    'Body Type':      'BodyType_onehot_encode',
+    'Preferred Foot': 'PreferredFoot_onehot_encode',
+    'Position':       'Position_onehot_encode',
+}
+
+#0-99 ratings of the players' skills
+Skill_Columns = ['Crossing', 'Finishing', 'HeadingAccuracy', 'ShortPassing', 'Volleys', 'Dribbling', 'Curve',
+                 'FKAccuracy', 'LongPassing', 'BallControl', 'Acceleration', 'SprintSpeed', 'Agility', 'Reactions',
+                 'Balance', 'ShotPower', 'Jumping', 'Stamina', 'Strength', 'LongShots', 'Aggression',
+                 'Interceptions', 'Positioning', 'Vision', 'Penalties', 'Composure', 'Marking', 'StandingTackle',
+                 'SlidingTackle', 'GKDiving', 'GKHandling', 'GKKicking', 'GKPositioning', 'GKReflexes']
+
+#compact type of the integer columns
+Rating_Columns  = ['Age', 'Overall', 'Potential', 'International Reputation', 'Weak Foot', 'Skill Moves',
+                   'Jersey Number'] + Skill_Columns + \
+                  [pos + suffix for pos in Position_List for suffix in ('_Final', '_Increment')]
+Integer_Columns = dict([('ID', np.int32), ('Special', np.int16), ('Contract_Remaining_Month_Number', np.int16),
+                        ('Total_Increment', np.int16)] +
+                       [(column, np.int8) for column in Rating_Columns] +
+                       [(column, np.int16) for column in Encoded_Columns.values()])
+
+Money_Columns = ['Value_Number_K', 'Wage_Number_K', 'ReleaseClause_Number_K']
+
+#raw columns replaced by the columns derived from them
+Superseded_Columns = ['Value', 'Wage', 'Release Clause', 'Contract Valid Until', 'Height', 'Weight'] + Position_List
+
+#############################################################
+def fits_integer(values, dtype):
+    """
+    True if an integer type holds every value of a numeric array: none missing, fractional or out of range
+    """
+    if values.dtype.kind not in 'iuf':
+        return False
+    if values.dtype.kind == 'f' and not np.array_equal(values, np.floor(values)):
+        return False
+    info = np.iinfo(dtype)
+    return len(values) == 0 or (info.min <= values.min() and values.max() <= info.max)
+
+def exact_float32(values):
+    """
+    True if float32 holds every value of a float array exactly, missing values included
+    """
+    return np.array_equal(values.astype(np.float32).astype(values.dtype), values, equal_nan=True)
+
+def categorical_dtypes(columns):
+    """
+    Return the read_csv() dtype of the categorical columns among columns. Pandas
+    sorts the categories like LabelEncoder sorts its classes: the codes are the label encodings
+    """
+    return dict((column, 'category') for column in Encoded_Columns if column in columns)
+
+#############################################################
+def compact_frame(df, classes=None):
+    """
+    Return a cleaned dataset with the compact types of the schema, without its superseded columns
+
+    Arguments:
+        df      - cleaned data Pandas DataFrame, or some of its columns
+        classes - dict categorical column -> label encoder classes, to build the categoricals
+                  from the codes of the *_onehot_encode columns. By default the categories
+                  are the sorted distinct values of each column
+    Outputs:
+        df - Pandas DataFrame with the same values and the compact types
+    """
+    # a new DataFrame of the converted columns: none of them is a view keeping the previous blocks alive
+    columns = {}
+    for column in df.columns:
+        values = df[column]
+        if column in Superseded_Columns:
+            continue
+        if column in Encoded_Columns and not isinstance(values.dtype, pd.CategoricalDtype):
+            encoded_column = Encoded_Columns[column]
+            if classes is not None and encoded_column in df:
+                values = pd.Categorical.from_codes(df[encoded_column].to_numpy(), categories=classes[column])
+            else:
+                values = values.astype('category')
+        elif column in Integer_Columns and values.dtype != Integer_Columns[column] and \
+             fits_integer(values.to_numpy(), Integer_Columns[column]):
+            values = values.astype(Integer_Columns[column])
+        elif column in Money_Columns and values.dtype == np.float64 and exact_float32(values.to_numpy()):
+            values = values.astype(np.float32)
+        columns[column] = values
+    return pd.DataFrame(columns, index=df.index)
+
+def memory_footprint(df):
+    """
+    Return the bytes held by a DataFrame, its strings included
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
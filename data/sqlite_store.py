@@ -0,0 +1,164 @@
+"""
+SQLite Store
+The cleaned FIFA19 players as an indexed SQLite database, written by process_data.py --sqlite
+
+The database, cleaned_data.sqlite next to the csv file, has three tables keyed
+by the row of the player in the cleaned csv file:
+
+    players          - ID, Name, Position, Overall, Club, values and wages... and
+                       first_row, the row of the first player sharing the name
+    abilities        - the PAC..PHY and DIV..POS abilities compared by most_similar()
+    position_ratings - the <position>_Final / _Increment ratings and Total_Increment
+
+Indexes cover the lookups of the web app: players by ID, by Name, by first_row
+(the players standing for each name), and by Position and Overall: the candidate
+names of a similarity search are a single range of that index.
+
+SqliteWriter inserts the rows chunk by chunk with executemany() in one large
+transaction, the database in WAL mode, and builds the indexes once every row is
+in. The file is written next to the destination and renamed over it at the end,
+so a web app reading the previous database never sees a half-written one. The
+finished database is never written again: it goes back to a rollback journal,
+which readers use without the -wal and -shm files of the previous database.
+"""
+
+import os
+import sqlite3
+
+import numpy  as np
+import pandas as pd
+
+from player_matrix import cols_GK, cols_nGK
+
+#columns of the players table, besides row and first_row
+Player_Columns  = ['ID', 'Name', 'Age', 'Nationality', 'Overall', 'Potential', 'Club', 'Special',
+                   'Preferred Foot', 'International Reputation', 'Weak Foot', 'Skill Moves', 'Work Rate',
+                   'Body Type', 'Position', 'Jersey Number', 'Height_float', 'Weight_float', 'Value_Number_K',
+                   'Wage_Number_K', 'ReleaseClause_Number_K', 'Contract_Remaining_Month_Number']
+Text_Columns    = ['Name', 'Nationality', 'Club', 'Preferred Foot', 'Work Rate', 'Body Type', 'Position']
+Ability_Columns = cols_nGK + cols_GK
+
+Indexes = [
+    ('players_id',        'players', '"ID"'),
+    ('players_name',      'players', '"Name", row'),
+    ('players_first_row', 'players', 'first_row'),
+    ('players_position',  'players', '"Position", "Overall", first_row'),
+]
+
+#############################################################
+def sqlite_filepath(database_filename):
+    """
+    Return the path of the SQLite copy of a cleaned csv file: cleaned_data.csv -> cleaned_data.sqlite
+    """
+    return os.path.splitext(database_filename)[0] + '.sqlite'
+
+def quote(column):
+    return '"{}"'.format(column.replace('"', '""'))
+
+def position_rating_columns(columns):
+    """
+    Return the position rating columns among the columns of a cleaned dataset
+    """
+    return [column for column in columns if column.endswith('_Final') or column.endswith('_Increment')]
+
+#############################################################
+class SqliteWriter(object):
+    """
+    Write a cleaned dataset to a new SQLite database, one chunk of rows after another
+
+    Parameter:
+    filepath:   destination database, replaced by close()
+    batch_rows: rows per executemany() call
+    """
+    def __init__(self, filepath, batch_rows=50000):
+        self.filepath   = filepath
+        self.tmppath    = filepath + '.tmp'
+        self.batch_rows = batch_rows
+        self.rows       = 0
+        self.ratings    = None
+        for path in (self.tmppath, self.tmppath + '-wal', self.tmppath + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+        # autocommit mode: the transaction is opened and committed explicitly
+        self.connection = sqlite3.connect(self.tmppath, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        # the file only replaces the database once complete, a crash just leaves the .tmp file behind
+        self.connection.execute('PRAGMA synchronous = OFF')
+        self.connection.execute('PRAGMA cache_size = -65536')
+        self.connection.execute('BEGIN')
+
+    def create_tables(self, columns):
+        self.ratings = position_rating_columns(columns)
+        declare = lambda column: '{} {}'.format(quote(column), 'TEXT' if column in Text_Columns else
+                                                'INTEGER NOT NULL' if column == 'ID' else 'REAL')
+        self.connection.execute('CREATE TABLE players (row INTEGER PRIMARY KEY, first_row INTEGER, {})'.format(
+            ', '.join(declare(column) for column in Player_Columns)))
+        self.connection.execute('CREATE TABLE abilities (row INTEGER PRIMARY KEY REFERENCES players (row), {})'.format(
+            ', '.join(declare(column) for column in Ability_Columns)))
+        self.connection.execute('CREATE TABLE position_ratings (row INTEGER PRIMARY KEY REFERENCES players (row){})'
+                                .format(''.join(', ' + declare(column) for column in self.ratings)))
+
+    def insert(self, table, columns, rows, df):
+        """
+        Insert the columns of df into a table, with their row numbers, missing values as NULL
+        """
+        values = [rows.tolist()]
+        for column in columns:
+            array = df[column].to_numpy(dtype=object) if column in df else np.full(len(df), None, dtype=object)
+            values.append(np.where(pd.isnull(array), None, array).tolist())
+        sql = 'INSERT INTO {} VALUES ({})'.format(table, ', '.join(['?'] * len(values)))
+        self.connection.executemany(sql, zip(*values))
+
+    def append(self, df):
+        """
+        Insert the next rows of the cleaned dataset
+        """
+        if self.ratings is None:
+            self.create_tables(df.columns)
+        for start in range(0, len(df), self.batch_rows):
+            chunk = df.iloc[start:start+self.batch_rows]
+            rows  = np.arange(self.rows + start, self.rows + start + len(chunk))
+            # first_row is filled in by close(), once every name is known
+            self.insert('players', [None] + Player_Columns, rows, chunk)
+            self.insert('abilities', Ability_Columns, rows, chunk)
+            self.insert('position_ratings', self.ratings, rows, chunk)
+        self.rows += len(df)
+
+    def close(self):
+        """
+        Build the indexes, commit, and replace the destination database with the new one
+
+        Returns:
+        number of players written
+        """
+        if self.ratings is None:
+            self.create_tables(Player_Columns + Ability_Columns)
+        for name, table, columns in Indexes:
+            if name == 'players_first_row':
+                # the first row of each name, found on the name index
+                self.connection.execute('UPDATE players SET first_row = (SELECT MIN(first.row) FROM players AS first '
+                                        'WHERE first."Name" = players."Name")')
+            self.connection.execute('CREATE {}INDEX {} ON {} ({})'.format('UNIQUE ' if name == 'players_id' else '',
+                                                                          name, table, columns))
+        self.connection.execute('ANALYZE')
+        self.connection.execute('COMMIT')
+        # checkpoints the WAL into the database file and removes it
+        self.connection.execute('PRAGMA journal_mode = DELETE')
+        self.connection.close()
+        os.replace(self.tmppath, self.filepath)
+        return self.rows
+
+def write_sqlite(df, filepath):
+    """
+    Write a cleaned dataset to a SQLite database, see SqliteWriter
+
+    Arguments:
+        df       - cleaned data Pandas DataFrame
+        filepath - destination database
+    Outputs:
+        number of players written
+    """
+    writer = SqliteWriter(filepath)
+    writer.append(df)
+    return writer.close()
@@ -0,0 +1,91 @@
+"""
+Similar-player searches of players sharing a name, for every engine of the web app
+"""
+
+import os
+import sys
+
+import numpy  as np
+import pandas as pd
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(root, 'app'))
+sys.path.append(os.path.join(root, 'data'))
+
+from player_store    import PlayerStore
+from similarity      import SimilarityEngine, NeighbourTableEngine
+from ann_index       import ApproximateSimilarityEngine
+from neighbour_table import build_neighbour_table
+from sqlite_store    import write_sqlite
+from sqlite_backend  import ConnectionPool, SqlitePlayerStore, SqliteSimilarityEngine
+from player_matrix   import cols_GK, cols_nGK
+
+#############################################################
+def build_dataset(players=60, seed=0):
+    # "Twin 0".."Twin 4" are each shared by two players of different positions and quality
+    rng = np.random.RandomState(seed)
+    df  = pd.DataFrame(rng.uniform(20, 90, (players, 12)), columns=cols_nGK + cols_GK)
+    df.insert(0, 'ID', np.arange(1000, 1000 + players))
+    df.insert(1, 'Name', ['Player {}'.format(i) for i in range(players)])
+    df.insert(2, 'Position', rng.choice(['ST', 'LCB', 'GK'], players))
+    df.insert(3, 'Overall', rng.randint(50, 95, players))
+    for i in range(5):
+        df.loc[[i, players - 1 - i], 'Name'] = 'Twin {}'.format(i)
+        df.loc[players - 1 - i, 'Position'] = 'LCB' if df.loc[i, 'Position'] != 'LCB' else 'ST'
+        df.loc[players - 1 - i, 'Overall'] = df.loc[i, 'Overall'] - 30
+    return df
+
+def reference(df, row, n):
+    """
+    The n most similar players of the player at the given row, one candidate per name, as (row, score)
+    """
+    first    = ~df['Name'].duplicated().to_numpy()
+    position = df['Position'].to_numpy()
+    columns  = cols_GK if position[row] == 'GK' else cols_nGK
+    vectors  = df[columns].to_numpy()
+    overall  = df['Overall'].to_numpy()
+    scores   = []
+    for candidate in np.flatnonzero(first & (position == position[row]) & (overall > overall[row]*0.8)):
+        if candidate != row:
+            scores.append((candidate, np.corrcoef(vectors[row], vectors[candidate])[0, 1]))
+    return sorted(scores, key=lambda item: -item[1])[0:n]
+
+def check(engine, df, rows, n=5):
+    for row, similar in zip(rows, engine.most_similar_rows(rows, n)):
+        expected = reference(df, row, n)
+        assert [candidate for _, _, candidate in similar] == [candidate for candidate, _ in expected]
+        assert np.allclose([score for score, _, _ in similar], [score for _, score in expected])
+
+#############################################################
+def test_id_query_of_a_duplicate_name_uses_its_own_player():
+    df    = build_dataset()
+    store = PlayerStore.from_frame(df)
+    twins = [int(store.row_by_id[1000 + len(df) - 1 - i]) for i in range(5)]
+    check(SimilarityEngine(store), df, twins)
+
+    # the second "Twin 0" is not searched like the first one
+    engine = SimilarityEngine(store)
+    first, second = engine.most_similar_rows([0, twins[0]], 5)
+    assert first != second
+
+def test_every_engine_returns_one_candidate_per_name(tmp_path):
+    df    = build_dataset()
+    store = PlayerStore.from_frame(df)
+    rows  = list(range(len(df)))
+    exact = SimilarityEngine(store)
+    check(exact, df, rows)
+
+    check(ApproximateSimilarityEngine(store, list_size=4, n_probe=1000, min_size=0), df, rows)
+    check(NeighbourTableEngine(build_neighbour_table(store.matrix, 5), exact), df, rows)
+
+    write_sqlite(df, str(tmp_path / 'players.sqlite'))
+    sqlite_store = SqlitePlayerStore(ConnectionPool(str(tmp_path / 'players.sqlite')))
+    check(SqliteSimilarityEngine(sqlite_store), df, rows)
+
+def test_approximate_engine_skips_a_bucket_of_constant_abilities():
+    df = build_dataset()
+    df.loc[df['Position'] == 'GK', cols_GK] = 50.0
+    store  = PlayerStore.from_frame(df)
+    engine = ApproximateSimilarityEngine(store, list_size=4, min_size=0)
+    assert 'GK' not in engine.indexes
+    assert engine.most_similar_rows(range(len(df)), 5) == SimilarityEngine(store).most_similar_rows(range(len(df)), 5)
@@ -0,0 +1,58 @@
+"""
+SquadOptimizer on a dataset whose names are not unique
+"""
+
+import os
+import sys
+
+import numpy  as np
+import pandas as pd
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.append(os.path.join(root, 'app'))
+sys.path.append(os.path.join(root, 'data'))
+
+from player_store    import PlayerStore
+from squad_optimizer import SquadOptimizer
+from player_matrix   import cols_GK, cols_nGK
+
+#############################################################
+def build_optimizer():
+    # two "A. Twin": the first an LCB close to the departing player, the second a weak and cheap LCM
+    players = [
+        # ID, Name,         Position, Overall, PAC..PHY,                  cost
+        (1,   'Defender',   'LCB',    70,      [80, 40, 60, 30, 85, 70], 500),
+        (2,   'A. Twin',    'LCB',    60,      [78, 42, 61, 33, 83, 69], 100),
+        (3,   'A. Twin',    'LCM',    40,      [30, 80, 40, 85, 35, 50], 10),
+        (4,   'Other',      'LCB',    65,      [60, 50, 55, 45, 70, 60], 50),
+        (5,   'Midfielder', 'LCM',    45,      [35, 75, 45, 80, 40, 55], 20),
+    ]
+    df = pd.DataFrame([[player_id, name, position, overall] + abilities + [0] * len(cols_GK)
+                       for player_id, name, position, overall, abilities, _ in players],
+                      columns=['ID', 'Name', 'Position', 'Overall'] + cols_nGK + cols_GK)
+    cost = np.array([player[-1] for player in players], dtype=np.float64)
+    return SquadOptimizer(PlayerStore.from_frame(df), cost)
+
+def test_duplicate_name_is_offered_as_its_first_row():
+    squad = build_optimizer().optimize([0], budget=1000)
+    row, score, cost = squad['picks'][0]
+    assert (row, cost) == (1, 100)
+    assert score > 0.9
+
+def test_duplicate_name_does_not_lend_its_score_to_a_cheaper_row():
+    # the second "A. Twin" would fit the budget, but only with the first one's score and Overall
+    squad = build_optimizer().optimize([0], budget=60)
+    row, _, cost = squad['picks'][0]
+    assert (row, cost) == (3, 50)
+
+def test_player_given_twice_is_replaced_once():
+    squad = build_optimizer().optimize([0, 0], budget=150)
+    assert squad['picks'][0] == squad['picks'][1]
+    assert squad['cost'] == 100
+
+def test_departing_player_given_by_row_is_replaced_on_its_own_profile():
+    # the second "A. Twin" is an LCM: replaced by the LCM, not like the first "A. Twin", an LCB
+    squad = build_optimizer().optimize([2], budget=1000)
+    row, score, cost = squad['picks'][0]
+    assert (row, cost) == (4, 20)
+    assert score > 0.9